@@ -7,21 +7,49 @@
  @DateTime: 2024/4/8 下午2:03
  @Docs:  各个app的admin基类
 """
+from django.contrib.admin.utils import unquote
 from django.core.exceptions import PermissionDenied
 from import_export.admin import ImportExportModelAdmin
+from import_export.signals import post_export
 from django.utils.translation import gettext_lazy as _
 
-from assets.models import Assetsmanager
+from utils.audit_archive import object_history
+from utils.paginator import KeysetPaginator
+from utils.streaming_export import STREAMING_EXPORT_FORMATS, streaming_export_response
+from utils.user_scope import get_user_scope
 
 
 class Baseadmin(ImportExportModelAdmin):
     list_per_page = 20  # 每页显示对象的数量
+    # 按部门做数据权限过滤的字段，None 表示该模型不按部门划分(仅超级用户可见数据)
+    scope_field = 'department'
+    # 是否对csv/xlsx使用流式导出(分块查询、逐行写出)，适用于数据量大的模型
+    streaming_export = False
+    # 列表页需要预先关联的外键(含__str__链上用到的)，创建人由基类统一加入
+    list_select_related = []
+    # 搜索使用的n-gram索引名称(见 utils.search_index.SEARCH_INDEXES)，None 表示使用默认的 icontains 搜索
+    search_index = None
+    # 大表列表页：估算/缓存总数、不统计未过滤的总数，顺序翻页时按上一页末行的排序值定位(见 utils.paginator)
+    fast_pagination = False
+    # 历史记录页面显示审计日志(含归档)
+    object_history_template = 'admin/audit_history.html'
+
+    def __init__(self, model, admin_site):
+        super().__init__(model, admin_site)
+        if self.fast_pagination:
+            self.show_full_result_count = False
 
     def creator_full_name(self, obj):
         return f"{obj.creator.last_name}{obj.creator.first_name}" if obj.creator else ''
 
     creator_full_name.short_description = _('创建人')
 
+    def get_list_select_related(self, request):
+        """
+        列表页在同一条查询中关联创建人及子类声明的外键，保证每页的查询条数与行数无关。
+        """
+        return ['creator', *(super().get_list_select_related(request) or [])]
+
     # 将原有的creator从list_display中移除，并替换成creator_full_name
     def get_list_display(self, request, *args, **kwargs):
         list_display = super().get_list_display(request)
@@ -32,6 +60,70 @@ class Baseadmin(ImportExportModelAdmin):
             list_display.append('creator_full_name')
         return list_display
 
+    def export_action(self, request, *args, **kwargs):
+        """
+        导出：开启流式导出时，csv/xlsx 分块读取查询集并逐行写出，其他格式仍使用默认导出。
+        """
+        if not self.streaming_export or request.method != 'POST':
+            return super().export_action(request, *args, **kwargs)
+        if not self.has_export_permission(request):
+            raise PermissionDenied
+
+        formats = self.get_export_formats()
+        form = self.get_export_form_class()(formats, request.POST, resources=self.get_export_resource_classes())
+        if not form.is_valid():
+            return super().export_action(request, *args, **kwargs)
+        file_format = formats[int(form.cleaned_data['file_format'])]()
+        if file_format.get_extension() not in STREAMING_EXPORT_FORMATS:
+            return super().export_action(request, *args, **kwargs)
+
+        queryset = self.get_export_queryset(request)
+        resource = self.choose_export_resource_class(form)(**self.get_export_resource_kwargs(request))
+        response = streaming_export_response(resource, queryset, file_format.get_extension(),
+                                             self.get_export_filename(request, queryset, file_format))
+        post_export.send(sender=None, model=self.model)
+        return response
+
+    def history_view(self, request, object_id, extra_context=None):
+        """
+        历史记录：显示审计日志。先读取日志表，对象有归档日志时显示加载链接，?archive=1 时才读取归档文件。
+        """
+        obj = self.get_object(request, unquote(object_id))
+        if obj is not None:
+            show_archive = request.GET.get('archive') == '1'
+            entries, archived = object_history(obj, show_archive)
+            extra_context = {**(extra_context or {}), 'audit_entries': entries, 'archived_count': archived,
+                             'show_archive': show_archive}
+        return super().history_view(request, object_id, extra_context)
+
+    def get_paginator(self, request, queryset, per_page, orphans=0, allow_empty_first_page=True):
+        if self.fast_pagination:
+            return KeysetPaginator(queryset, per_page, orphans, allow_empty_first_page)
+        return super().get_paginator(request, queryset, per_page, orphans, allow_empty_first_page)
+
+    def get_search_results(self, request, queryset, search_term):
+        """
+        配置了搜索索引时先通过索引表取得候选集，再用默认搜索条件剔除n-gram误命中，
+        未指定排序列时按相关度排序(见 get_ordering)；查询词过短无法使用索引时直接使用默认搜索。
+        """
+        if self.search_index and search_term:
+            from assets.models import SearchToken
+            candidates = SearchToken.search(self.search_index, queryset, search_term, rank='o' not in request.GET)
+            if candidates is not None:
+                queryset = candidates
+                if 'search_score' in queryset.query.annotations:
+                    request._search_ranked_model = self.model
+        return super().get_search_results(request, queryset, search_term)
+
+    def get_ordering(self, request):
+        """
+        按相关度排序的搜索结果以得分为首要排序，否则列表页会把 ordering(如按创建时间)放在得分之前。
+        列表页先调用 get_search_results 再取排序；列表过滤器取关联模型的排序时不受影响。
+        """
+        if getattr(request, '_search_ranked_model', None) is self.model:
+            return ['-search_score', '-pk']
+        return super().get_ordering(request)
+
     def save_model(self, request, obj, form, change):
         """
         保存模型实例。
@@ -41,7 +133,7 @@ class Baseadmin(ImportExportModelAdmin):
         :param change: 布尔值，表示是新增还是修改
         :raises PermissionDenied: 如果用户没有权限，则抛出异常
         """
-        if request.user.is_superuser or self._is_asset_manager_for_department(request.user, obj.department):
+        if get_user_scope(request).can_access(self._get_department_id(obj)):
             obj.creator = request.user
             super().save_model(request, obj, form, change)
         else:
@@ -54,8 +146,7 @@ class Baseadmin(ImportExportModelAdmin):
         :param obj: 要删除的对象
         :raises PermissionDenied: 如果用户没有权限，则抛出异常
         """
-        if request.user.is_superuser or self._is_asset_manager_for_department(request.user,
-                                                                              getattr(obj, 'department', None)):
+        if get_user_scope(request).can_access(self._get_department_id(obj)):
             obj.creator = request.user
             super().delete_model(request, obj)
         else:
@@ -63,14 +154,13 @@ class Baseadmin(ImportExportModelAdmin):
 
     def get_queryset(self, request):
         """
-        获得查询集时的权限过滤。
+        获得查询集时的权限过滤，并关联列表页需要的外键。
+        (模型的默认管理器已带select_related时，列表页不会再应用list_select_related，因此在这里统一关联)
         :param request: HttpRequest对象
         :return: 过滤后的模型查询集
         """
-        qs = super().get_queryset(request)
-        if request.user.is_superuser:
-            return qs
-        return qs.filter(department__assetsmanager__user=request.user)
+        qs = super().get_queryset(request).select_related(*self.get_list_select_related(request))
+        return get_user_scope(request).filter(qs, self.scope_field)
 
     def has_add_permission(self, request):
         """
@@ -78,7 +168,8 @@ class Baseadmin(ImportExportModelAdmin):
         :param request: HttpRequest对象
         :return: 布尔值，具有权限则为True，否则为False
         """
-        return request.user.is_superuser or Assetsmanager.objects.filter(user=request.user).exists()
+        scope = get_user_scope(request)
+        return scope.is_superuser or scope.is_manager
 
     def has_change_permission(self, request, obj=None):
         """
@@ -87,10 +178,11 @@ class Baseadmin(ImportExportModelAdmin):
         :param obj: 要修改的对象，可为空
         :return: 布尔值，具有权限则为True，否则为False
         """
-        if request.user.is_superuser:
+        scope = get_user_scope(request)
+        if scope.is_superuser:
             return True
         if obj is not None and (
-                obj.creator == request.user or self._is_asset_manager_for_department(request.user, obj.department)):
+                obj.creator_id == request.user.pk or scope.can_access(self._get_department_id(obj))):
             return True
         return False
 
@@ -101,19 +193,20 @@ class Baseadmin(ImportExportModelAdmin):
         :param obj: 要删除的对象，可为空
         :return: 布尔值，具有权限则为True，否则为False
         """
-        if request.user.is_superuser:
+        scope = get_user_scope(request)
+        if scope.is_superuser:
             return True
         if obj is not None and (
-                obj.creator == request.user or self._is_asset_manager_for_department(request.user, obj.department)):
+                obj.creator_id == request.user.pk or scope.can_access(self._get_department_id(obj))):
             return True
         return False
 
-    @staticmethod
-    def _is_asset_manager_for_department(user, department):
+    def _get_department_id(self, obj):
         """
-        判断用户是否为指定部门的资产管理员。
-        :param user: 用户对象
-        :param department: 部门对象
-        :return: 布尔值，是资产管理员则为True，否则为False
+        获取对象所属部门的ID，直接读取外键列，不查询部门表。
+        :param obj: 模型对象
+        :return: 部门ID，模型不按部门划分时为None
         """
-        return Assetsmanager.objects.filter(user=user, department=department).exists()
+        if self.scope_field is None:
+            return None
+        return getattr(obj, obj._meta.get_field(self.scope_field).attname, None)
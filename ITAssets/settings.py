@@ -42,6 +42,7 @@ MIDDLEWARE = [
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
     "corsheaders.middleware.CorsMiddleware",  # 跨域请求
     'auditlog.middleware.AuditlogMiddleware',  # 审计日志
+    'utils.audit_buffer.AuditBufferMiddleware',  # 审计日志合并写入
 ]
 
 ROOT_URLCONF = "ITAssets.urls"
@@ -74,7 +75,7 @@ DATABASES = {
         'PORT': os.getenv("DATABASE_PORT"),
         'OPTIONS': {
             'charset': 'utf8mb4',  # 设置字符集, 要确保数据库支持并设置为utf8mb4
-        },
+        } if 'mysql' in os.getenv("DATABASE_ENGINE", "") else {},  # 其他数据库(如基准测试用的SQLite)不支持charset参数
     }
 }
 
@@ -101,6 +102,39 @@ SESSION_EXPIRE_AFTER_LAST_ACTIVITY = True if 'True' == os.getenv(
     "SESSION_EXPIRE_AFTER_LAST_ACTIVITY") else False  # 会话过期时间是否从最后一次活动开始计算
 SESSION_TiMEOUT_REDIRECT_URL = '/login/'  # 会话过期后跳转的URL
 
+# 自定义菜单：即将过保/已过保的资产和备件
+SIMPLEUI_CONFIG['menus'] = [{
+    'name': '过保报表',
+    'icon': 'fas fa-calendar-times',
+    'url': '/assets/warranty_report/',
+}, {
+    'name': '维修分析',
+    'icon': 'fas fa-chart-line',
+    'url': '/repair/analytics/',
+}]
+
+# 用户数据权限范围(管理的部门)跨请求缓存时间(秒)，0表示只在单个请求内缓存；多进程部署开启时需配置共享缓存
+USER_SCOPE_CACHE_TIMEOUT = int(os.getenv("USER_SCOPE_CACHE_TIMEOUT", 0))
+
+# 请求性能采样：记录每个请求的SQL条数、数据库耗时和慢SQL，写入Server-Timing响应头，超级用户可在"请求性能统计"菜单查看分位数
+REQUEST_PROFILER_ENABLED = True if 'True' == os.getenv("REQUEST_PROFILER_ENABLED") else False
+REQUEST_PROFILER_WINDOW = int(os.getenv("REQUEST_PROFILER_WINDOW", 1000))  # 每个URL保留的最近请求数
+REQUEST_PROFILER_SLOW_QUERIES = int(os.getenv("REQUEST_PROFILER_SLOW_QUERIES", 5))  # 每个请求保留的最慢SQL条数
+if REQUEST_PROFILER_ENABLED:
+    MIDDLEWARE.insert(0, 'utils.request_profiler.RequestProfilerMiddleware')
+    SIMPLEUI_CONFIG['menus'].append({
+        'name': '请求性能统计',
+        'icon': 'fas fa-tachometer-alt',
+        'url': '/assets/request_profile/',
+    })
+
+# 扫码查看资产(/a/<资产编号>)的数据缓存时间(秒)，资产修改时自动失效
+ASSET_SCAN_CACHE_TIMEOUT = int(os.getenv("ASSET_SCAN_CACHE_TIMEOUT", 3600))
+
+# 审计日志归档：manage.py auditlog_archive 把超过保留天数的日志按月写入压缩的JSONL文件，历史记录页面按需读取
+AUDITLOG_RETENTION_DAYS = int(os.getenv("AUDITLOG_RETENTION_DAYS", 365))
+AUDITLOG_ARCHIVE_DIR = os.getenv("AUDITLOG_ARCHIVE_DIR", os.path.join(BASE_DIR, 'auditlog_archive'))
+
 LANGUAGE_CODE = os.getenv("LANGUAGE_CODE", "zh-hans")
 
 TIME_ZONE = os.getenv("TIME_ZONE", "Asia/Shanghai")
@@ -6,10 +6,15 @@ from django.contrib import admin
 from django.shortcuts import redirect
 from django.urls import path, include
 
+from assets.views import asset_scan_view
+
 urlpatterns = [
     path("admin/", admin.site.urls),
     path('assets/', include('assets.urls')),
     path('repair/', include('repair.urls')),
+    path('api/v1/', include('assets.api')),  # 只读JSON接口
+    path('api/v1/', include('repair.api')),
+    path('a/<str:sn>', asset_scan_view, name='asset_scan'),  # 资产二维码扫码地址
     path('', lambda request: redirect('/admin/', permanent=False)),
 ]
 
@@ -1,16 +1,18 @@
-from django.contrib import admin
+from django.contrib import admin, messages
 from django.urls import reverse
-from django.utils import timezone
 from django.utils.html import format_html
 from django.utils.translation import gettext_lazy as _
 
 from ITAssets.baseAdmin import Baseadmin
 from assets.models import Bussline, Department, Supplier, Assetsmanager, Assets
+from utils.bulk_edit import bulk_edit
 from utils.resource import AssetsResource
+from utils.warranty import WarrantyListFilter
 
 
 @admin.register(Bussline)
 class BusslineAdmin(Baseadmin):
+    scope_field = None  # 业务线不按部门划分
     # 定义事业线管理界面的展示字段、搜索字段、过滤器和编辑字段
     list_display = ['name', 'create_time', 'update_time', 'remake']
     search_fields = ['name']
@@ -20,8 +22,10 @@ class BusslineAdmin(Baseadmin):
 
 @admin.register(Department)
 class DepartmentAdmin(Baseadmin):
+    scope_field = 'id'  # 资产管理员只能看到自己管理的部门
     # 定义部门管理界面的展示字段、搜索字段、过滤器和编辑字段
     list_display = ['bussline', 'name', 'create_time', 'update_time', 'remake']
+    list_select_related = ['bussline']
     search_fields = ['name']
     list_filter = ['bussline', 'create_time', 'update_time']
     fields = ['bussline', 'name', 'remake']
@@ -29,6 +33,7 @@ class DepartmentAdmin(Baseadmin):
 
 @admin.register(Supplier)
 class SupplierAdmin(Baseadmin):
+    scope_field = None  # 供应商不按部门划分
     # 定义供应商管理界面的展示字段、搜索字段、过滤器和编辑字段
     list_display = ['name', 'contact', 'phone', 'email', 'address', 'is_active', 'create_time',
                     'update_time', 'remake']
@@ -42,7 +47,8 @@ class AssetsmanagerAdmin(Baseadmin):
     # 定义资产管理员管理界面的展示字段、搜索字段、过滤器和编辑字段
     list_display = ['user', 'department', 'phone', 'email', 'employee_id', 'is_active',
                     'create_time', 'update_time', 'remake']
-    search_fields = ['user']
+    list_select_related = ['user', 'department__bussline']
+    search_fields = ['user__username']
     list_filter = ['is_active', 'create_time', 'update_time']
     fields = ['user', 'department', 'phone', 'email', 'employee_id', 'is_active', 'remake']
 
@@ -53,36 +59,50 @@ class AssetsAdmin(Baseadmin):
     资产管理的模型注册类，定义了资产管理界面的展示字段、搜索字段、过滤器、字段分组和批量操作。
     """
     resource_class = AssetsResource
+    streaming_export = True
+    fast_pagination = True
+    skip_admin_log = True  # 批量导入时不逐行写入admin日志
 
     list_display = ['name', 'sn', 'qr_code_preview', 'supplier', 'status', 'repair_count_link', 'is_active',
-                    'create_time', 'update_time']
+                    'warranty_end', 'create_time', 'update_time']
     search_fields = ['name', 'sn', 'asset_location']
+    search_index = 'assets'
     # autocomplete_fields = ['supplier']
     list_editable = ['status', 'is_active']
     list_select_related = ['supplier', 'department']
-    list_filter = ['asset_type', 'supplier', 'bussline', 'department', 'status', 'is_active']
+    list_filter = ['asset_type', 'supplier', 'bussline', 'department', 'status', 'is_active', WarrantyListFilter]
     fieldsets = (
         (_('主要信息'), {
             'fields': ('name', 'sn', 'asset_type', 'bussline', 'department', 'asset_location')
         }),
         (_('采购信息'), {
-            'fields': ('supplier', 'purchase_date', 'expire_date', 'price')
+            'fields': ('supplier', 'purchase_date', 'expire_date', 'warranty_end', 'price')
         }),
         (_('状态信息'), {
             'fields': ('status', 'repair_count', 'is_active', 'remake')
         }),
     )
     actions = ['mark_as_active', 'mark_as_inactive', 'rose_diagram']
-    readonly_fields = ['repair_count']
+    readonly_fields = ['repair_count', 'warranty_end']
     ordering = ['-create_time']
 
+    def add_success_message(self, result, request):
+        """
+        导入完成后的提示信息中附带导入速度。
+        """
+        super().add_success_message(result, request)
+        if getattr(result, 'rows_per_second', None):
+            messages.info(request, _('共导入 {} 行，耗时 {:.2f} 秒，{:.1f} 行/秒').format(
+                result.total_rows, result.elapsed, result.rows_per_second))
+
     def mark_as_active(self, request, queryset):
         """
-        批量将资产标记为启用状态。
+        批量将资产标记为启用状态，已报废的资产不启用。
         :param request: HttpRequest对象
         :param queryset: 被选中的资产对象列表
         """
-        queryset.update(is_active=True, update_time=timezone.now())
+        count = bulk_edit(queryset, is_active=True)
+        self.message_user(request, _('已启用 {} 个资产').format(count))
 
     mark_as_active.short_description = _('标记为启用')
 
@@ -92,7 +112,8 @@ class AssetsAdmin(Baseadmin):
         :param request: HttpRequest对象
         :param queryset: 被选中的资产对象列表
         """
-        queryset.update(is_active=False, update_time=timezone.now())
+        count = bulk_edit(queryset, is_active=False)
+        self.message_user(request, _('已禁用 {} 个资产').format(count))
 
     mark_as_inactive.short_description = _('标记为禁用')
 
@@ -118,9 +139,7 @@ class AssetsAdmin(Baseadmin):
         :param obj: 资产对象
         :return: HTML代码
         """
-        if obj.qr_code:
-            return format_html(f'<img src="{obj.qr_code.url}" width="100" height="100">')
-        return _('二维码未生成')
+        return format_html('<img src="{}" width="100" height="100" loading="lazy">', obj.qr_code_url())
 
     qr_code_preview.short_description = _('二维码预览')
 
@@ -0,0 +1,29 @@
+"""
+-*- coding: utf-8 -*-
+ @Author: li
+ @ProjectName: ITAssets
+ @Email: lijianqiao2906@live.com
+ @FileName: api.py
+ @DateTime: 2024/4/27 上午10:40
+ @Docs: 资产、业务线、部门、供应商的只读JSON接口(/api/v1/)
+"""
+from assets.models import Assets, Bussline, Department, Supplier
+from utils.json_api import ApiResource, api_urlpatterns
+
+urlpatterns = api_urlpatterns([
+    ApiResource('assets', Assets, {
+        'name': 'name', 'sn': 'sn', 'asset_type': 'asset_type', 'asset_location': 'asset_location',
+        'bussline_id': 'bussline_id', 'department_id': 'department_id', 'supplier_id': 'supplier_id',
+        'purchase_date': 'purchase_date', 'expire_date': 'expire_date', 'warranty_end': 'warranty_end',
+        'price': 'price', 'status': 'status', 'repair_count': 'repair_count', 'is_active': 'is_active',
+        'create_time': 'create_time',
+    }),
+    ApiResource('busslines', Bussline, {'name': 'name', 'create_time': 'create_time'}),
+    ApiResource('departments', Department, {
+        'name': 'name', 'bussline_id': 'bussline_id', 'create_time': 'create_time',
+    }),
+    ApiResource('suppliers', Supplier, {
+        'name': 'name', 'contact': 'contact', 'phone': 'phone', 'email': 'email', 'address': 'address',
+        'is_active': 'is_active', 'create_time': 'create_time',
+    }),
+])
@@ -0,0 +1,48 @@
+"""
+-*- coding: utf-8 -*-
+ @Author: li
+ @ProjectName: ITAssets
+ @Email: lijianqiao2906@live.com
+ @FileName: import_assets.py
+ @DateTime: 2024/4/15 上午10:12
+ @Docs: 命令行批量导入资产, 适用于admin页面导入超时的大文件; 文件按块流式读取, 校验在进程池中进行, 内存占用与文件大小无关
+"""
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from utils.chunked_import import IMPORT_CHUNK_SIZE, import_assets
+
+
+class Command(BaseCommand):
+    help = '从xlsx/csv文件批量导入资产, 逐行输出错误, 结束时输出导入速度(行/秒)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='导入文件路径(.xlsx 或 .csv)')
+        parser.add_argument('--dry-run', action='store_true', help='只校验不写入数据库')
+        parser.add_argument('--chunk-size', type=int, default=IMPORT_CHUNK_SIZE, help='每块行数')
+        parser.add_argument('--workers', type=int, default=None, help='校验进程数, 0表示不使用进程池, 默认为CPU数')
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+
+        def progress(result):
+            if options['verbosity'] > 1:
+                self.stdout.write(f"已读取 {result.totals['rows']} 行")
+
+        try:
+            result = import_assets(options['path'], chunk_size=options['chunk_size'], workers=options['workers'],
+                                   dry_run=options['dry_run'], progress=progress)
+        except (OSError, ValueError) as e:
+            raise CommandError(e)
+
+        for line, error in result.errors:
+            self.stderr.write(f"第 {line} 行: {error}")
+
+        totals = result.totals
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f"新增 {totals['new']} 行, 更新 {totals['update']} 行, 跳过 {totals['skip']} 行, "
+            f"错误 {result.error_rows} 行; "
+            f"耗时 {elapsed:.2f} 秒, {totals['rows'] / elapsed if elapsed > 0 else 0:.1f} 行/秒"
+        ))
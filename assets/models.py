@@ -1,17 +1,21 @@
-from _pydatetime import datetime
+from collections import Counter
 
 from auditlog.models import AuditlogHistoryField
 from django.conf import settings
 from django.core.exceptions import ValidationError
-from django.db.models.signals import post_delete
-from django.dispatch import receiver
 from django.contrib.auth.models import User
-from django.core.files import File
-from django.db import models
-
-from auditlog.registry import auditlog
+from django.contrib.contenttypes.models import ContentType
+from django.db import IntegrityError, models, transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.urls import reverse
 from django.utils import timezone
 
+from utils import audit_buffer
+from utils.bulk_edit import bulk_edited
+from utils.qr_code import qr_code_etag
+from utils.warranty import warranty_end
+
 
 class BaseModel(models.Model):
     """模型抽象基类"""
@@ -39,11 +43,20 @@ class Bussline(BaseModel):
         verbose_name_plural = verbose_name
 
 
+class DepartmentManager(models.Manager):
+    """部门的名称显示包含业务线，默认一并查询，避免下拉框/过滤器逐个查询业务线"""
+
+    def get_queryset(self):
+        return super().get_queryset().select_related('bussline')
+
+
 class Department(BaseModel):
     """部门"""
     bussline = models.ForeignKey(Bussline, on_delete=models.CASCADE, verbose_name='业务线')
     name = models.CharField(max_length=32, unique=True, verbose_name='部门名称')
 
+    objects = DepartmentManager()
+
     def __str__(self):
         return f"{self.bussline.name}-{self.name}"
 
@@ -51,6 +64,7 @@ class Department(BaseModel):
         db_table = 'department'
         verbose_name = '部门'
         verbose_name_plural = verbose_name
+        indexes = [models.Index(fields=['update_time', 'id'])]  # 接口按修改时间游标分页
 
 
 class Supplier(BaseModel):
@@ -69,6 +83,7 @@ class Supplier(BaseModel):
         db_table = 'supplier'
         verbose_name = '供应商'
         verbose_name_plural = verbose_name
+        indexes = [models.Index(fields=['update_time', 'id'])]  # 接口按修改时间游标分页
 
 
 class Assetsmanager(BaseModel):
@@ -90,7 +105,7 @@ class Assetsmanager(BaseModel):
 
 
 def department_path(instance, filename):
-    """保存部门二维码路径，在 media/业务线/部门/文件名 下"""
+    """保存部门二维码路径，在 media/业务线/部门/文件名 下(二维码已改为按需渲染，保留此函数供历史迁移文件引用)"""
     return '{0}/{1}/{2}'.format(instance.department.bussline.name, instance.department.name, filename)
 
 
@@ -119,9 +134,9 @@ class Assets(BaseModel):
     supplier = models.ForeignKey(Supplier, on_delete=models.CASCADE, verbose_name='供应商')
     purchase_date = models.DateField(verbose_name='购买日期')
     expire_date = models.PositiveIntegerField(verbose_name='过保期限(月份)')
+    warranty_end = models.DateField(null=True, blank=True, editable=False, verbose_name='过保日期')  # 购买日期+过保期限
     price = models.FloatField(null=True, blank=True, verbose_name='价格')
     status = models.SmallIntegerField(choices=ASSET_STATUS, default=1, verbose_name='资产状态')
-    qr_code = models.ImageField(upload_to=department_path, null=True, blank=True, verbose_name='二维码')
     repair_count = models.PositiveIntegerField(default=0, verbose_name='维修次数')
     is_active = models.BooleanField(default=True, verbose_name='是否启用')
 
@@ -132,15 +147,51 @@ class Assets(BaseModel):
         db_table = 'assets'
         verbose_name = '资产信息'
         verbose_name_plural = verbose_name
+        # 由 manage.py index_advisor 根据列表页的排序、过滤和部门权限范围得出
+        indexes = [
+            models.Index(fields=['create_time']),
+            models.Index(fields=['department', 'status', 'is_active']),
+            models.Index(fields=['update_time', 'id']),  # 接口按修改时间游标分页
+            # 即将过保/已过保：资产管理员按部门范围查询，超级用户只按日期范围查询
+            models.Index(fields=['department', 'warranty_end']),
+            models.Index(fields=['warranty_end']),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # 记录加载时的统计维度，保存时据此增量更新资产统计表
+        instance._loaded_stat_key = (instance.__dict__.get('department_id'), instance.__dict__.get('asset_type'))
+        # 资产名称同时被维修记录的搜索索引使用，改名时需要重建相关维修记录的索引
+        instance._loaded_name = instance.__dict__.get('name')
+        return instance
 
     def save(self, *args, **kwargs):
-        super().save(*args, **kwargs)
-        if not self.qr_code:
-            self.generate_qr_code()
         if self.status == 2:  # 已报废
             self.is_active = False
+        self.warranty_end = self.get_warranty_end()
         super().save(*args, **kwargs)
 
+    def get_warranty_end(self):
+        """
+        过保日期：购买日期加过保期限(月份)。
+        保存前的值可能还是字符串(如 create(purchase_date='2024-01-01'))，先按字段类型转换，与写入数据库时一致。
+        """
+        opts = self._meta
+        return warranty_end(opts.get_field('purchase_date').to_python(self.purchase_date),
+                            opts.get_field('expire_date').to_python(self.expire_date))
+
+    @classmethod
+    def bulk_edit_values(cls, values):
+        """批量修改时执行与 save() 相同的规则：已报废的资产不能启用"""
+        values = dict(values)
+        if values.get('status') == 2:
+            values['is_active'] = False
+        elif values.get('is_active') and 'status' not in values:
+            values['is_active'] = models.Case(models.When(status=2, then=models.Value(False)),
+                                              default=models.Value(True))
+        return values
+
     def clean(self):
         super().clean()  # 调用父级 clean 方法
         if self.purchase_date and self.purchase_date > timezone.now().date():
@@ -148,43 +199,381 @@ class Assets(BaseModel):
         if self.price and self.price < 0:
             raise ValidationError({'price': '采购价格不能小于0'})
 
-    def generate_qr_code(self):
-        """生成资产二维码"""
-        import qrcode
-        import io
-        qr_content = f"{settings.PUBLIC_URL}/admin/assets/assets/{self.pk}/change/"
-
-        qr = qrcode.main.QRCode(
-            version=1,
-            error_correction=qrcode.constants.ERROR_CORRECT_L,
-            box_size=10,
-            border=4,
-        )
-        # 添加内容到二维码
-        qr.add_data(qr_content)
-        qr.make(fit=True)
-        # 将二维码保存为图片
-        img = qr.make_image()
-        img_io = io.BytesIO()
-        img.save(img_io)
-        img_io.seek(0)
-        timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
-        filename = f"{self.name}_{self.sn}_{timestamp}.png"
-        self.qr_code.save(filename, File(img_io), save=False)
+    def qr_code_content(self):
+        """二维码内容：资产的扫码查看地址"""
+        return f"{settings.PUBLIC_URL}{reverse('asset_scan', args=[self.sn])}"
+
+    def qr_code_url(self, fmt='png'):
+        """
+        二维码图片地址，附带内容摘要作为版本参数，内容变化时地址随之变化。
+        :param fmt: 图片格式, png 或 svg
+        """
+        return f"{reverse('assets:qr_code_' + fmt, args=[self.sn])}?v={qr_code_etag(self.qr_code_content(), fmt)}"
 
     def get_asset_type_display(self):
         return dict(self.ASSET_TYPE)[self.asset_type]
 
 
+class DataVersion(models.Model):
+    """数据版本号：相关数据变化时递增，用于缓存和ETag失效"""
+    name = models.CharField(max_length=32, unique=True, verbose_name='名称')
+    version = models.PositiveBigIntegerField(default=0, verbose_name='版本号')
+
+    def __str__(self):
+        return f"{self.name}: {self.version}"
+
+    class Meta:
+        db_table = 'data_version'
+        verbose_name = '数据版本'
+        verbose_name_plural = verbose_name
+
+    @classmethod
+    def bump(cls, name):
+        """
+        递增数据版本号。
+        :param name: 数据名称，如 assets、repair
+        """
+        if cls.objects.filter(name=name).update(version=models.F('version') + 1):
+            return
+        try:
+            with transaction.atomic():
+                cls.objects.create(name=name, version=1)
+        except IntegrityError:
+            cls.objects.filter(name=name).update(version=models.F('version') + 1)
+
+    @classmethod
+    def get(cls, name):
+        """
+        获取数据版本号。
+        :param name: 数据名称，如 assets、repair
+        :return: 版本号，没有记录时为0
+        """
+        return cls.objects.filter(name=name).values_list('version', flat=True).first() or 0
+
+
+def apply_stat_deltas(model, key_fields, deltas, version):
+    """
+    按 {统计维度: 增量} 批量更新统计表：一次读取涉及的统计行，用一条 bulk_update 和一条 bulk_create 写入。
+    只有一个维度时使用 model.bump。
+    :param model: 统计模型(AssetStat、RepairStat)，count 字段为数量
+    :param key_fields: 维度字段名，顺序与 deltas 的键一致
+    :param deltas: {维度值元组: 增量}
+    :param version: 需要递增的数据版本名称
+    """
+    deltas = {key: delta for key, delta in deltas.items() if delta}
+    if len(deltas) <= 1:
+        for key, delta in deltas.items():
+            model.bump(*key, delta)
+        return
+    DataVersion.bump(version)
+    rows, missing, existing, keys = [], [], {}, list(deltas)
+    for i in range(0, len(keys), 300):
+        condition = models.Q()
+        for key in keys[i:i + 300]:
+            condition |= models.Q(**dict(zip(key_fields, key)))
+        existing.update((tuple(getattr(row, field) for field in key_fields), row)
+                        for row in model.objects.filter(condition))
+    for key, delta in deltas.items():
+        row = existing.get(key)
+        if row is not None:
+            row.count = models.F('count') + delta
+            rows.append(row)
+        elif delta > 0:
+            missing.append(model(count=delta, **dict(zip(key_fields, key))))
+    model.objects.bulk_update(rows, ['count'], batch_size=500)
+    try:
+        with transaction.atomic():
+            model.objects.bulk_create(missing)
+    except IntegrityError:
+        # 并发情况下部分统计行已被其他请求创建
+        for row in missing:
+            model.bump(*(getattr(row, field) for field in key_fields), row.count)
+
+
+class AssetStat(models.Model):
+    """资产统计：各部门各资产类型的资产数量，由信号增量维护，供资产信息图使用"""
+    department = models.ForeignKey(Department, on_delete=models.CASCADE, verbose_name='部门')
+    asset_type = models.SmallIntegerField(choices=Assets.ASSET_TYPE, verbose_name='资产类型')
+    count = models.IntegerField(default=0, verbose_name='资产数量')
+
+    def __str__(self):
+        return f"{self.department_id}-{self.asset_type}: {self.count}"
+
+    class Meta:
+        db_table = 'asset_stat'
+        verbose_name = '资产统计'
+        verbose_name_plural = verbose_name
+        unique_together = ('department', 'asset_type')
+
+    @classmethod
+    def bump(cls, department_id, asset_type, delta):
+        """
+        增量更新某个部门某个资产类型的资产数量。
+        :param department_id: 部门ID
+        :param asset_type: 资产类型
+        :param delta: 增量，可以为负数
+        """
+        key = {'department_id': department_id, 'asset_type': asset_type}
+        DataVersion.bump('assets')
+        if cls.objects.filter(**key).update(count=models.F('count') + delta) or delta <= 0:
+            return
+        try:
+            with transaction.atomic():
+                cls.objects.create(count=delta, **key)
+        except IntegrityError:
+            # 并发情况下统计行已被其他请求创建
+            cls.objects.filter(**key).update(count=models.F('count') + delta)
+
+    @classmethod
+    def apply(cls, before, after):
+        """
+        按两次统计快照的差值增量更新。
+        :param before: 变更前的 Counter{(部门ID, 资产类型): 数量}
+        :param after: 变更后的 Counter
+        """
+        apply_stat_deltas(cls, ('department_id', 'asset_type'),
+                          {key: after[key] - before[key] for key in set(before) | set(after)}, 'assets')
+
+    @staticmethod
+    def snapshot(asset_ids, batch_size=1000):
+        """
+        统计指定资产当前对各统计维度的贡献。
+        :param asset_ids: 资产ID列表
+        :return: Counter{(部门ID, 资产类型): 数量}
+        """
+        snapshot = Counter()
+        for i in range(0, len(asset_ids), batch_size):
+            snapshot.update(Assets.objects.filter(pk__in=asset_ids[i:i + batch_size])
+                            .values_list('department_id', 'asset_type'))
+        return snapshot
+
+    @classmethod
+    def rebuild(cls):
+        """根据资产表全量重建统计数据，用于修复统计偏差"""
+        rows = Assets.objects.values('department_id', 'asset_type').annotate(count=models.Count('id'))
+        with transaction.atomic():
+            cls.objects.all().delete()
+            cls.objects.bulk_create([cls(**row) for row in rows])
+            DataVersion.bump('assets')
+
+
+class SearchToken(models.Model):
+    """
+    搜索倒排索引：每个对象的每个n-gram词元一行，由信号在保存/删除时维护，
+    批量写入后运行 manage.py rebuild_search_index 重建。
+    """
+    kind = models.CharField(max_length=16, verbose_name='索引名称')
+    object_id = models.PositiveIntegerField(verbose_name='对象ID')
+    token = models.CharField(max_length=8, verbose_name='词元')
+    weight = models.SmallIntegerField(default=1, verbose_name='权重')
+
+    SEARCH_RANK_LIMIT = 10000  # 候选集不超过该数量时按相关度排序
+
+    def __str__(self):
+        return f"{self.kind}-{self.object_id}: {self.token}"
+
+    class Meta:
+        db_table = 'search_token'
+        verbose_name = '搜索索引'
+        verbose_name_plural = verbose_name
+        unique_together = ('kind', 'object_id', 'token')
+        indexes = [models.Index(fields=['kind', 'token', 'object_id'], name='search_token_lookup')]
+
+    @staticmethod
+    def index_model(kind):
+        from django.apps import apps
+        from utils.search_index import SEARCH_INDEXES
+        model, fields = SEARCH_INDEXES[kind]
+        return apps.get_model(model), fields
+
+    @classmethod
+    def index(cls, kind, object_ids, batch_size=1000):
+        """
+        重建指定对象的索引(先删后写)。
+        :param kind: 索引名称，见 utils.search_index.SEARCH_INDEXES
+        :param object_ids: 对象ID列表
+        :param batch_size: 每批处理的对象数
+        """
+        from utils.search_index import tokenize
+        model, fields = cls.index_model(kind)
+        object_ids = list(object_ids)
+        for i in range(0, len(object_ids), batch_size):
+            chunk = object_ids[i:i + batch_size]
+            tokens = []
+            for pk, *values in model.objects.filter(pk__in=chunk).values_list('pk', *fields):
+                weights = {}
+                for value, weight in zip(values, fields.values()):
+                    for token in tokenize(value):
+                        weights[token] = max(weight, weights.get(token, 0))
+                tokens.extend(cls(kind=kind, object_id=pk, token=token, weight=weight)
+                              for token, weight in weights.items())
+            with transaction.atomic():
+                cls.objects.filter(kind=kind, object_id__in=chunk).delete()
+                cls.objects.bulk_create(tokens, batch_size=batch_size * 10)
+
+    @classmethod
+    def remove(cls, kind, object_ids):
+        cls.objects.filter(kind=kind, object_id__in=list(object_ids)).delete()
+
+    @classmethod
+    def rebuild(cls, kind, batch_size=1000):
+        """按主键分块全量重建一个索引，返回索引的对象数"""
+        model, _ = cls.index_model(kind)
+        cls.objects.filter(kind=kind).delete()
+        last_pk, total = 0, 0
+        while True:
+            chunk = list(model.objects.filter(pk__gt=last_pk).order_by('pk').values_list('pk', flat=True)[:batch_size])
+            if not chunk:
+                return total
+            cls.index(kind, chunk, batch_size)
+            last_pk, total = chunk[-1], total + len(chunk)
+
+    @classmethod
+    def search(cls, kind, queryset, term, rank=True):
+        """
+        用索引过滤查询集：对象需包含查询词的全部词元，得分(search_score)为命中词元的权重之和。
+        先按文档频率最低的词元取候选集，其余词元逐个用唯一索引校验，避免扫描高频词元的全部倒排记录。
+        :param kind: 索引名称
+        :param queryset: 要过滤的查询集
+        :param term: 查询词
+        :param rank: 是否按得分排序；候选集超过 SEARCH_RANK_LIMIT 时不排序(为全部候选计算得分代价过高)
+        :return: 过滤后的查询集，按得分排序时带 search_score 注解；查询词无法使用索引时返回None
+        """
+        from utils.search_index import query_tokens
+        tokens = query_tokens(term)
+        if not tokens:
+            return None
+        postings = cls.objects.filter(kind=kind)
+        frequency = dict(postings.filter(token__in=tokens).values('token')
+                         .annotate(count=models.Count('object_id')).values_list('token', 'count'))
+        if len(frequency) < len(tokens):
+            return queryset.none()
+        rarest, *others = sorted(tokens, key=frequency.get)
+        queryset = queryset.filter(pk__in=postings.filter(token=rarest).values('object_id'))
+        for token in others:
+            queryset = queryset.filter(models.Exists(postings.filter(token=token, object_id=models.OuterRef('pk'))))
+        if rank and frequency[rarest] <= cls.SEARCH_RANK_LIMIT:
+            score = (postings.filter(token__in=tokens, object_id=models.OuterRef('pk')).values('object_id')
+                     .annotate(score=models.Sum('weight')).values('score'))
+            queryset = queryset.annotate(search_score=models.Subquery(score)).order_by('-search_score', '-pk')
+        return queryset
+
+
+class AuditArchive(models.Model):
+    """
+    审计日志归档索引：每个对象在每个月的归档文件中有几条日志，由 manage.py auditlog_archive 维护，
+    查看历史记录时据此判断是否有归档以及需要打开哪几个月的文件。
+    """
+    content_type = models.ForeignKey(ContentType, on_delete=models.CASCADE, verbose_name='对象类型')
+    object_pk = models.CharField(max_length=255, verbose_name='对象主键')
+    month = models.CharField(max_length=7, verbose_name='月份')
+    entries = models.PositiveIntegerField(default=0, verbose_name='日志条数')
+
+    def __str__(self):
+        return f"{self.content_type_id}-{self.object_pk} {self.month}: {self.entries}"
+
+    class Meta:
+        db_table = 'audit_archive'
+        verbose_name = '审计日志归档'
+        verbose_name_plural = verbose_name
+        unique_together = ('content_type', 'object_pk', 'month')
+
+    @classmethod
+    def add(cls, counts):
+        """
+        累加归档条数。
+        :param counts: {(内容类型ID, 对象主键, 月份): 条数}
+        """
+        existing = {(row.content_type_id, row.object_pk, row.month): row for row in cls.objects.filter(
+            content_type_id__in={key[0] for key in counts}, object_pk__in={key[1] for key in counts},
+            month__in={key[2] for key in counts})}
+        updated = []
+        for key, count in counts.items():
+            if key in existing:
+                existing[key].entries += count
+                updated.append(existing[key])
+        cls.objects.bulk_update(updated, ['entries'], batch_size=1000)
+        cls.objects.bulk_create([cls(content_type_id=ct, object_pk=pk, month=month, entries=count)
+                                 for (ct, pk, month), count in counts.items() if (ct, pk, month) not in existing],
+                                batch_size=1000)
+
+
+@receiver(post_save, sender=Assetsmanager)
+@receiver(post_delete, sender=Assetsmanager)
+def invalidate_user_scope(sender, instance, **kwargs):
+    """资产管理员变化时使缓存的用户权限范围失效"""
+    from utils.user_scope import invalidate_user_scopes
+    invalidate_user_scopes()
+
+
+@receiver(post_save, sender=Bussline)
+@receiver(post_save, sender=Department)
+@receiver(post_save, sender=Supplier)
+def invalidate_asset_scans(sender, instance, created, **kwargs):
+    """业务线、部门、供应商名称显示在扫码页面中，修改后使扫码缓存失效"""
+    if not created:
+        from utils.asset_scan import invalidate_all_asset_scans
+        invalidate_all_asset_scans()
+
+
+@receiver(post_save, sender=Department)
+@receiver(post_save, sender=Supplier)
+def bump_chart_version_on_rename(sender, instance, created, **kwargs):
+    """部门、供应商名称会显示在图表中，修改后使图表缓存失效"""
+    if not created:
+        DataVersion.bump('assets')
+        DataVersion.bump('repair')
+
+
+@receiver(post_save, sender=Assets)
+def update_asset_stat_on_save(sender, instance, created, **kwargs):
+    """资产新增或修改部门/类型时增量更新资产统计"""
+    new_key = (instance.department_id, instance.asset_type)
+    if created:
+        AssetStat.bump(*new_key, 1)
+    else:
+        # 未从数据库加载过的实例无法得知原值，统计偏差由 manage.py rebuild_stats 修复
+        old_key = getattr(instance, '_loaded_stat_key', None)
+        if old_key is not None and None not in old_key and old_key != new_key:
+            AssetStat.bump(*old_key, -1)
+            AssetStat.bump(*new_key, 1)
+    instance._loaded_stat_key = new_key
+
+
 @receiver(post_delete, sender=Assets)
-def delete_qr_code(sender, instance, **kwargs):
-    """删除资产时删除本地二维码"""
-    if instance.qr_code:
-        instance.qr_code.delete(save=False)
+def update_asset_stat_on_delete(sender, instance, **kwargs):
+    """删除资产时增量更新资产统计"""
+    AssetStat.bump(instance.department_id, instance.asset_type, -1)
+
 
+@receiver(post_save, sender=Assets)
+def update_asset_search_index(sender, instance, **kwargs):
+    """保存资产时更新资产搜索索引"""
+    SearchToken.index('assets', [instance.pk])
 
-auditlog.register(Bussline)
-auditlog.register(Department)
-auditlog.register(Supplier)
-auditlog.register(Assetsmanager)
-auditlog.register(Assets)
+
+@receiver(post_delete, sender=Assets)
+def remove_asset_search_index(sender, instance, **kwargs):
+    SearchToken.remove('assets', [instance.pk])
+
+
+@receiver(bulk_edited, sender=Assets)
+def update_asset_stat_and_index_on_bulk_edit(sender, old, new, **kwargs):
+    """批量修改资产后增量更新资产统计、搜索索引和过保日期"""
+    AssetStat.apply(Counter((old[obj.pk].department_id, old[obj.pk].asset_type) for obj in new),
+                    Counter((obj.department_id, obj.asset_type) for obj in new))
+    renamed = [obj.pk for obj in new if (old[obj.pk].name, old[obj.pk].sn) != (obj.name, obj.sn)]
+    if renamed:
+        SearchToken.index('assets', renamed)
+    # 修改购买日期或过保期限后重新计算过保日期
+    stale = [obj for obj in new if obj.warranty_end != obj.get_warranty_end()]
+    for obj in stale:
+        obj.warranty_end = obj.get_warranty_end()
+    Assets.objects.bulk_update(stale, ['warranty_end'], batch_size=1000)
+
+
+audit_buffer.register(Bussline)
+audit_buffer.register(Department)
+audit_buffer.register(Supplier)
+audit_buffer.register(Assetsmanager)
+audit_buffer.register(Assets)
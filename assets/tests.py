@@ -1,3 +1,437 @@
-from django.test import TestCase
+import base64
+import csv
+import tempfile
+from datetime import date, datetime
+from io import BytesIO, StringIO
+from unittest import mock
 
-# Create your tests here.
+from auditlog.models import LogEntry
+from auditlog.registry import auditlog
+from django.contrib import admin
+from django.contrib.auth.models import Permission, User
+from django.contrib.contenttypes.models import ContentType
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.paginator import Paginator
+from django.db import transaction
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from openpyxl import Workbook, load_workbook
+
+from assets.models import Assets, Assetsmanager, AssetStat, AuditArchive, Bussline, Department, SearchToken, Supplier
+from repair.models import SparePart, SparePartType
+from utils import audit_buffer
+from utils.audit_archive import change_rows
+from utils.audit_buffer import buffered_audit
+from utils.chunked_import import import_assets
+from utils.paginator import KeysetPaginator
+from utils.resource import AssetsResource
+from utils.search_index import query_tokens, tokenize
+from utils.streaming_export import iter_export_rows, streaming_export_response
+from utils.warranty import add_months, expiring_filter
+
+
+class ChangelistQueryCountMixin:
+    """列表页查询条数与每页行数无关：分别以每页2行和每页全部行打开列表页，查询条数必须一致且等于预算"""
+    rows = 12
+
+    def assertChangelistQueries(self, model, budget):
+        model_admin = admin.site._registry[model]
+        url = reverse(f'admin:{model._meta.app_label}_{model._meta.model_name}_changelist')
+        self.client.get(url)  # 预热ContentType等进程级缓存
+        for per_page in (2, self.rows):
+            with mock.patch.object(model_admin, 'list_per_page', per_page):
+                with self.assertNumQueries(budget):
+                    response = self.client.get(url)
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(len(response.context['cl'].result_list), per_page)
+
+
+def create_fleet(rows):
+    """每行使用不同的业务线、部门、供应商和创建人，任何逐行查询都会体现在查询条数上"""
+    assets = []
+    for i in range(rows):
+        creator = User.objects.create_user(f'user{i}', first_name=f'{i}', last_name='张')
+        bussline = Bussline.objects.create(name=f'业务线{i}', creator=creator)
+        department = Department.objects.create(name=f'部门{i}', bussline=bussline, creator=creator)
+        supplier = Supplier.objects.create(name=f'供应商{i}', creator=creator)
+        Assetsmanager.objects.create(user=creator, department=department, creator=creator)
+        assets.append(Assets.objects.create(
+            name=f'电脑{i}', sn=f'SN{i:04d}', bussline=bussline, department=department, supplier=supplier,
+            purchase_date=date(2024, 1, 1), expire_date=12, creator=creator))
+    return assets
+
+
+class AssetsChangelistQueryTests(ChangelistQueryCountMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.superuser = User.objects.create_superuser('admin', password='password')
+        create_fleet(cls.rows)
+
+    def setUp(self):
+        self.client.force_login(self.superuser)
+
+    def test_bussline_changelist(self):
+        self.assertChangelistQueries(Bussline, 5)
+
+    def test_department_changelist(self):
+        self.assertChangelistQueries(Department, 6)
+
+    def test_supplier_changelist(self):
+        self.assertChangelistQueries(Supplier, 5)
+
+    def test_assetsmanager_changelist(self):
+        self.assertChangelistQueries(Assetsmanager, 5)
+
+    def test_assets_changelist(self):
+        self.assertChangelistQueries(Assets, 8)
+
+
+class SearchIndexTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.assets = create_fleet(3)
+
+    def test_tokenize(self):
+        self.assertEqual(tokenize('联想电脑 SN01'), {'联想', '想电', '电脑', 'sn0', 'n01'})
+        self.assertEqual(query_tokens('电脑'), {'电脑'})
+        self.assertIsNone(query_tokens('电'))  # 单个汉字无法使用索引
+
+    def test_search_follows_save_and_delete(self):
+        asset = self.assets[1]
+        self.assertEqual(list(SearchToken.search('assets', Assets.objects.all(), 'SN0001')), [asset])
+        asset.name = '联想笔记本'
+        asset.save()
+        self.assertEqual(list(SearchToken.search('assets', Assets.objects.all(), '笔记本')), [asset])
+        asset.delete()
+        self.assertFalse(SearchToken.objects.filter(kind='assets', object_id=asset.pk).exists())
+
+    def test_admin_search_is_exact(self):
+        self.client.force_login(User.objects.create_superuser('admin', password='password'))
+        response = self.client.get(reverse('admin:assets_assets_changelist'), {'q': 'SN0002'})
+        self.assertEqual(list(response.context['cl'].result_list), [self.assets[2]])
+        response = self.client.get(reverse('admin:assets_assets_changelist'), {'q': '电脑 0000'})
+        self.assertEqual(list(response.context['cl'].result_list), [self.assets[0]])
+
+    def test_admin_search_ranks_by_score(self):
+        """按相关度排序优先于 AssetsAdmin.ordering(按创建时间倒序)，指定排序列时不按相关度"""
+        named, located = self.assets[0], self.assets[2]
+        named.name = '打印机'
+        named.save()
+        located.asset_location = '打印机旁'
+        located.save()
+        self.client.force_login(User.objects.create_superuser('admin', password='password'))
+        url = reverse('admin:assets_assets_changelist')
+        response = self.client.get(url, {'q': '打印机'})
+        self.assertEqual(list(response.context['cl'].result_list), [named, located])
+        self.assertEqual(response.context['cl'].queryset.query.order_by[0], '-search_score')
+        response = self.client.get(url, {'q': '打印机', 'o': '-1'})
+        self.assertNotIn('search_score', response.context['cl'].queryset.query.annotations)
+
+
+class KeysetPaginatorTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        create_fleet(7)
+
+    def test_pages_match_offset_pagination(self):
+        cache.clear()
+        queryset = Assets.objects.order_by('-create_time', '-pk')
+        keyset, offset = KeysetPaginator(queryset, 3), Paginator(queryset, 3)
+        for number in [1, 2, 3]:  # 顺序翻页按上一页的边界定位
+            self.assertEqual(list(keyset.page(number)), list(offset.page(number)))
+        cache.clear()  # 无边界缓存时跳页按主键OFFSET
+        self.assertEqual(list(keyset.page(3)), list(offset.page(3)))
+
+
+class AuditBufferTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.asset = create_fleet(1)[0]
+
+    def test_saves_are_merged_into_one_insert(self):
+        with buffered_audit() as buffer:
+            with self.captureOnCommitCallbacks(execute=True):
+                self.asset.name = '笔记本'
+                self.asset.save()
+            with self.captureOnCommitCallbacks(execute=True):
+                self.asset.status = 2
+                self.asset.save()
+            self.assertFalse(LogEntry.objects.exists())  # 提交后仍在缓冲中
+            with self.assertNumQueries(1):
+                buffer.flush()
+        entry = LogEntry.objects.get_for_object(self.asset).get()
+        self.assertEqual(entry.action, LogEntry.Action.UPDATE)
+        self.assertEqual(entry.changes_dict['name'], ['电脑0', '笔记本'])
+        self.assertEqual(entry.changes_dict['is_active'], ['True', 'False'])
+
+    def test_rolled_back_and_discarded_changes_are_not_logged(self):
+        with buffered_audit():
+            with self.captureOnCommitCallbacks(execute=True):
+                supplier = Supplier.objects.create(name='临时供应商')
+                supplier.delete()
+            with self.captureOnCommitCallbacks(execute=True), transaction.atomic():
+                self.asset.name = '回滚'
+                self.asset.save()
+                transaction.set_rollback(True)
+        self.assertFalse(LogEntry.objects.exists())
+
+    def test_reused_pk_entries_are_replaced_on_create(self):
+        with buffered_audit() as buffer:
+            with self.captureOnCommitCallbacks(execute=True):
+                supplier = Supplier.objects.create(name='新供应商')
+            # 之前使用该主键的对象(已删除)留下的日志
+            LogEntry.objects.create(content_type=ContentType.objects.get_for_model(Supplier), object_pk=str(supplier.pk),
+                                    object_repr='旧供应商', action=LogEntry.Action.DELETE, changes='{}')
+            buffer.flush()
+        entry = LogEntry.objects.get_for_object(supplier).get()
+        self.assertEqual(entry.action, LogEntry.Action.CREATE)
+        self.assertEqual(entry.object_repr, '新供应商')
+
+    def test_models_are_not_registered_with_auditlog(self):
+        self.assertTrue(audit_buffer.registry.contains(Assets))
+        self.assertFalse(auditlog.contains(Assets))
+        with buffered_audit(), self.captureOnCommitCallbacks(execute=True):
+            self.asset.status = 2
+            self.asset.save()
+        entry = LogEntry.objects.get_for_object(self.asset).get()
+        self.assertIn(('资产状态', '使用中 → 已报废'), change_rows(entry))
+
+
+class AuditArchiveTests(TestCase):
+    def test_archived_entries_are_read_on_demand(self):
+        asset = create_fleet(1)[0]
+        with buffered_audit(), self.captureOnCommitCallbacks(execute=True):
+            asset.name = '笔记本'
+            asset.save()
+        LogEntry.objects.update(timestamp=datetime(2023, 1, 15))
+        self.client.force_login(User.objects.create_superuser('admin', password='password'))
+        url = reverse('admin:assets_assets_history', args=[asset.pk])
+        with tempfile.TemporaryDirectory() as directory, override_settings(AUDITLOG_ARCHIVE_DIR=directory):
+            call_command('auditlog_archive', stdout=StringIO())
+            self.assertFalse(LogEntry.objects.exists())
+            self.assertEqual(AuditArchive.objects.get().month, '2023-01')
+
+            response = self.client.get(url)
+            self.assertEqual((response.context['audit_entries'], response.context['archived_count']), ([], 1))
+            response = self.client.get(url, {'archive': '1'})
+            self.assertIn(('资产名称', '电脑0 → 笔记本'), response.context['audit_entries'][0].change_rows)
+
+
+class JsonApiTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.assets = create_fleet(3)
+        cls.superuser = User.objects.create_superuser('admin', password='password')
+        cls.manager = User.objects.get(username='user0')
+        cls.manager.set_password('password')
+        cls.manager.save()
+        cls.manager.user_permissions.add(Permission.objects.get(codename='view_assets'))
+
+    def test_cursor_pages_and_not_modified(self):
+        self.client.force_login(self.superuser)
+        url = reverse('api_assets')
+        first = self.client.get(url, {'limit': 2, 'fields': 'sn,update_time'})
+        self.assertEqual([row['sn'] for row in first.json()['results']], ['SN0000', 'SN0001'])
+        self.assertEqual(set(first.json()['results'][0]), {'id', 'sn', 'update_time'})
+        second = self.client.get(first.json()['next'])
+        self.assertEqual([row['sn'] for row in second.json()['results']], ['SN0002'])
+        self.assertIsNone(second.json()['next'])
+        with self.assertNumQueries(3):  # 会话、用户、本页的 (ID, 修改时间)
+            response = self.client.get(url, {'limit': 2, 'fields': 'sn,update_time'},
+                                       HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(self.client.get(url, {'fields': 'password'}).status_code, 400)
+
+    def test_basic_auth_and_scope(self):
+        url = reverse('api_assets')
+        self.assertEqual(self.client.get(url).status_code, 401)
+        credentials = base64.b64encode(b'user0:password').decode()
+        response = self.client.get(url, HTTP_AUTHORIZATION=f'Basic {credentials}')
+        self.assertEqual([row['id'] for row in response.json()['results']], [self.assets[0].pk])
+        self.assertEqual(self.client.get(reverse('api_suppliers'), HTTP_AUTHORIZATION=f'Basic {credentials}')
+                         .status_code, 403)
+
+    def test_cached_basic_auth_expires_on_password_change(self):
+        url = reverse('api_assets')
+        credentials = base64.b64encode(b'admin:password').decode()
+        self.assertEqual(self.client.get(url, HTTP_AUTHORIZATION=f'Basic {credentials}').status_code, 200)
+        self.superuser.set_password('changed')
+        self.superuser.save()
+        self.assertEqual(self.client.get(url, HTTP_AUTHORIZATION=f'Basic {credentials}').status_code, 401)
+
+
+class BulkEditTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.assets = create_fleet(3)
+        Assets.objects.filter(pk=cls.assets[0].pk).update(status=2, is_active=False)
+        Assets.objects.update(is_active=False)
+
+    def test_action_applies_scrap_rule_and_logs_changes(self):
+        self.client.force_login(User.objects.create_superuser('admin', password='password'))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('admin:assets_assets_changelist'), {
+                'action': 'mark_as_active', '_selected_action': [asset.pk for asset in self.assets]})
+        self.assertEqual(list(Assets.objects.order_by('pk').values_list('is_active', flat=True)), [False, True, True])
+        entries = LogEntry.objects.filter(action=LogEntry.Action.UPDATE)
+        self.assertEqual(sorted(entries.values_list('object_id', flat=True)), [a.pk for a in self.assets[1:]])
+        self.assertEqual(entries[0].changes_dict['is_active'], ['False', 'True'])
+
+    def test_command_sets_status(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('bulk_edit', 'assets.Assets', '--where', f'department={self.assets[1].department_id}',
+                         '--set', 'status=2', '--set', 'is_active=true', stdout=StringIO())
+        self.assertEqual(Assets.objects.filter(status=2, is_active=True).count(), 0)
+        entry = LogEntry.objects.get_for_object(self.assets[1]).get()
+        self.assertEqual(entry.changes_dict['status'], ['1', '2'])
+
+
+class AssetScanTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.asset = create_fleet(1)[0]
+        cls.superuser = User.objects.create_superuser('admin', password='password')
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.superuser)
+
+    def test_scan_data_is_cached_until_asset_changes(self):
+        url = reverse('asset_scan', args=[self.asset.sn])
+        self.assertEqual(self.client.get(url, {'format': 'json'}).json()['department'], '部门0')
+        with self.assertNumQueries(3):  # 会话、用户、按资产编号查询ID和修改时间
+            self.assertEqual(self.client.get(url, {'format': 'json'}).json()['name'], '电脑0')
+        self.asset.name = '笔记本'
+        self.asset.save()
+        self.asset.department.name = '财务部'
+        self.asset.department.save()
+        data = self.client.get(url, {'format': 'json'}).json()
+        self.assertEqual((data['name'], data['department']), ('笔记本', '财务部'))
+
+    def test_qr_code_points_to_scan_page_and_change_page_is_unchanged(self):
+        self.assertTrue(self.asset.qr_code_content().endswith(f'/a/{self.asset.sn}'))
+        url = reverse('admin:assets_assets_change', args=[self.asset.pk])
+        self.assertEqual(url, f'/admin/assets/assets/{self.asset.pk}/change/')
+        self.assertEqual(self.client.get(url).status_code, 200)
+        scan_page = self.client.get(reverse('asset_scan', args=[self.asset.sn]))
+        self.assertEqual(scan_page.context['change_url'], url)
+
+
+class WarrantyTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.assets = create_fleet(3)
+        cls.today = date.today()
+
+    def test_add_months_clamps_to_month_end(self):
+        self.assertEqual(add_months(date(2024, 1, 31), 1), date(2024, 2, 29))
+        self.assertEqual(add_months(date(2023, 11, 30), 15), date(2025, 2, 28))
+        self.assertEqual(self.assets[0].warranty_end, date(2025, 1, 1))
+
+    def test_string_values_are_converted(self):
+        asset = self.assets[0]
+        created = Assets.objects.create(name='电脑9', sn='SN0009', bussline=asset.bussline, department=asset.department,
+                                        supplier=asset.supplier, purchase_date='2024-01-31', expire_date='1')
+        self.assertEqual(created.warranty_end, date(2024, 2, 29))
+        part = SparePart.objects.create(type=SparePartType.objects.create(name='内存'), name='内存0', sn='RAM0',
+                                        supplier=asset.supplier, warranty='12')
+        self.assertEqual(part.warranty_end, add_months(date.today(), 12))
+
+    def test_filter_and_report_use_stored_warranty_end(self):
+        for asset, months_ago in zip(self.assets, [6, 11, 13]):  # 6个月后、1个月后、1个月前过保
+            asset.purchase_date = add_months(self.today, -months_ago)
+            asset.save()
+        Assets.objects.update(warranty_end=None)
+        call_command('backfill_warranty_end', stdout=StringIO())
+        self.assertEqual(Assets.objects.filter(**expiring_filter(90)).get(), self.assets[1])
+
+        self.client.force_login(User.objects.get(username='user1'))
+        User.objects.filter(username='user1').update(is_staff=True)
+        data = self.client.get(reverse('assets:warranty_report'), {'days': 400, 'format': 'json'}).json()
+        self.assertEqual([row['sn'] for row in data['assets']], ['SN0001'])  # 只有管理的部门
+        self.client.force_login(User.objects.create_superuser('admin', password='password'))
+        response = self.client.get(reverse('admin:assets_assets_changelist'), {'warranty': 'expired'})
+        self.assertEqual(list(response.context['cl'].result_list), [self.assets[2]])
+
+
+class StreamingExportTests(TestCase):
+    def setUp(self):
+        self.sns = [asset.sn for asset in create_fleet(5)]
+        self.headers = [str(header) for header in AssetsResource().get_export_headers()]
+
+    def test_chunked_rows(self):
+        rows = list(iter_export_rows(AssetsResource(), Assets.objects.all(), chunk_size=2))
+        self.assertEqual([row[self.headers.index('资产编号')] for row in rows], self.sns)
+
+    def test_csv(self):
+        response = streaming_export_response(AssetsResource(), Assets.objects.all(), 'csv', 'assets.csv')
+        self.assertTrue(response.streaming)
+        rows = list(csv.reader(b''.join(response.streaming_content).decode('utf-8-sig').splitlines()))
+        self.assertEqual(rows[0], self.headers)
+        self.assertEqual([row[self.headers.index('资产编号')] for row in rows[1:]], self.sns)
+
+    def test_xlsx(self):
+        response = streaming_export_response(AssetsResource(), Assets.objects.all(), 'xlsx', 'assets.xlsx')
+        rows = list(load_workbook(BytesIO(b''.join(response.streaming_content))).active.values)
+        self.assertEqual(list(rows[0]), self.headers)
+        self.assertEqual([row[self.headers.index('资产编号')] for row in rows[1:]], self.sns)
+
+
+class ChunkedImportTests(TestCase):
+    headers = ['业务线', '部门', '供应商', '资产名称', '资产编号', '资产类型', '状态', '是否启用', '购入日期',
+               '过保期限(月份)']
+
+    def setUp(self):
+        self.asset = create_fleet(1)[0]
+        existing = [self.asset.bussline.name, self.asset.department.name, self.asset.supplier.name]
+        rows = [
+            existing + ['笔记本', self.asset.sn, '电脑设备', '已报废', '是', '2024/01/02', 12],
+            existing + ['交换机', 'NEW001', '网络设备', '使用中', '是', datetime(2024, 2, 1), 36],
+            ['新业务线', '新部门', '新供应商', '防火墙', 'NEW002', '安全设备', '未使用', '否', '2024/03/01', '24'],
+            existing + ['打印机', 'BAD001', '打印设备', '使用中', '是', '2024/01/02', 12],
+            existing + ['', 'BAD002', '电脑设备', '使用中', '是', '2024-01-02', -1],
+        ]
+        workbook = Workbook(write_only=True)
+        sheet = workbook.create_sheet()
+        for row in [self.headers, *rows]:
+            sheet.append(row)
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = f'{directory.name}/assets.xlsx'
+        workbook.save(self.path)
+
+    def test_valid_rows_are_imported_and_errors_collected(self):
+        for workers in (0, 1):
+            result = import_assets(self.path, chunk_size=2, workers=workers, dry_run=True)
+            self.assertEqual((result.totals['rows'], result.totals['valid'], result.error_rows), (5, 3, 2))
+        self.assertFalse(Assets.objects.filter(sn__startswith='NEW').exists())
+
+        result = import_assets(self.path, chunk_size=2, workers=0)
+        self.assertEqual((result.totals['new'], result.totals['update']), (2, 1))
+        self.assertEqual([line for line, _ in result.errors], [5, 6, 6, 6])
+        self.assertIn('无效的资产类型: 打印设备', result.errors[0][1])
+
+        self.asset.refresh_from_db()
+        self.assertEqual((self.asset.name, self.asset.status, self.asset.is_active), ('笔记本', 2, False))
+        asset = Assets.objects.select_related('department').get(sn='NEW002')
+        self.assertEqual((asset.asset_type, asset.status, asset.is_active, asset.department.name),
+                         (3, 0, False, '新部门'))
+        self.assertEqual(asset.warranty_end, date(2026, 3, 1))
+        self.assertEqual(AssetStat.objects.filter(department=asset.department).get().count, 1)
+        # 导入按快照差值增量更新的统计与全量重建的结果一致
+        counts = set(AssetStat.objects.filter(count__gt=0).values_list('department', 'asset_type', 'count'))
+        AssetStat.rebuild()
+        self.assertEqual(counts, set(AssetStat.objects.values_list('department', 'asset_type', 'count')))
+
+    def test_imported_rows_are_audited(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            import_assets(self.path, chunk_size=2, workers=0)
+        entry = LogEntry.objects.get_for_object(self.asset).get()
+        self.assertEqual(entry.action, LogEntry.Action.UPDATE)
+        self.assertEqual(entry.changes_dict['name'], ['电脑0', '笔记本'])
+        self.assertEqual(entry.changes_dict['status'], ['1', '2'])
+        created = LogEntry.objects.filter(action=LogEntry.Action.CREATE)
+        self.assertEqual(sorted(created.values_list('object_id', flat=True)),
+                         sorted(Assets.objects.filter(sn__startswith='NEW').values_list('pk', flat=True)))
+        self.assertEqual(created.get(object_repr__contains='防火墙').changes_dict['sn'], ['None', 'NEW002'])
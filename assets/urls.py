@@ -5,7 +5,7 @@
  @Email: lijianqiao2906@live.com
  @FileName: urls.py
  @DateTime: 2024/4/8 上午9:48
- @Docs: 资产路由-生成资产信息玫瑰图
+ @Docs: 资产路由-生成资产信息玫瑰图、资产二维码、过保报表
 """
 
 from django.urls import path
@@ -15,4 +15,9 @@ app_name = 'assets'
 
 urlpatterns = [
     path('asset_chart_view/', views.asset_chart_view, name='asset_chart_view'),
+    path('chart_cache_stats/', views.chart_cache_stats_view, name='chart_cache_stats'),
+    path('request_profile/', views.request_profile_view, name='request_profile'),
+    path('warranty_report/', views.warranty_report_view, name='warranty_report'),
+    path('qr/<str:sn>.png', views.qr_code_view, {'fmt': 'png'}, name='qr_code_png'),
+    path('qr/<str:sn>.svg', views.qr_code_view, {'fmt': 'svg'}, name='qr_code_svg'),
 ]
@@ -1,9 +1,29 @@
-from django.db import models
-from django.http import HttpResponse
+from django.conf import settings
+from django.contrib import admin
+from django.contrib.admin.views.decorators import staff_member_required
+from django.contrib.auth.views import redirect_to_login
+from django.core.exceptions import PermissionDenied
+from django.http import Http404, HttpResponse, JsonResponse
+from django.shortcuts import redirect, render
+from django.urls import reverse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import quote_etag
+from django.views.decorators.http import require_safe
 from pyecharts import options as opts
 
-from assets.models import Assets
-from utils.sunburst_chart import generate_sunburst_chart
+from assets.models import Assets, AssetStat, DataVersion
+from utils.asset_scan import find_asset, get_scan_data
+from utils.qr_code import QR_IMAGE_FORMATS, get_qr_image, qr_code_etag
+from utils.request_profiler import request_profile_stats, reset_request_profile_stats
+from utils.sunburst_chart import cached_chart_response, chart_cache_stats, generate_sunburst_chart
+from utils.user_scope import get_user_scope
+from utils.warranty import WARRANTY_FILTER_DAYS, expiring_filter
+
+WARRANTY_REPORT_LIMIT = 500  # 过保报表每类最多列出的行数
+
+# 带版本参数(?v=内容摘要)的二维码地址内容不会变化，可以长期缓存
+QR_CODE_IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+QR_CODE_MAX_AGE = 24 * 3600
 
 
 def asset_chart_view(request):
@@ -16,34 +36,185 @@ def asset_chart_view(request):
     返回值:
     - HttpResponse对象，包含渲染的旭日图HTML代码。
     """
-    user = request.user
-    if user.is_superuser:
-        # 超级用户，获取所有部门的资产数据
-        assets = Assets.objects.values('department__name', 'asset_type').annotate(count=models.Count('id'))
+    scope = get_user_scope(request)
+    # 从资产统计表读取，统计表由信号增量维护，大小与资产数量无关；资产管理员只获取其管理的部门的资产数据
+    stats = scope.filter(AssetStat.objects.filter(count__gt=0))
+
+    def render():
+        assets = stats.values('department__name', 'asset_type', 'count')
+
+        # 处理资产数据，生成部门和资产类型的统计字典
+        data_dict = {}
+        total_count = 0
+        for asset in assets:
+            asset_type_display = Assets(asset_type=asset['asset_type']).get_asset_type_display()
+            if asset['department__name'] not in data_dict:
+                data_dict[asset['department__name']] = {}
+            data_dict[asset['department__name']][asset_type_display] = asset['count']
+            total_count += asset['count']
+
+        # 将部门和资产类型统计数据转换为旭日图所需的格式
+        data = []
+        for department, asset_types in data_dict.items():
+            children = []
+            for asset_type, count in asset_types.items():
+                children.append(opts.SunburstItem(name=asset_type, value=count))
+            data.append(opts.SunburstItem(name=department, children=children))
+
+        # 创建旭日图对象
+        return generate_sunburst_chart(data, f"资产信息图 (总资产数: {total_count})")
+
+    return cached_chart_response(request, 'asset_chart', scope.cache_key, DataVersion.get('assets'), render)
+
+
+def chart_cache_stats_view(request):
+    """
+    图表缓存命中率和渲染耗时(仅超级用户可见)。
+
+    返回值:
+    - JsonResponse对象，按图表类型统计本进程的缓存命中、未命中、304次数、命中率和平均渲染耗时。
+    """
+    if not request.user.is_superuser:
+        raise PermissionDenied
+    return JsonResponse(chart_cache_stats())
+
+
+def request_profile_view(request):
+    """
+    按URL名称展示请求耗时和数据库耗时的p50/p95/p99(仅超级用户可见)，POST请求清空样本。
+
+    返回值:
+    - HttpResponse对象，统计页面；?format=json 时返回JsonResponse。
+    """
+    if not request.user.is_superuser:
+        raise PermissionDenied
+    if request.method == 'POST':
+        reset_request_profile_stats()
+        return redirect(request.path)
+    stats = request_profile_stats()
+    if request.GET.get('format') == 'json':
+        return JsonResponse({'stats': stats})
+    return render(request, 'assets/request_profile.html', {
+        **admin.site.each_context(request),
+        'stats': stats,
+        'enabled': settings.REQUEST_PROFILER_ENABLED,
+        'window': settings.REQUEST_PROFILER_WINDOW,
+    })
+
+
+@require_safe
+def qr_code_view(request, sn, fmt):
+    """
+    按需渲染资产二维码图片。
+
+    参数:
+    - request: HttpRequest对象，包含客户端请求的信息。
+    - sn: 资产编号。
+    - fmt: 图片格式, png 或 svg。
+
+    返回值:
+    - HttpResponse对象，包含二维码图片；ETag匹配时返回304。
+    """
+    pk = Assets.objects.filter(sn=sn).values_list('pk', flat=True).first()
+    if pk is None:
+        raise Http404('资产不存在')
+    content = Assets(pk=pk, sn=sn).qr_code_content()
+    etag = qr_code_etag(content, fmt)
+
+    response = get_conditional_response(request, etag=quote_etag(etag))
+    if response is None:
+        response = HttpResponse(get_qr_image(content, fmt), content_type=QR_IMAGE_FORMATS[fmt])
+        response['ETag'] = quote_etag(etag)
+    if request.GET.get('v') == etag:
+        patch_cache_control(response, public=True, max_age=QR_CODE_IMMUTABLE_MAX_AGE, immutable=True)
+    else:
+        patch_cache_control(response, public=True, max_age=QR_CODE_MAX_AGE)
+    return response
+
+
+@require_safe
+def asset_scan_view(request, sn):
+    """
+    扫码查看资产：只读的资产信息页面，不加载admin修改页面。
+    按资产编号的唯一索引查询ID和修改时间，其余数据从缓存读取；资产管理员只能查看其管理部门的资产。
+
+    参数:
+    - request: HttpRequest对象，包含客户端请求的信息。
+    - sn: 资产编号。
+
+    返回值:
+    - HttpResponse对象，资产信息页面；?format=json 时返回JsonResponse。
+    """
+    as_json = request.GET.get('format') == 'json'
+    if not request.user.is_authenticated:
+        if as_json:
+            return JsonResponse({'error': '需要登录'}, status=401)
+        return redirect_to_login(request.get_full_path(), reverse('admin:login'))
+    found = find_asset(sn)
+    if found is None:
+        raise Http404('资产不存在')
+    data = get_scan_data(*found)
+    if data is None:
+        raise Http404('资产不存在')
+    if not get_user_scope(request).can_access(data['department_id']):
+        raise PermissionDenied
+    if as_json:
+        response = JsonResponse(data, json_dumps_params={'ensure_ascii': False})
     else:
-        # 资产管理员，只获取其管理的部门的资产数据
-        assets = (Assets.objects.filter(department__assetsmanager__user=user)
-                  .values('department__name', 'asset_type').annotate(count=models.Count('id')))
-
-    # 处理资产数据，生成部门和资产类型的统计字典
-    data_dict = {}
-    total_count = 0
-    for asset in assets:
-        asset_type_display = Assets(asset_type=asset['asset_type']).get_asset_type_display()
-        if asset['department__name'] not in data_dict:
-            data_dict[asset['department__name']] = {}
-        data_dict[asset['department__name']][asset_type_display] = asset['count']
-        total_count += asset['count']
-
-    # 将部门和资产类型统计数据转换为旭日图所需的格式
-    data = []
-    for department, asset_types in data_dict.items():
-        children = []
-        for asset_type, count in asset_types.items():
-            children.append(opts.SunburstItem(name=asset_type, value=count))
-        data.append(opts.SunburstItem(name=department, children=children))
-
-    # 创建旭日图对象
-    chart = generate_sunburst_chart(data, f"资产信息图 (总资产数: {total_count})")
-
-    return HttpResponse(chart)
+        response = render(request, 'assets/asset_scan.html', {
+            'asset': data,
+            'change_url': reverse('admin:assets_assets_change', args=[data['id']]),
+        })
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+
+def _warranty_rows(queryset, days, fields):
+    """过保报表的一类数据：(总数, 按过保日期排序的前 WARRANTY_REPORT_LIMIT 行)，都是 warranty_end 上的范围查询"""
+    queryset = queryset.filter(**expiring_filter(days))
+    rows = list(queryset.order_by('warranty_end', 'pk').values(*fields)[:WARRANTY_REPORT_LIMIT])
+    total = len(rows) if len(rows) < WARRANTY_REPORT_LIMIT else queryset.count()
+    return total, rows
+
+
+@staff_member_required
+def warranty_report_view(request):
+    """
+    即将过保和已过保的资产、备件报表，资产管理员只看到其管理部门的资产(备件仅超级用户可见)。
+
+    参数:
+    - request: HttpRequest对象，?days=N 指定即将过保的天数(默认90)，?expired=1 查看已过保。
+
+    返回值:
+    - HttpResponse对象，报表页面；?format=json 时返回JsonResponse。
+    """
+    from repair.models import SparePart
+    days = request.GET.get('days', '90')
+    days = min(int(days), 3650) if days.isdigit() and int(days) > 0 else 90
+    expired = request.GET.get('expired') == '1'
+    window = None if expired else days
+    scope = get_user_scope(request)
+    asset_total, assets = _warranty_rows(
+        scope.filter(Assets.objects.all()), window,
+        ['id', 'name', 'sn', 'department__name', 'asset_location', 'purchase_date', 'expire_date', 'warranty_end'])
+    part_total, parts = _warranty_rows(
+        scope.filter(SparePart.objects.all(), None), window,
+        ['id', 'name', 'sn', 'type__name', 'supplier__name', 'warranty', 'warranty_end'])
+    if request.GET.get('format') == 'json':
+        return JsonResponse({'days': days, 'expired': expired, 'assets_total': asset_total, 'assets': assets,
+                             'spare_parts_total': part_total, 'spare_parts': parts},
+                            json_dumps_params={'ensure_ascii': False})
+    warranty = 'expired' if expired else str(days)
+    return render(request, 'assets/warranty_report.html', {
+        **admin.site.each_context(request),
+        'days': days,
+        'expired': expired,
+        'choices': WARRANTY_FILTER_DAYS,
+        'limit': WARRANTY_REPORT_LIMIT,
+        'assets': assets,
+        'asset_total': asset_total,
+        'parts': parts,
+        'part_total': part_total,
+        'asset_changelist': f"{reverse('admin:assets_assets_changelist')}?warranty={warranty}",
+        'part_changelist': f"{reverse('admin:repair_sparepart_changelist')}?warranty={warranty}",
+    })
@@ -4,6 +4,7 @@ from django.utils.translation import gettext_lazy as _
 from ITAssets.baseAdmin import Baseadmin
 from assets.models import Assets, Supplier
 from utils.resource import RepairRecordResource
+from utils.warranty import WarrantyListFilter
 from .models import RepairRecord, SparePartType, SparePart
 
 
@@ -12,6 +13,7 @@ class SparePartTypeAdmin(Baseadmin):
     """
     备件类型管理界面的自定义配置。
     """
+    scope_field = None  # 备件类型不按部门划分
     list_display = ['name', 'create_time', 'update_time', 'remake']
     search_fields = ['name']
     list_filter = ['create_time', 'update_time']
@@ -23,9 +25,12 @@ class SparePartAdmin(Baseadmin):
     """
     备件管理界面的自定义配置。
     """
-    list_display = ['type', 'name', 'sn', 'supplier', 'warranty', 'create_time', 'update_time', 'remake']
+    scope_field = None  # 备件不按部门划分
+    list_display = ['type', 'name', 'sn', 'supplier', 'warranty', 'warranty_end', 'create_time', 'update_time',
+                    'remake']
+    list_select_related = ['type', 'supplier']
     search_fields = ['name', 'sn']
-    list_filter = ['type', 'supplier', 'warranty', 'create_time', 'update_time']
+    list_filter = ['type', 'supplier', 'warranty', WarrantyListFilter, 'create_time', 'update_time']
     fields = ['type', 'name', 'sn', 'supplier', 'warranty', 'remake']
 
 
@@ -35,10 +40,15 @@ class RepairRecordAdmin(Baseadmin):
     维修记录管理界面的自定义配置。
     """
     resource_class = RepairRecordResource
+    streaming_export = True
+    fast_pagination = True
+    skip_admin_log = True  # 批量导入时不逐行写入admin日志
 
     list_display = ['repair_number', 'asset', 'department', 'applicant', 'fault_description', 'supplier', 'repair_type',
                     'repair_status', 'repair_start_time', 'get_repair_duration_display']
+    list_select_related = ['asset', 'department__bussline', 'supplier']
     search_fields = ['asset__name', 'fault_description']
+    search_index = 'repair'
     list_filter = ['repair_start_time', 'department', 'supplier', 'repair_type', 'repair_status']
     fieldsets = (
         (_('主要信息'), {
@@ -57,7 +67,7 @@ class RepairRecordAdmin(Baseadmin):
     )
     readonly_fields = ('repair_number', 'get_repair_duration_display')
     filter_horizontal = ('spare_part',)
-    actions = ['department_to_spare', 'supplier_to_spare']
+    actions = ['department_to_spare', 'supplier_to_spare', 'repair_trend']
 
     def department_to_spare(self, request, queryset):
         """
@@ -95,6 +105,24 @@ class RepairRecordAdmin(Baseadmin):
     supplier_to_spare.action_type = 1
     supplier_to_spare.action_url = '/repair/supplier_to_spare/'
 
+    def repair_trend(self, request, queryset):
+        """
+        维修趋势图按钮的动作。
+        :param request:
+        :param queryset:
+        :return:
+        """
+        pass
+
+    repair_trend.short_description = _(' 维修趋势图')
+    repair_trend.icon = "fa-solid fa-chart-line"
+
+    repair_trend.type = 'success'
+
+    repair_trend.style = 'color:black;'
+    repair_trend.action_type = 1
+    repair_trend.action_url = '/repair/repair_trend/'
+
     def formfield_for_foreignkey(self, db_field, request, **kwargs):
         """
         重写外键字段的显示内容 - 不显示已报废的资产和不显示已禁止的供应商。。
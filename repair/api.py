@@ -0,0 +1,25 @@
+"""
+-*- coding: utf-8 -*-
+ @Author: li
+ @ProjectName: ITAssets
+ @Email: lijianqiao2906@live.com
+ @FileName: api.py
+ @DateTime: 2024/4/27 上午10:45
+ @Docs: 维修记录、备件、备件类型的只读JSON接口(/api/v1/)
+"""
+from repair.models import RepairRecord, SparePart, SparePartType
+from utils.json_api import ApiResource, api_urlpatterns
+
+urlpatterns = api_urlpatterns([
+    ApiResource('repair-records', RepairRecord, {
+        'repair_number': 'repair_number', 'asset_id': 'asset_id', 'department_id': 'department_id',
+        'applicant': 'applicant', 'fault_description': 'fault_description', 'supplier_id': 'supplier_id',
+        'repair_type': 'repair_type', 'repair_status': 'repair_status', 'repair_start_time': 'repair_start_time',
+        'repair_duration': 'repair_duration', 'create_time': 'create_time',
+    }, many={'spare_part_ids': 'spare_part'}),
+    ApiResource('spare-parts', SparePart, {
+        'name': 'name', 'sn': 'sn', 'type_id': 'type_id', 'supplier_id': 'supplier_id', 'warranty': 'warranty',
+        'warranty_end': 'warranty_end', 'create_time': 'create_time',
+    }),
+    ApiResource('spare-part-types', SparePartType, {'name': 'name', 'create_time': 'create_time'}),
+])
@@ -0,0 +1,90 @@
+"""
+-*- coding: utf-8 -*-
+ @Author: li
+ @ProjectName: ITAssets
+ @Email: lijianqiao2906@live.com
+ @FileName: auditlog_archive.py
+ @DateTime: 2024/4/26 上午10:30
+ @Docs: 审计日志归档：把超过保留天数的日志按月分块写入压缩的JSONL文件，记录归档索引后从日志表删除；
+        --compact 把同一个月的多个归档文件合并为一个并去掉重复记录
+"""
+from collections import Counter
+from datetime import timedelta
+
+from auditlog.models import LogEntry
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from assets.models import AuditArchive
+from utils.audit_archive import archive_dir, archive_files, entry_to_record, iter_records, write_chunk
+
+
+class Command(BaseCommand):
+    help = '把超过保留天数的审计日志移入按月归档的压缩文件'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=settings.AUDITLOG_RETENTION_DAYS,
+                            help='日志表中保留的天数, 默认 AUDITLOG_RETENTION_DAYS')
+        parser.add_argument('--chunk-size', type=int, default=2000, help='每块读取、写入和删除的日志条数')
+        parser.add_argument('--dry-run', action='store_true', help='只统计需要归档的日志条数')
+        parser.add_argument('--compact', action='store_true', help='归档后合并每个月的多个归档文件')
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(days=options['days'])
+        queryset = LogEntry.objects.filter(timestamp__lt=cutoff)
+        if options['dry_run']:
+            self.stdout.write(f"{cutoff:%Y-%m-%d %H:%M} 之前的日志: {queryset.count()} 条")
+            return
+
+        archive_dir().mkdir(parents=True, exist_ok=True)
+        run = timezone.now().strftime('%Y%m%d%H%M%S')
+        months, total, last_pk = set(), 0, 0
+        while True:
+            chunk = list(queryset.filter(pk__gt=last_pk).select_related('content_type', 'actor')
+                         .order_by('pk')[:options['chunk_size']])
+            if not chunk:
+                break
+            by_month, counts = {}, Counter()
+            for entry in chunk:
+                month = entry.timestamp.strftime('%Y-%m')
+                by_month.setdefault(month, []).append(entry_to_record(entry))
+                counts[(entry.content_type_id, entry.object_pk, month)] += 1
+            # 先写入文件并落盘，再在同一事务中记录索引、删除日志；中断时日志仍在表中，重跑后读取时按ID去重
+            for month, records in by_month.items():
+                write_chunk(archive_dir() / f'logentry-{month}-{run}.jsonl.gz', records)
+            with transaction.atomic():
+                AuditArchive.add(counts)
+                LogEntry.objects.filter(pk__in=[entry.pk for entry in chunk]).delete()
+            months.update(by_month)
+            last_pk, total = chunk[-1].pk, total + len(chunk)
+            self.stdout.write(f"已归档 {total} 条")
+        self.stdout.write(self.style.SUCCESS(f"归档完成: {total} 条, 月份 {', '.join(sorted(months)) or '-'}"))
+
+        if options['compact']:
+            for month in sorted({path.name[9:16] for path in archive_dir().glob('logentry-*.jsonl.gz')}):
+                self.compact(month, run)
+
+    def compact(self, month, run):
+        """把一个月的归档文件合并为一个，去掉重复的日志ID；先写新文件再删除旧文件"""
+        paths = archive_files(month)
+        if len(paths) < 2:
+            return
+        target = archive_dir() / f'logentry-{month}-{run}c.jsonl.gz'
+        seen, chunk, written = set(), [], 0
+        for path in paths:
+            for record in iter_records(path):
+                if record['id'] in seen:
+                    continue
+                seen.add(record['id'])
+                chunk.append(record)
+                if len(chunk) >= 10000:
+                    write_chunk(target, chunk)
+                    written, chunk = written + len(chunk), []
+        if chunk:
+            write_chunk(target, chunk)
+            written += len(chunk)
+        for path in paths:
+            path.unlink()
+        self.stdout.write(f"{month}: 合并 {len(paths)} 个文件, {written} 条")
@@ -0,0 +1,54 @@
+"""
+-*- coding: utf-8 -*-
+ @Author: li
+ @ProjectName: ITAssets
+ @Email: lijianqiao2906@live.com
+ @FileName: backfill_warranty_end.py
+ @DateTime: 2024/4/30 上午10:40
+ @Docs: 回填/校正资产和备件的过保日期(warranty_end)，按主键分块读取计算所需的字段，只写入有变化的行
+"""
+from django.core.management.base import BaseCommand
+from django.db import connections, transaction
+from django.utils import timezone
+
+from assets.models import Assets
+from repair.models import SparePart
+
+
+class Command(BaseCommand):
+    help = '根据购买日期/入库日期和保修月数重新计算过保日期'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=2000, help='每块处理的行数')
+
+    def handle(self, *args, **options):
+        for model, fields in ((Assets, ['purchase_date', 'expire_date']),
+                              (SparePart, ['create_time', 'warranty'])):
+            count = self.backfill(model, fields, options['chunk_size'])
+            self.stdout.write(f"{model._meta.verbose_name}: 更新 {count} 行")
+        self.stdout.write(self.style.SUCCESS('过保日期回填完成'))
+
+    @staticmethod
+    def backfill(model, fields, chunk_size):
+        """
+        只读取主键、计算所需字段和当前值，有变化的行用一条参数化 UPDATE 批量执行(executemany)，同时更新修改时间；
+        bulk_update 会为每行生成 CASE WHEN 分支，在Python中构造表达式的开销远大于数据库执行。
+        """
+        connection = connections[model._base_manager.db]
+        qn = connection.ops.quote_name
+        sql = (f"UPDATE {qn(model._meta.db_table)} SET {qn('warranty_end')} = %s, {qn('update_time')} = %s "
+               f"WHERE {qn(model._meta.pk.column)} = %s")
+        last_pk, total = 0, 0
+        while True:
+            chunk = list(model._base_manager.filter(pk__gt=last_pk).order_by('pk')
+                         .only('pk', 'warranty_end', *fields)[:chunk_size])
+            if not chunk:
+                return total
+            last_pk = chunk[-1].pk
+            now = timezone.now()
+            params = [(value, now, obj.pk) for obj, value in ((obj, obj.get_warranty_end()) for obj in chunk)
+                      if obj.warranty_end != value]
+            if params:
+                with transaction.atomic(using=connection.alias), connection.cursor() as cursor:
+                    cursor.executemany(sql, params)
+            total += len(params)
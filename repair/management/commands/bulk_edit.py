@@ -0,0 +1,80 @@
+"""
+-*- coding: utf-8 -*-
+ @Author: li
+ @ProjectName: ITAssets
+ @Email: lijianqiao2906@live.com
+ @FileName: bulk_edit.py
+ @DateTime: 2024/4/28 上午10:20
+ @Docs: 批量修改数据并记录审计日志，例如：
+        python manage.py bulk_edit assets.Assets --where department=3 --where status=0 --set is_active=false --user admin
+"""
+from auditlog.context import set_actor
+from django.apps import apps
+from django.contrib.auth.models import User
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.core.management.base import BaseCommand, CommandError
+from django.db import models
+
+from utils.bulk_edit import BULK_EDIT_CHUNK_SIZE, bulk_edit
+
+
+def parse_pair(model, value):
+    """解析 字段=值，布尔字段接受 true/false"""
+    name, sep, raw = value.partition('=')
+    if not sep or not name:
+        raise CommandError(f'参数格式应为 字段=值: {value}')
+    try:
+        field = model._meta.get_field(name.split('__')[0])
+    except FieldDoesNotExist:
+        raise CommandError(f'未知字段: {name}') from None
+    if isinstance(field, models.BooleanField):
+        raw = {'true': 'True', 'false': 'False'}.get(raw.lower(), raw)
+    return name, raw
+
+
+class Command(BaseCommand):
+    help = '按条件批量修改数据，执行模型的业务规则并记录审计日志'
+
+    def add_arguments(self, parser):
+        parser.add_argument('model', help='模型，如 assets.Assets')
+        parser.add_argument('--where', action='append', default=[], help='过滤条件 字段=值，可使用查询后缀，可多次指定')
+        parser.add_argument('--set', action='append', default=[], required=True, help='修改 字段=值，可多次指定')
+        parser.add_argument('--user', help='记录为审计日志操作人的用户名')
+        parser.add_argument('--chunk-size', type=int, default=BULK_EDIT_CHUNK_SIZE, help='每块修改的行数')
+        parser.add_argument('--dry-run', action='store_true', help='只统计符合条件的行数')
+
+    def handle(self, *args, **options):
+        try:
+            model = apps.get_model(options['model'])
+        except (LookupError, ValueError) as e:
+            raise CommandError(e)
+        values = dict(self.parse_value(model, *parse_pair(model, item)) for item in options['set'])
+        queryset = model._default_manager.filter(**dict(parse_pair(model, item) for item in options['where']))
+        if options['dry_run']:
+            self.stdout.write(f"符合条件: {queryset.count()} 条")
+            return
+        actor = None
+        if options['user']:
+            actor = User.objects.filter(username=options['user']).first()
+            if actor is None:
+                raise CommandError(f"用户不存在: {options['user']}")
+        with set_actor(actor):
+            count = bulk_edit(queryset, chunk_size=options['chunk_size'], **values)
+        self.stdout.write(self.style.SUCCESS(f"已修改 {count} 条"))
+
+    @staticmethod
+    def parse_value(model, name, raw):
+        """按字段类型转换 --set 的值，外键使用ID，null 表示空值"""
+        try:
+            field = model._meta.get_field(name)
+        except FieldDoesNotExist:
+            raise CommandError(f'未知字段: {name}') from None
+        if not field.concrete or field.many_to_many or field.primary_key or not field.editable or \
+                name in ('create_time', 'update_time'):
+            raise CommandError(f'字段不能批量修改: {name}')
+        if raw == 'null' and field.null:
+            return name, None
+        try:
+            return name, (field.target_field if field.is_relation else field).to_python(raw)
+        except ValidationError as e:
+            raise CommandError(f"{name}: {'; '.join(e.messages)}") from None
@@ -0,0 +1,219 @@
+"""
+-*- coding: utf-8 -*-
+ @Author: li
+ @ProjectName: ITAssets
+ @Email: lijianqiao2906@live.com
+ @FileName: index_advisor.py
+ @DateTime: 2024/4/23 上午10:20
+ @Docs: 索引建议：根据各ModelAdmin的过滤器、排序、搜索字段和部门权限范围构造列表页查询，在当前数据库上执行EXPLAIN并计时，
+        报告全表扫描/临时排序，推荐联合索引(等值列在前，范围列或排序列在后)，可生成对应的迁移文件。
+        搜索只报告耗时和执行计划，不推荐索引：search_fields 的 icontains 是 LIKE '%词%'，B树索引无法使用，
+        需要时应为该admin配置 n-gram 搜索索引(search_index)
+"""
+import re
+import time
+from datetime import timedelta
+
+from django.contrib import admin
+from django.contrib.auth.models import User
+from django.core.exceptions import FieldError
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, models
+from django.db.migrations import AddIndex, Migration
+from django.db.migrations.loader import MigrationLoader
+from django.db.migrations.writer import MigrationWriter
+from django.test import RequestFactory
+
+
+def explain_flags(plan):
+    """
+    从EXPLAIN输出中识别全表扫描和额外排序(不同数据库的输出格式不同)。
+    :return: (是否全表扫描, 是否额外排序)
+    """
+    if connection.vendor == 'sqlite':
+        full_scan = bool(re.search(r'\bSCAN \w+(?! USING)(\s|$)', plan))
+        return full_scan, 'USE TEMP B-TREE FOR ORDER BY' in plan
+    if connection.vendor == 'mysql':
+        return "'ALL'" in plan, 'Using filesort' in plan
+    return 'Seq Scan' in plan, bool(re.search(r'\bSort\b', plan))
+
+
+class Command(BaseCommand):
+    help = '分析admin列表页查询的执行计划, 推荐联合索引并可生成迁移文件'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--app', action='append', help='只分析指定的应用, 可重复, 默认 assets 和 repair')
+        parser.add_argument('--min-ms', type=float, default=20, help='只为耗时超过该值(毫秒)的查询推荐索引')
+        parser.add_argument('--emit-migration', action='store_true', help='为推荐的索引生成迁移文件')
+
+    def handle(self, *args, **options):
+        app_labels = options['app'] or ['assets', 'repair']
+        request = RequestFactory().get('/')
+        request.user = User(is_superuser=True, is_staff=True)
+
+        recommendations = {}
+        for model, model_admin in admin.site._registry.items():
+            if model._meta.app_label not in app_labels:
+                continue
+            existing = self.existing_indexes(model)
+            for label, queryset, columns in self.changelist_queries(model, model_admin, request):
+                elapsed, plan = self.measure(queryset, model_admin.list_per_page)
+                full_scan, sort = explain_flags(plan)
+                covered = not columns or any(index[:len(columns)] == columns for index in existing)
+                advice = ''
+                if columns is None:
+                    advice = 'n-gram搜索索引' if getattr(model_admin, 'search_index', None) else '模糊搜索, 普通索引不可用'
+                elif (full_scan or sort) and columns and not covered and elapsed >= options['min_ms']:
+                    recommendations.setdefault(model, set()).add(tuple(columns))
+                    advice = f"推荐索引 ({', '.join(columns)})"
+                elif covered and columns:
+                    advice = '已有索引'
+                flags = ' '.join(flag for flag, on in (('全表扫描', full_scan), ('额外排序', sort)) if on) or '-'
+                self.stdout.write(f"{model.__name__:<14}{label:<44}{elapsed:>9.1f} ms  {flags:<12}{advice}")
+
+        if not recommendations:
+            self.stdout.write(self.style.SUCCESS('没有需要新增的索引'))
+            return
+        self.stdout.write('\n推荐的索引(请同时加入模型的 Meta.indexes, 否则 makemigrations 会生成删除索引的迁移):')
+        indexes = {}
+        for model, candidates in recommendations.items():
+            # 一个索引的列是另一个索引的前缀时，只保留较长的索引
+            kept = [c for c in candidates if not any(o != c and o[:len(c)] == c for o in candidates)]
+            indexes[model] = [self.make_index(model, columns) for columns in sorted(kept)]
+            for index in indexes[model]:
+                self.stdout.write(f"  {model.__name__}: models.Index(fields={index.fields!r}, name={index.name!r})")
+        if options['emit_migration']:
+            self.write_migrations(indexes)
+
+    def changelist_queries(self, model, model_admin, request):
+        """
+        构造列表页的典型查询：无过滤、按部门权限范围过滤、各过滤器单独使用及与部门范围组合、按搜索字段搜索。
+        :return: (名称, 查询集, 推荐索引列) 的生成器；等值列在前，其后为范围列(如有)或排序列，搜索查询为None
+        """
+        queryset = model_admin.get_queryset(request)
+        ordering = [name for name in (model_admin.get_ordering(request) or []) if name.lstrip('-') != 'pk']
+        order_columns = [model._meta.get_field(name.lstrip('-')).column for name in ordering]
+        queryset = queryset.order_by(*ordering, '-pk')
+
+        scope = []
+        scope_field = getattr(model_admin, 'scope_field', None)
+        if scope_field and model._meta.get_field(scope_field) != model._meta.pk:
+            value = self.sample_value(model, scope_field)
+            if value is not None:
+                scope = [(model._meta.get_field(scope_field).column, {f'{scope_field}__in': [value]})]
+
+        filters = []
+        for list_filter in model_admin.get_list_filter(request):
+            name = list_filter[0] if isinstance(list_filter, (list, tuple)) else list_filter
+            if not isinstance(name, str) or '__' in name:
+                continue
+            field = model._meta.get_field(name)
+            if isinstance(field, (models.DateField, models.DateTimeField)):
+                # 日期过滤器以"过去7天"为例
+                value = model.objects.order_by(f'-{name}').values_list(name, flat=True).first()
+                if value is not None:
+                    filters.append((field.column, {f'{name}__gte': value - timedelta(days=7)}, True))
+            else:
+                value = self.sample_value(model, name)
+                if value is not None:
+                    filters.append((field.column, {name: value}, False))
+
+        yield '无过滤', queryset, order_columns
+        for column, lookup in scope:
+            yield '部门范围', queryset.filter(**lookup), [column, *order_columns]
+        for column, lookup, is_range in filters:
+            yield f'过滤 {column}', queryset.filter(**lookup), [column] if is_range else [column, *order_columns]
+            for scope_column, scope_lookup in scope:
+                if scope_column != column:
+                    columns = [scope_column, column] if is_range else [scope_column, column, *order_columns]
+                    yield f'部门范围+过滤 {column}', queryset.filter(**scope_lookup, **lookup), columns
+        # 部门范围内按状态类字段(布尔、枚举)组合过滤
+        equality = [(column, lookup) for column, lookup, is_range in filters
+                    if not is_range and self.is_flag(model, column)]
+        if scope and len(equality) > 1:
+            lookups = dict(scope[0][1])
+            for _, lookup in equality:
+                lookups.update(lookup)
+            columns = [scope[0][0], *(column for column, _ in equality)]
+            yield f"部门范围+{'+'.join(column for column, _ in equality)}", queryset.filter(**lookups), columns
+        search = self.search_query(model, model_admin, request, queryset)
+        if search is not None:
+            yield search
+
+    @staticmethod
+    def search_query(model, model_admin, request, queryset):
+        """
+        以第一个搜索字段的一个已有值的前几个字符为查询词，按列表页的方式搜索(配置了 search_index 时使用n-gram索引)。
+        :return: (名称, 查询集, None)，没有搜索字段或数据时返回None
+        """
+        search_fields = model_admin.get_search_fields(request)
+        if not search_fields:
+            return None
+        name = search_fields[0].lstrip('^=@')
+        value = next((value for value in model.objects.exclude(**{f'{name}__isnull': True})
+                      .values_list(name, flat=True)[:100] if str(value).strip()), None)
+        if value is None:
+            return None
+        term = str(value)[:4]
+        # 搜索可能在请求上记录相关度排序，使用单独的请求，不影响其他查询的排序
+        search_request = RequestFactory().get('/', {'q': term})
+        search_request.user = request.user
+        label = f"搜索 {','.join(search_fields)}={term!r}"
+        try:
+            queryset, _ = model_admin.get_search_results(search_request, queryset, term)
+        except FieldError as e:
+            raise CommandError(f'{model.__name__} 的 search_fields 无效: {e}') from None
+        return label, queryset, None
+
+    @staticmethod
+    def is_flag(model, column):
+        field = next(f for f in model._meta.concrete_fields if f.column == column)
+        return isinstance(field, models.BooleanField) or (field.choices and not field.is_relation)
+
+    @staticmethod
+    def sample_value(model, name):
+        """取该列最常见的值作为过滤示例，最接近实际使用中返回行数较多的情况"""
+        attname = model._meta.get_field(name).attname
+        return (model.objects.exclude(**{f'{attname}__isnull': True}).values(attname)
+                .annotate(n=models.Count('pk')).order_by('-n').values_list(attname, flat=True).first())
+
+    @staticmethod
+    def measure(queryset, per_page):
+        """按列表页的方式执行计数和取第一页，返回耗时(毫秒)和第一页查询的执行计划"""
+        start = time.perf_counter()
+        queryset.count()
+        list(queryset[:per_page])
+        return (time.perf_counter() - start) * 1000, queryset[:per_page].explain()
+
+    @staticmethod
+    def existing_indexes(model):
+        """模型已有索引的列(含外键、唯一约束自带的索引)"""
+        opts = model._meta
+        indexes = [[opts.get_field(name.lstrip('-')).column for name in index.fields] for index in opts.indexes]
+        indexes += [[opts.get_field(name).column for name in fields] for fields in opts.unique_together]
+        indexes += [[field.column] for field in opts.concrete_fields if field.db_index or field.unique]
+        return indexes
+
+    @staticmethod
+    def make_index(model, columns):
+        fields = [next(f.name for f in model._meta.concrete_fields if f.column == column) for column in columns]
+        index = models.Index(fields=fields)
+        index.set_name_with_model(model)  # 与Django为Meta.indexes自动生成的名称一致
+        return index
+
+    def write_migrations(self, indexes):
+        loader = MigrationLoader(connection)
+        for app_label in sorted({model._meta.app_label for model in indexes}):
+            leaves = loader.graph.leaf_nodes(app_label)
+            if not leaves:
+                raise CommandError(f'{app_label} 还没有迁移, 请先运行 makemigrations')
+            operations = [AddIndex(model._meta.model_name, index)
+                          for model, model_indexes in indexes.items() if model._meta.app_label == app_label
+                          for index in model_indexes]
+            number = int(leaves[0][1].split('_')[0]) + 1 if leaves[0][1][:4].isdigit() else 1
+            migration = type('Migration', (Migration,), {'dependencies': leaves, 'operations': operations})(
+                f'{number:04d}_advised_indexes', app_label)
+            writer = MigrationWriter(migration)
+            with open(writer.path, 'w', encoding='utf-8') as f:
+                f.write(writer.as_string())
+            self.stdout.write(self.style.SUCCESS(f'已生成迁移 {writer.path}'))
@@ -0,0 +1,29 @@
+"""
+-*- coding: utf-8 -*-
+ @Author: li
+ @ProjectName: ITAssets
+ @Email: lijianqiao2906@live.com
+ @FileName: rebuild_search_index.py
+ @DateTime: 2024/4/22 下午2:10
+ @Docs: 全量重建资产和维修记录的搜索索引, 用于批量写入(不触发信号)之后或索引出现偏差时
+"""
+from django.core.management.base import BaseCommand, CommandError
+
+from assets.models import SearchToken
+from utils.search_index import SEARCH_INDEXES
+
+
+class Command(BaseCommand):
+    help = '按主键分块全量重建搜索索引'
+
+    def add_arguments(self, parser):
+        parser.add_argument('kinds', nargs='*', help=f"要重建的索引({', '.join(SEARCH_INDEXES)}), 默认全部")
+
+    def handle(self, *args, **options):
+        unknown = set(options['kinds']) - set(SEARCH_INDEXES)
+        if unknown:
+            raise CommandError(f"未知的索引: {', '.join(unknown)}")
+        for kind in options['kinds'] or SEARCH_INDEXES:
+            total = SearchToken.rebuild(kind)
+            self.stdout.write(f"{kind}: {total} 个对象")
+        self.stdout.write(self.style.SUCCESS('搜索索引重建完成'))
@@ -0,0 +1,26 @@
+"""
+-*- coding: utf-8 -*-
+ @Author: li
+ @ProjectName: ITAssets
+ @Email: lijianqiao2906@live.com
+ @FileName: rebuild_stats.py
+ @DateTime: 2024/4/17 下午3:20
+ @Docs: 全量重建图表统计表(资产统计、维修统计、维修日统计), 用于修复增量维护产生的偏差
+"""
+from django.core.management.base import BaseCommand
+
+from assets.models import AssetStat
+from repair.models import RepairDailyStat, RepairStat
+
+
+class Command(BaseCommand):
+    help = '根据资产表和维修记录表全量重建图表统计数据'
+
+    def handle(self, *args, **options):
+        AssetStat.rebuild()
+        self.stdout.write(f"资产统计: {AssetStat.objects.count()} 行")
+        RepairStat.rebuild()
+        self.stdout.write(f"维修统计: {RepairStat.objects.count()} 行")
+        RepairDailyStat.refresh(full=True)
+        self.stdout.write(f"维修日统计: {RepairDailyStat.objects.count()} 行")
+        self.stdout.write(self.style.SUCCESS('统计数据重建完成'))
@@ -0,0 +1,36 @@
+"""
+-*- coding: utf-8 -*-
+ @Author: li
+ @ProjectName: ITAssets
+ @Email: lijianqiao2906@live.com
+ @FileName: reconcile_repair_counts.py
+ @DateTime: 2024/4/19 上午10:40
+ @Docs: 根据维修记录重新计算所有资产的维修次数
+"""
+from django.core.management.base import BaseCommand
+from django.db import models
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from assets.models import Assets
+from repair.models import RepairRecord
+
+
+class Command(BaseCommand):
+    help = '根据维修记录表重新计算所有资产的维修次数'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='只统计不一致的资产数量，不写入数据库')
+
+    def handle(self, *args, **options):
+        actual = Coalesce(models.Subquery(
+            RepairRecord.objects.filter(asset=models.OuterRef('pk')).order_by().values('asset')
+            .annotate(count=models.Count('id')).values('count')
+        ), 0)
+        mismatched = Assets.objects.annotate(actual=actual).exclude(repair_count=models.F('actual'))
+        count = mismatched.count()
+        self.stdout.write(f"维修次数不一致的资产: {count} 个")
+        if count and not options['dry_run']:
+            # 一条带关联子查询的UPDATE只修正不一致的资产，同时更新修改时间(接口ETag和扫码页面缓存按修改时间失效)
+            mismatched.update(repair_count=models.F('actual'), update_time=timezone.now())
+            self.stdout.write(self.style.SUCCESS('维修次数已重新计算'))
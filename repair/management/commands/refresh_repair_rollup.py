@@ -0,0 +1,27 @@
+"""
+-*- coding: utf-8 -*-
+ @Author: li
+ @ProjectName: ITAssets
+ @Email: lijianqiao2906@live.com
+ @FileName: refresh_repair_rollup.py
+ @DateTime: 2024/5/1 上午9:40
+ @Docs: 增量刷新维修日统计(维修趋势图的数据)，适合定时运行；--full 全量重建
+"""
+import time
+
+from django.core.management.base import BaseCommand
+
+from repair.models import RepairDailyStat
+
+
+class Command(BaseCommand):
+    help = '按维修记录修改时间的高水位增量刷新维修日统计'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true', help='全量重建维修日统计')
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        days = RepairDailyStat.refresh(full=options['full'])
+        self.stdout.write(self.style.SUCCESS(
+            f"重新汇总 {days} 天, 耗时 {time.perf_counter() - start:.2f} 秒"))
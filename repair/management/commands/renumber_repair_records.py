@@ -0,0 +1,81 @@
+"""
+-*- coding: utf-8 -*-
+ @Author: li
+ @ProjectName: ITAssets
+ @Email: lijianqiao2906@live.com
+ @FileName: renumber_repair_records.py
+ @DateTime: 2024/4/18 下午2:30
+ @Docs: 维修单号改为唯一之前，为重复和空的维修单号重新编号；必须在生成并执行 repair_number 唯一约束的迁移之前运行
+"""
+import re
+from datetime import date
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from repair.models import RepairNumberSequence, RepairRecord
+
+REPAIR_NUMBER_RE = re.compile(r'^WX(\d{4})(\d{2})(\d{2})(\d{4,})$')
+
+
+def parse_repair_number(number):
+    """解析 WX<yyyymmdd><nnnn> 格式的维修单号，返回 (日期, 序号)，格式不符时返回 None"""
+    match = REPAIR_NUMBER_RE.match(number or '')
+    if not match:
+        return None
+    try:
+        return date(int(match[1]), int(match[2]), int(match[3])), int(match[4])
+    except ValueError:
+        return None
+
+
+def plan_renumbering(rows):
+    """
+    计算需要重新编号的维修记录。每个单号保留ID最小的记录，其余重复的记录和空单号的记录
+    在原单号的日期(无法解析时为创建日期)当天已有的最大序号之后依次编号。
+    :param rows: [(ID, 维修单号, 创建时间)]，按ID升序
+    :return: ({ID: 新维修单号}, {日期: 当天最大序号})
+    """
+    rows = list(rows)
+    last = {}
+    for _, number, _ in rows:
+        parsed = parse_repair_number(number)
+        if parsed:
+            last[parsed[0]] = max(last.get(parsed[0], 0), parsed[1])
+    seen, plan, touched = set(), {}, {}
+    for pk, number, create_time in rows:
+        if number and number not in seen:
+            seen.add(number)
+            continue
+        parsed = parse_repair_number(number)
+        day = parsed[0] if parsed else create_time.date()
+        last[day] = last.get(day, 0) + 1
+        plan[pk] = RepairNumberSequence.format_number(day, last[day])
+        touched[day] = last[day]
+    return plan, touched
+
+
+class Command(BaseCommand):
+    help = '为重复或空的维修单号重新编号(在添加维修单号唯一约束的迁移之前运行)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='只列出需要重新编号的维修记录，不写入数据库')
+
+    def handle(self, *args, **options):
+        rows = (RepairRecord.objects.order_by('pk').values_list('pk', 'repair_number', 'create_time')
+                .iterator(chunk_size=5000))
+        plan, touched = plan_renumbering(rows)
+        for pk, number in plan.items():
+            self.stdout.write(f"维修记录 {pk}: {number}")
+        self.stdout.write(f"需要重新编号的维修记录: {len(plan)} 条")
+        if not plan or options['dry_run']:
+            return
+
+        with transaction.atomic():
+            RepairRecord.objects.bulk_update([RepairRecord(pk=pk, repair_number=number) for pk, number in plan.items()],
+                                             ['repair_number'], batch_size=500)
+            # 已有单号计数器时，计数器不能落后于新分配的单号
+            if RepairNumberSequence._meta.db_table in connection.introspection.table_names():
+                for day, number in touched.items():
+                    RepairNumberSequence.objects.filter(day=day, last_number__lt=number).update(last_number=number)
+        self.stdout.write(self.style.SUCCESS('重新编号完成，现在可以运行 makemigrations/migrate'))
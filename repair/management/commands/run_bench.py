@@ -0,0 +1,219 @@
+"""
+-*- coding: utf-8 -*-
+ @Author: li
+ @ProjectName: ITAssets
+ @Email: lijianqiao2906@live.com
+ @FileName: run_bench.py
+ @DateTime: 2024/4/20 上午11:05
+ @Docs: 基准测试：对关键路径(列表页、搜索、导入导出、图表、保存维修记录)计时并统计SQL条数, 输出JSON便于跨提交对比
+"""
+import json
+import platform
+import statistics
+import subprocess
+import time
+from datetime import datetime
+
+import django
+import tablib
+from django.contrib import admin
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import reverse
+from import_export.formats.base_formats import XLSX
+
+from assets.models import Assets, Department, Supplier
+from repair.models import RepairRecord, SparePart
+from utils.resource import AssetsResource
+
+
+class Command(BaseCommand):
+    help = '运行基准测试(需先用 seed_bench 生成数据), 结果输出为JSON, 可用 --compare 与之前的结果对比'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=5, help='每项测试的重复次数, 取中位数')
+        parser.add_argument('--import-rows', type=int, default=1000, help='xlsx导入测试的行数')
+        parser.add_argument('--saves', type=int, default=20, help='RepairRecord.save 测试的保存次数')
+        parser.add_argument('--only', nargs='*', help='只运行名称包含这些关键字的测试')
+        parser.add_argument('--output', help='结果JSON文件路径, 默认输出到标准输出')
+        parser.add_argument('--compare', help='与之前的结果JSON对比')
+
+    def handle(self, *args, **options):
+        admin_user = User.objects.filter(username='bench_admin').first()
+        manager_user = User.objects.filter(username='bench_manager').first()
+        if not admin_user or not Assets.objects.exists():
+            raise CommandError('没有基准数据, 请先运行 manage.py seed_bench')
+
+        self.repeat = options['repeat']
+        self.only = options['only']
+        self.results = {}
+        with override_settings(ALLOWED_HOSTS=['*']):
+            self.client = Client()
+            self.client.force_login(admin_user)
+            self.run_http_benches(manager_user)
+            self.bench('import_assets_xlsx', lambda: self.import_assets(options['import_rows']), rollback=True)
+            self.bench('repair_record_save', lambda: self.save_repair_records(options['saves']), rollback=True)
+
+        report = {'meta': self.meta(options), 'results': self.results}
+        output = json.dumps(report, ensure_ascii=False, indent=2)
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as f:
+                f.write(output)
+            self.stdout.write(self.style.SUCCESS(f"结果已写入 {options['output']}"))
+        else:
+            self.stdout.write(output)
+        if options['compare']:
+            self.compare(options['compare'])
+
+    def run_http_benches(self, manager_user):
+        assets_changelist = reverse('admin:assets_assets_changelist')
+        repair_changelist = reverse('admin:repair_repairrecord_changelist')
+        sample = Assets.objects.order_by('pk').values_list('name', 'sn')[Assets.objects.count() // 2]
+
+        self.bench('assets_changelist', lambda: self.get(assets_changelist))
+        self.bench('assets_changelist_page_100', lambda: self.get(assets_changelist, {'p': 100}))
+        self.bench('assets_search_sn', lambda: self.get(assets_changelist, {'q': sample[1]}))
+        self.bench('repair_changelist', lambda: self.get(repair_changelist))
+        self.bench('repair_search_asset_name', lambda: self.get(repair_changelist, {'q': sample[0]}))
+        if manager_user:
+            manager_client = Client()
+            manager_client.force_login(manager_user)
+            self.bench('assets_changelist_manager', lambda: self.get(assets_changelist, client=manager_client))
+            self.bench('repair_changelist_manager', lambda: self.get(repair_changelist, client=manager_client))
+
+        xlsx = self.export_format_index(Assets, 'xlsx')
+        self.bench('assets_export_xlsx', lambda: self.post(reverse('admin:assets_assets_export'), {'file_format': xlsx}))
+        xlsx = self.export_format_index(RepairRecord, 'xlsx')
+        self.bench('repair_export_xlsx',
+                   lambda: self.post(reverse('admin:repair_repairrecord_export'), {'file_format': xlsx}))
+
+        for name in ['assets:asset_chart_view', 'repair:department_to_spare', 'repair:supplier_to_spare']:
+            url = reverse(name)
+            key = name.split(':')[1]
+            # 冷：清空图表缓存后渲染；热：命中缓存
+            self.bench(f'chart_{key}_cold', lambda: self.get(url), setup=cache.clear)
+            self.bench(f'chart_{key}_warm', lambda: self.get(url))
+
+    def bench(self, name, func, setup=None, rollback=False):
+        """
+        重复执行测试函数, 记录每次耗时(毫秒)与最后一次的SQL条数。
+        :param name: 测试名称
+        :param func: 测试函数, 返回HTTP状态码或None
+        :param setup: 每次执行前调用(不计时)
+        :param rollback: 是否在事务中执行并回滚, 用于会写库的测试
+        """
+        if self.only and not any(keyword in name for keyword in self.only):
+            return
+        timings, queries, status = [], 0, None
+        for _ in range(self.repeat):
+            if setup:
+                setup()
+            with transaction.atomic():
+                with CaptureQueriesContext(connection) as captured:
+                    start = time.perf_counter()
+                    status = func()
+                    timings.append((time.perf_counter() - start) * 1000)
+                queries = len(captured.captured_queries)
+                if rollback:
+                    transaction.set_rollback(True)
+        self.results[name] = {
+            'median_ms': round(statistics.median(timings), 2),
+            'min_ms': round(min(timings), 2),
+            'max_ms': round(max(timings), 2),
+            'queries': queries,
+            'status': status,
+        }
+        self.stderr.write(f"{name}: {self.results[name]['median_ms']} ms, {queries} 条SQL")
+
+    def get(self, url, data=None, client=None):
+        response = (client or self.client).get(url, data)
+        self.consume(response)
+        return response.status_code
+
+    def post(self, url, data):
+        response = self.client.post(url, data)
+        self.consume(response)
+        return response.status_code
+
+    @staticmethod
+    def consume(response):
+        """读完流式响应的内容, 计入生成文件的耗时"""
+        if response.streaming:
+            for _ in response.streaming_content:
+                pass
+        else:
+            response.content
+
+    @staticmethod
+    def export_format_index(model, extension):
+        formats = admin.site._registry[model].get_export_formats()
+        return [f().get_extension() for f in formats].index(extension)
+
+    def import_assets(self, rows):
+        """生成xlsx文件并通过 AssetsResource 导入(解析+校验+写库), 在事务中执行后回滚"""
+        department = Department.objects.select_related('bussline').order_by('pk').first()
+        supplier = Supplier.objects.order_by('pk').first()
+        dataset = tablib.Dataset(headers=['业务线', '部门', '供应商', '资产名称', '资产编号', '资产类型', '状态',
+                                          '是否启用', '购入日期', '过保期限(月份)', '价格'])
+        for i in range(rows):
+            dataset.append([department.bussline.name, department.name, supplier.name, f'导入测试资产{i}',
+                            f'BENCHIMP{i:06d}', Assets.ASSET_TYPE[4][1], Assets.ASSET_STATUS[0][1], '是',
+                            '2024/01/02', 36, 1000])
+        content = XLSX().export_data(dataset)
+        result = AssetsResource().import_data(XLSX().create_dataset(content), raise_errors=True)
+        return 200 if not result.has_validation_errors() else 400
+
+    @staticmethod
+    def save_repair_records(count):
+        """逐条保存新维修记录(含单号分配、统计维护、维修次数更新), 在事务中执行后回滚"""
+        assets = list(Assets.objects.order_by('pk')[:count])
+        part = SparePart.objects.order_by('pk').first()
+        for asset in assets:
+            record = RepairRecord(asset=asset, department_id=asset.department_id, applicant='基准测试',
+                                  fault_description='基准测试', supplier_id=asset.supplier_id)
+            record.save()
+            if part:
+                record.spare_part.add(part)
+
+    def meta(self, options):
+        try:
+            commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                    check=True).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            commit = None
+        return {
+            'commit': commit,
+            'time': datetime.now().isoformat(timespec='seconds'),
+            'database': connection.vendor,
+            'django': django.get_version(),
+            'python': platform.python_version(),
+            'repeat': self.repeat,
+            'import_rows': options['import_rows'],
+            'saves': options['saves'],
+            'counts': {
+                'assets': Assets.objects.count(),
+                'repair_records': RepairRecord.objects.count(),
+                'departments': Department.objects.count(),
+                'spare_parts': SparePart.objects.count(),
+            },
+        }
+
+    def compare(self, path):
+        """输出与之前结果的对比: 中位耗时变化百分比与SQL条数变化"""
+        with open(path, encoding='utf-8') as f:
+            baseline = json.load(f)
+        self.stderr.write(f"\n对比 {baseline['meta'].get('commit')} -> 当前")
+        self.stderr.write(f"{'测试':<36}{'之前(ms)':>12}{'当前(ms)':>12}{'变化':>10}{'SQL':>14}")
+        for name, current in self.results.items():
+            before = baseline['results'].get(name)
+            if not before:
+                self.stderr.write(f"{name:<36}{'-':>12}{current['median_ms']:>12}{'新增':>10}")
+                continue
+            change = (current['median_ms'] - before['median_ms']) / before['median_ms'] * 100 \
+                if before['median_ms'] else 0
+            self.stderr.write(f"{name:<36}{before['median_ms']:>12}{current['median_ms']:>12}{change:>+9.1f}%"
+                              f"{before['queries']:>7} -> {current['queries']}")
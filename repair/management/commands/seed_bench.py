@@ -0,0 +1,160 @@
+"""
+-*- coding: utf-8 -*-
+ @Author: li
+ @ProjectName: ITAssets
+ @Email: lijianqiao2906@live.com
+ @FileName: seed_bench.py
+ @DateTime: 2024/4/20 上午9:30
+ @Docs: 生成基准测试用的合成数据(业务线、部门、资产、维修记录、备件), 数量可配置, 随机种子固定可复现
+"""
+import random
+from collections import Counter
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta
+
+from django.contrib.auth.models import Permission, User
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from assets.models import AssetStat, Assets, Assetsmanager, Bussline, Department, Supplier
+from repair.models import RepairNumberSequence, RepairRecord, RepairStat, SparePart, SparePartType
+
+BENCH_PASSWORD = 'bench-password'
+
+
+@contextmanager
+def explicit_start_time():
+    """批量写入时保留指定的维修开始时间(该字段为auto_now_add, 默认会被覆盖为当前时间)"""
+    field = RepairRecord._meta.get_field('repair_start_time')
+    field.auto_now_add = False
+    try:
+        yield
+    finally:
+        field.auto_now_add = True
+
+
+class Command(BaseCommand):
+    help = '向空数据库写入基准测试用的合成数据, 配合 run_bench 使用'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--busslines', type=int, default=100, help='业务线数量')
+        parser.add_argument('--departments', type=int, default=2000, help='部门数量')
+        parser.add_argument('--suppliers', type=int, default=200, help='供应商数量')
+        parser.add_argument('--assets', type=int, default=200000, help='资产数量')
+        parser.add_argument('--repairs', type=int, default=1000000, help='维修记录数量')
+        parser.add_argument('--spare-part-types', type=int, default=50, help='备件类型数量')
+        parser.add_argument('--spare-parts', type=int, default=5000, help='备件数量')
+        parser.add_argument('--days', type=int, default=3 * 365, help='维修记录分布的天数(截至今天)')
+        parser.add_argument('--batch-size', type=int, default=5000, help='每批写入的行数')
+        parser.add_argument('--seed', type=int, default=42, help='随机种子')
+
+    def handle(self, *args, **options):
+        if Bussline.objects.exists() or Assets.objects.exists() or RepairRecord.objects.exists():
+            raise CommandError('数据库中已有业务数据, 请使用空数据库(如单独的SQLite文件)生成基准数据')
+
+        self.rnd = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+
+        busslines = self.bulk(Bussline, [Bussline(name=f'业务线{i:04d}') for i in range(options['busslines'])])
+        departments = self.bulk(Department, [
+            Department(name=f'部门{i:05d}', bussline=busslines[i % len(busslines)])
+            for i in range(options['departments'])
+        ])
+        suppliers = self.bulk(Supplier, [Supplier(name=f'供应商{i:04d}') for i in range(options['suppliers'])])
+        types = self.bulk(SparePartType, [
+            SparePartType(name=f'备件类型{i:03d}') for i in range(options['spare_part_types'])
+        ])
+        parts = self.bulk(SparePart, [
+            SparePart(name=f'备件{i:05d}', sn=f'BP{i:08d}', type=self.rnd.choice(types),
+                      supplier=self.rnd.choice(suppliers), warranty=self.rnd.choice([12, 24, 36]))
+            for i in range(options['spare_parts'])
+        ])
+        asset_departments = self.seed_assets(options['assets'], departments, suppliers)
+        self.seed_repairs(options['repairs'], options['days'], asset_departments, suppliers, parts)
+        self.seed_users(departments[0])
+
+        self.stdout.write('重建统计数据...')
+        AssetStat.rebuild()
+        RepairStat.rebuild()
+        call_command('reconcile_repair_counts', stdout=self.stdout)
+        call_command('rebuild_search_index', stdout=self.stdout)
+        self.stdout.write(self.style.SUCCESS('基准数据生成完成'))
+
+    def bulk(self, model, objs):
+        """分批写入并返回带主键的对象(按名称回查, 兼容bulk_create不回填主键的MySQL)"""
+        model.objects.bulk_create(objs, batch_size=self.batch_size)
+        self.stdout.write(f"{model._meta.verbose_name}: {len(objs)}")
+        return list(model.objects.order_by('pk'))
+
+    def seed_assets(self, count, departments, suppliers):
+        """写入资产, 返回按资产ID索引的部门ID(资产ID连续分配)"""
+        start = (Assets.objects.order_by('-pk').values_list('pk', flat=True).first() or 0) + 1
+        asset_departments = {}
+        today = date.today()
+        for offset in range(0, count, self.batch_size):
+            batch = []
+            for i in range(offset, min(offset + self.batch_size, count)):
+                department = self.rnd.choice(departments)
+                status = self.rnd.choices([0, 1, 2], weights=[10, 82, 8])[0]  # Assets.ASSET_STATUS: 未使用/使用中/已报废
+                batch.append(Assets(
+                    id=start + i, name=f'资产{i:08d}', sn=f'BENCH{i:08d}',
+                    asset_type=self.rnd.choice(Assets.ASSET_TYPE)[0],
+                    asset_location=f'{self.rnd.randint(1, 30)}楼', bussline_id=department.bussline_id,
+                    department=department, supplier=self.rnd.choice(suppliers),
+                    purchase_date=today - timedelta(days=self.rnd.randint(0, 6 * 365)),
+                    expire_date=self.rnd.choice([12, 24, 36, 60]), price=round(self.rnd.uniform(500, 20000), 2),
+                    status=status, is_active=status != 2,
+                ))
+                asset_departments[start + i] = department.pk
+            Assets.objects.bulk_create(batch)
+            self.stdout.write(f"资产: {offset + len(batch)}/{count}")
+        return asset_departments
+
+    def seed_repairs(self, count, days, asset_departments, suppliers, parts):
+        """写入维修记录及其备件关联, 维修单号按天从序列中整段分配"""
+        asset_ids = list(asset_departments)
+        supplier_ids = [supplier.pk for supplier in suppliers]
+        part_ids = [part.pk for part in parts]
+        through = RepairRecord.spare_part.through
+        start = (RepairRecord.objects.order_by('-pk').values_list('pk', flat=True).first() or 0) + 1
+        now = datetime.now().replace(microsecond=0)
+
+        with explicit_start_time():
+            for offset in range(0, count, self.batch_size):
+                size = min(self.batch_size, count - offset)
+                start_times = sorted(now - timedelta(seconds=self.rnd.randint(0, days * 86400)) for _ in range(size))
+                numbers = {}
+                for day, day_count in Counter(start_time.date() for start_time in start_times).items():
+                    numbers[day] = iter(RepairNumberSequence.allocate(day_count, day))
+
+                records, links = [], []
+                for i, start_time in enumerate(start_times):
+                    record_id = start + offset + i
+                    asset_id = self.rnd.choice(asset_ids)
+                    status = self.rnd.choices([0, 1, 2, 3, 4], weights=[5, 10, 70, 10, 5])[0]
+                    duration = timedelta(hours=self.rnd.expovariate(1 / 48)) if status in [2, 3, 4] else None
+                    records.append(RepairRecord(
+                        id=record_id, repair_number=next(numbers[start_time.date()]), asset_id=asset_id,
+                        department_id=asset_departments[asset_id], applicant=f'员工{self.rnd.randint(1, 99999):05d}',
+                        fault_description=self.rnd.choice(['无法开机', '蓝屏', '屏幕损坏', '键盘故障', '网络不通']),
+                        supplier_id=self.rnd.choice(supplier_ids), repair_type=self.rnd.randint(0, 3),
+                        repair_status=status, repair_start_time=start_time, repair_duration=duration,
+                    ))
+                    if part_ids:
+                        for part_id in self.rnd.sample(part_ids, min(len(part_ids), self.rnd.choice([0, 1, 1, 2, 3]))):
+                            links.append(through(repairrecord_id=record_id, sparepart_id=part_id))
+                with transaction.atomic():
+                    RepairRecord.objects.bulk_create(records)
+                    through.objects.bulk_create(links)
+                self.stdout.write(f"维修记录: {offset + size}/{count}")
+
+    def seed_users(self, department):
+        """基准测试账号: 超级管理员 bench_admin 与部门管理员 bench_manager"""
+        if not User.objects.filter(username='bench_admin').exists():
+            User.objects.create_superuser('bench_admin', password=BENCH_PASSWORD)
+        if not User.objects.filter(username='bench_manager').exists():
+            manager = User.objects.create_user('bench_manager', password=BENCH_PASSWORD, is_staff=True)
+            manager.user_permissions.set(Permission.objects.filter(content_type__app_label__in=['assets', 'repair']))
+            Assetsmanager.objects.create(user=manager, department=department)
+        self.stdout.write(f"基准测试账号: bench_admin / bench_manager, 密码 {BENCH_PASSWORD}")
@@ -1,13 +1,19 @@
-from datetime import datetime
+from collections import Counter
+from datetime import date, datetime, timedelta
 
 from auditlog.models import AuditlogHistoryField
 from django.core.exceptions import ValidationError
-from django.db import models
+from django.db import IntegrityError, connections, models, transaction
+from django.db.models.functions import TruncDate
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
+from django.dispatch import receiver
 from django.contrib.auth.models import User
 from django.utils import timezone
 
-from assets.models import Assets, Department, Supplier
-from auditlog.registry import auditlog
+from assets.models import Assets, DataVersion, Department, SearchToken, Supplier, apply_stat_deltas
+from utils import audit_buffer
+from utils.bulk_edit import bulk_edited
+from utils.warranty import warranty_end
 
 
 class BaseModel(models.Model):
@@ -36,6 +42,13 @@ class SparePartType(BaseModel):
         verbose_name_plural = verbose_name
 
 
+class SparePartManager(models.Manager):
+    """备件的名称显示包含备件类型，默认一并查询，避免选择框逐个查询备件类型"""
+
+    def get_queryset(self):
+        return super().get_queryset().select_related('type')
+
+
 class SparePart(BaseModel):
     """备件"""
     type = models.ForeignKey(SparePartType, on_delete=models.CASCADE, verbose_name='备件类型')
@@ -43,6 +56,9 @@ class SparePart(BaseModel):
     sn = models.CharField(max_length=255, unique=True, verbose_name='备件序列号')
     supplier = models.ForeignKey(Supplier, on_delete=models.CASCADE, verbose_name='供应商')
     warranty = models.IntegerField(verbose_name='保修期限')
+    warranty_end = models.DateField(null=True, blank=True, editable=False, verbose_name='过保日期')  # 入库日期+保修期限
+
+    objects = SparePartManager()
 
     def __str__(self):
         return f"{self.type.name}-{self.name}({self.sn})"
@@ -51,6 +67,68 @@ class SparePart(BaseModel):
         db_table = 'spare_part'
         verbose_name = '备件'
         verbose_name_plural = verbose_name
+        indexes = [
+            models.Index(fields=['update_time', 'id']),  # 接口按修改时间游标分页
+            models.Index(fields=['warranty_end']),
+        ]
+
+    def save(self, *args, **kwargs):
+        self.warranty_end = self.get_warranty_end()
+        super().save(*args, **kwargs)
+
+    def get_warranty_end(self):
+        """过保日期：备件没有购买日期，以入库(创建)日期加保修期限(月份)计算，字符串的值先按字段类型转换"""
+        opts = self._meta
+        create_time = opts.get_field('create_time').to_python(self.create_time) or timezone.now()
+        return warranty_end(create_time.date(), opts.get_field('warranty').to_python(self.warranty))
+
+
+class RepairNumberSequence(models.Model):
+    """维修单号序列：每天一行计数器，原子递增分配维修单号 WX<yyyymmdd><nnnn>"""
+    day = models.DateField(unique=True, verbose_name='日期')
+    last_number = models.PositiveIntegerField(default=0, verbose_name='已分配的最大序号')
+
+    def __str__(self):
+        return f"{self.day}: {self.last_number}"
+
+    class Meta:
+        db_table = 'repair_number_sequence'
+        verbose_name = '维修单号序列'
+        verbose_name_plural = verbose_name
+
+    @staticmethod
+    def format_number(day, number):
+        return f"WX{day.strftime('%Y%m%d')}{number:04d}"
+
+    @classmethod
+    def allocate(cls, count=1, day=None):
+        """
+        原子地分配一段连续的维修单号，可一次为批量导入分配多个。
+        计数器行的 UPDATE 会加行锁，并发事务在此串行，不会分到重复的单号。
+        :param count: 分配数量
+        :param day: 日期，默认为今天
+        :return: 维修单号列表
+        """
+        day = day or date.today()
+        with transaction.atomic():
+            if not cls.objects.filter(day=day).update(last_number=models.F('last_number') + count):
+                cls._create_counter(day)
+                cls.objects.filter(day=day).update(last_number=models.F('last_number') + count)
+            last_number = cls.objects.filter(day=day).values_list('last_number', flat=True).get()
+        return [cls.format_number(day, number) for number in range(last_number - count + 1, last_number + 1)]
+
+    @classmethod
+    def _create_counter(cls, day):
+        """创建当天的计数器，从当天已有的最大单号开始(兼容启用序列之前生成的单号)"""
+        prefix = cls.format_number(day, 0)[:-4]
+        last = (RepairRecord.objects.filter(repair_number__startswith=prefix)
+                .order_by('-repair_number').values_list('repair_number', flat=True).first())
+        try:
+            with transaction.atomic():
+                cls.objects.create(day=day, last_number=int(last[len(prefix):]) if last else 0)
+        except IntegrityError:
+            # 计数器已被并发请求创建
+            pass
 
 
 class RepairRecord(BaseModel):
@@ -69,7 +147,7 @@ class RepairRecord(BaseModel):
         (3, '不为修'),
         (4, '废弃'),
     ]
-    repair_number = models.CharField(max_length=50, verbose_name='维修单号', blank=True)
+    repair_number = models.CharField(max_length=50, unique=True, verbose_name='维修单号', blank=True)
     asset = models.ForeignKey(Assets, on_delete=models.CASCADE, verbose_name='资产名称')
     department = models.ForeignKey(Department, on_delete=models.CASCADE, verbose_name='维修部门')
     applicant = models.CharField(max_length=50, verbose_name='申请维修人')
@@ -84,10 +162,25 @@ class RepairRecord(BaseModel):
     def __str__(self):
         return f"{self.repair_number}-{self.asset.name}"
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # 记录加载时的统计维度，保存时据此增量更新维修统计表
+        instance._loaded_stat_key = (instance.__dict__.get('department_id'), instance.__dict__.get('supplier_id'))
+        # 记录加载时的维修开始时间，改到其他日期后原日期的维修日统计需要重新汇总
+        instance._loaded_start_time = instance.__dict__.get('repair_start_time')
+        return instance
+
     class Meta:
         db_table = 'repair_record'
         verbose_name = '维修记录'
         verbose_name_plural = verbose_name
+        # 由 manage.py index_advisor 根据列表页的过滤和部门权限范围得出
+        indexes = [
+            models.Index(fields=['repair_start_time']),
+            models.Index(fields=['department', 'repair_start_time']),
+            models.Index(fields=['update_time', 'id']),  # 接口按修改时间游标分页
+        ]
 
     def clean(self):
         super().clean()
@@ -96,21 +189,10 @@ class RepairRecord(BaseModel):
 
     def save(self, *args, **kwargs):
         # 如果是新的维修记录
-        if not self.pk:
+        is_new = not self.pk
+        if is_new:
             # 生成维修单号
-            today = datetime.today().strftime('%Y%m%d')
-            last_repair_record = RepairRecord.objects.filter(repair_number__startswith=f'WX{today}').order_by(
-                '-repair_number').first()
-            if last_repair_record:
-                last_number = int(last_repair_record.repair_number[-4:])
-                new_number = last_number + 1
-            else:
-                new_number = 1
-            self.repair_number = f'WX{today}{new_number:04d}'
-
-            # 更新维修状态
-            self.asset.repair_count += 1
-            self.asset.save()
+            self.repair_number = RepairNumberSequence.allocate()[0]
 
         if self.repair_status in [2, 3, 4] and self.repair_start_time:
             # 计算维修持续周期
@@ -118,7 +200,366 @@ class RepairRecord(BaseModel):
 
         super().save(*args, **kwargs)
 
+        if is_new:
+            # 更新维修次数：单条原子UPDATE，不保存整个资产对象(同时更新修改时间，供接口按修改时间增量同步)
+            Assets.objects.filter(pk=self.asset_id).update(repair_count=models.F('repair_count') + 1,
+                                                           update_time=timezone.now())
+
+
+class RepairStat(models.Model):
+    """
+    维修统计：各部门、供应商、备件类型的维修记录数量，由信号增量维护，供维修图表使用。
+    计数口径与按备件关联分组统计一致：每个维修备件计一次，没有备件的维修记录计入空备件类型。
+    """
+    department = models.ForeignKey(Department, on_delete=models.CASCADE, verbose_name='维修部门')
+    supplier = models.ForeignKey(Supplier, on_delete=models.CASCADE, verbose_name='维修供应商')
+    spare_part_type = models.ForeignKey(SparePartType, on_delete=models.CASCADE, null=True, blank=True,
+                                        verbose_name='备件类型')
+    count = models.IntegerField(default=0, verbose_name='维修记录数')
+
+    def __str__(self):
+        return f"{self.department_id}-{self.supplier_id}-{self.spare_part_type_id}: {self.count}"
+
+    class Meta:
+        db_table = 'repair_stat'
+        verbose_name = '维修统计'
+        verbose_name_plural = verbose_name
+        unique_together = ('department', 'supplier', 'spare_part_type')
+
+    @classmethod
+    def bump(cls, department_id, supplier_id, spare_part_type_id, delta):
+        """
+        增量更新某个统计维度的维修记录数量。
+        :param delta: 增量，可以为负数
+        """
+        key = {'department_id': department_id, 'supplier_id': supplier_id, 'spare_part_type_id': spare_part_type_id}
+        DataVersion.bump('repair')
+        if cls.objects.filter(**key).update(count=models.F('count') + delta) or delta <= 0:
+            return
+        try:
+            with transaction.atomic():
+                cls.objects.create(count=delta, **key)
+        except IntegrityError:
+            # 并发情况下统计行已被其他请求创建
+            cls.objects.filter(**key).update(count=models.F('count') + delta)
+
+    @classmethod
+    def apply(cls, before, after):
+        """
+        按两次统计快照的差值增量更新。
+        :param before: 变更前的 Counter{(部门ID, 供应商ID, 备件类型ID): 数量}
+        :param after: 变更后的 Counter
+        """
+        apply_stat_deltas(cls, ('department_id', 'supplier_id', 'spare_part_type_id'),
+                          {key: after[key] - before[key] for key in set(before) | set(after)}, 'repair')
+
+    @staticmethod
+    def snapshot(record_ids):
+        """
+        统计指定维修记录当前对各统计维度的贡献。
+        :param record_ids: 维修记录ID列表
+        :return: Counter{(部门ID, 供应商ID, 备件类型ID): 数量}
+        """
+        return Counter(RepairRecord.objects.filter(pk__in=record_ids)
+                       .values_list('department_id', 'supplier_id', 'spare_part__type_id'))
+
+    @classmethod
+    def rebuild(cls):
+        """根据维修记录全量重建统计数据，用于修复统计偏差"""
+        rows = (RepairRecord.objects.values('department_id', 'supplier_id', 'spare_part__type_id')
+                .annotate(count=models.Count('id')))
+        with transaction.atomic():
+            cls.objects.all().delete()
+            cls.objects.bulk_create([cls(department_id=row['department_id'], supplier_id=row['supplier_id'],
+                                         spare_part_type_id=row['spare_part__type_id'], count=row['count'])
+                                     for row in rows])
+            DataVersion.bump('repair')
+
+
+class HighWaterMark(models.Model):
+    """增量汇总的高水位：已汇总到的源数据最大修改时间"""
+    name = models.CharField(max_length=32, unique=True, verbose_name='名称')
+    value = models.DateTimeField(null=True, blank=True, verbose_name='已汇总到的修改时间')
+
+    def __str__(self):
+        return f"{self.name}: {self.value}"
+
+    class Meta:
+        db_table = 'high_water_mark'
+        verbose_name = '汇总高水位'
+        verbose_name_plural = verbose_name
+
+
+class StaleDay(models.Model):
+    """增量汇总中需要重新汇总的日期：源数据离开该日期(删除、改到其他日期)时登记，下次刷新时重新汇总并删除"""
+    name = models.CharField(max_length=32, verbose_name='名称')
+    day = models.DateField(verbose_name='日期')
+
+    def __str__(self):
+        return f"{self.name}: {self.day}"
+
+    class Meta:
+        db_table = 'stale_day'
+        verbose_name = '待重新汇总的日期'
+        verbose_name_plural = verbose_name
+        unique_together = ('name', 'day')
+
+
+class RepairDailyStat(models.Model):
+    """
+    维修日统计：按 (日期, 部门, 供应商, 维修类别, 维修状态) 汇总的维修记录数，日期为维修开始日期，供维修趋势图使用。
+    按维修记录修改时间的高水位增量刷新：重新汇总高水位之后修改过的记录所在的日期，以及登记为待重新汇总的日期
+    (维修开始时间改到其他日期时的原日期)；删除记录时由信号直接减去或登记该日期。
+    """
+    day = models.DateField(verbose_name='日期')
+    department = models.ForeignKey(Department, on_delete=models.CASCADE, verbose_name='维修部门')
+    supplier = models.ForeignKey(Supplier, on_delete=models.CASCADE, verbose_name='维修供应商')
+    repair_type = models.SmallIntegerField(choices=RepairRecord.REPAIR_TYPE_CHOICES, verbose_name='维修类别')
+    repair_status = models.SmallIntegerField(choices=RepairRecord.REPAIR_STATUS_CHOICES, verbose_name='维修状态')
+    count = models.IntegerField(default=0, verbose_name='维修记录数')
+
+    # 高水位最多推进到 刷新时间-REFRESH_OVERLAP：修改时间较早但提交较晚的事务不会被漏掉，
+    # 最近修改的记录在之后几次刷新中重复汇总(结果相同)，没有新修改时刷新只有一次索引查询
+    REFRESH_OVERLAP = timedelta(minutes=5)
+    MARK_NAME = 'repair_daily_stat'
+    KEY_FIELDS = ['department_id', 'supplier_id', 'repair_type', 'repair_status']
+
+    def __str__(self):
+        return f"{self.day}-{self.department_id}-{self.supplier_id}-{self.repair_type}-{self.repair_status}: {self.count}"
+
+    class Meta:
+        db_table = 'repair_daily_stat'
+        verbose_name = '维修日统计'
+        verbose_name_plural = verbose_name
+        unique_together = ('day', 'department', 'supplier', 'repair_type', 'repair_status')
+        indexes = [models.Index(fields=['department', 'day'])]  # 资产管理员按部门范围查询
+
+    @classmethod
+    def refresh(cls, full=False):
+        """
+        增量刷新：只重新汇总高水位之后修改过的维修记录所在的日期和登记为待重新汇总的日期。
+        高水位行加锁，并发刷新在此串行。
+        :param full: 全量重建
+        :return: 重新汇总的天数
+        """
+        with transaction.atomic():
+            mark, _ = HighWaterMark.objects.get_or_create(name=cls.MARK_NAME)
+            mark = HighWaterMark.objects.select_for_update().get(pk=mark.pk)
+            now = timezone.now()
+            stale = StaleDay.objects.filter(name=cls.MARK_NAME)
+            stale_days = set(stale.values_list('day', flat=True))
+            changed = RepairRecord.objects.all()
+            if mark.value and not full:
+                changed = changed.filter(update_time__gt=mark.value)
+            latest = changed.aggregate(latest=models.Max('update_time'))['latest']
+            if latest is None and not stale_days:
+                return 0
+            if full:
+                cls.objects.all().delete()
+                days = list(RepairRecord.objects.dates('repair_start_time', 'day'))
+            else:
+                days = sorted(stale_days.union(changed.dates('repair_start_time', 'day') if latest else ()))
+            for start, end in cls._day_ranges(days):
+                cls._rebuild_range(start, end)
+            # 只删除本次读到的日期，刷新期间新登记的日期留给下次刷新
+            stale.filter(day__in=stale_days).delete()
+            if latest is not None:
+                previous, mark.value = mark.value, min(latest, now - cls.REFRESH_OVERLAP)
+                if previous and not full:
+                    mark.value = max(mark.value, previous)
+                mark.save(update_fields=['value'])
+            DataVersion.bump('repair')
+        return len(days)
+
+    @classmethod
+    def mark_stale(cls, days):
+        """登记需要重新汇总的日期，下次刷新时重新汇总"""
+        StaleDay.objects.bulk_create([StaleDay(name=cls.MARK_NAME, day=day) for day in set(days)],
+                                     ignore_conflicts=True)
+
+    @staticmethod
+    def moved_days(pairs):
+        """
+        维修开始时间改到其他日期的记录的原日期。
+        :param pairs: [(修改前的维修开始时间, 修改后的维修开始时间)]，导入时修改后的值可能是日期
+        """
+        def day(value):
+            return value.date() if isinstance(value, datetime) else value
+
+        return {day(old) for old, new in pairs if old is not None and day(old) != day(new)}
+
+    @staticmethod
+    def _day_ranges(days):
+        """把排序后的日期合并为连续区间 [(开始, 结束)]"""
+        ranges = []
+        for day in days:
+            if ranges and day == ranges[-1][1] + timedelta(days=1):
+                ranges[-1][1] = day
+            else:
+                ranges.append([day, day])
+        return ranges
+
+    @classmethod
+    def _rebuild_range(cls, start, end):
+        """
+        重新汇总一段连续日期：删除旧行后执行一条 INSERT ... SELECT，按日期分组的查询使用维修开始时间索引，
+        汇总结果不经过Python(全量重建时可能有数十万行)。
+        """
+        rows = (RepairRecord.objects
+                .filter(repair_start_time__gte=start, repair_start_time__lt=end + timedelta(days=1))
+                .annotate(day=TruncDate('repair_start_time'))
+                .values('day', *cls.KEY_FIELDS).annotate(count=models.Count('id')).order_by())
+        cls.objects.filter(day__gte=start, day__lte=end).delete()
+        # SELECT 列的顺序：先是 values() 中的字段，再是注解
+        columns = [*rows.query.values_select, *rows.query.annotation_select]
+        sql, params = rows.query.sql_with_params()
+        connection = connections[rows.db]
+        qn = connection.ops.quote_name
+        with connection.cursor() as cursor:
+            cursor.execute(f"INSERT INTO {qn(cls._meta.db_table)} "
+                           f"({', '.join(qn(cls._meta.get_field(name).column) for name in columns)}) {sql}", params)
+
+    @classmethod
+    def subtract(cls, record):
+        """
+        删除维修记录时从所在日期的统计中减去。只有修改时间不晚于高水位的记录才确定已按当前的维度汇总，
+        否则(最后一次修改尚未汇总，计入的可能是修改前的维度)登记该日期，下次刷新时重新汇总。
+        """
+        if record.repair_start_time is None:
+            return
+        day = record.repair_start_time.date()
+        mark = HighWaterMark.objects.filter(name=cls.MARK_NAME).values_list('value', flat=True).first()
+        if mark is None:
+            return  # 尚未汇总过，刷新时从维修记录汇总
+        if record.update_time is None or record.update_time > mark:
+            cls.mark_stale([day])
+            return
+        cls.objects.filter(day=day, count__gt=0, **{name: getattr(record, name) for name in cls.KEY_FIELDS}).update(
+            count=models.F('count') - 1)
+        DataVersion.bump('repair')
+
+
+@receiver(post_save, sender=SparePartType)
+def bump_chart_version_on_rename(sender, instance, created, **kwargs):
+    """备件类型名称会显示在图表中，修改后使图表缓存失效"""
+    if not created:
+        DataVersion.bump('repair')
+
+
+@receiver(post_save, sender=RepairRecord)
+def update_repair_stat_on_save(sender, instance, created, **kwargs):
+    """维修记录新增或修改部门/供应商时增量更新维修统计"""
+    new_key = (instance.department_id, instance.supplier_id)
+    if created:
+        # 新记录此时还没有关联备件，备件由 m2m_changed 信号处理
+        RepairStat.bump(*new_key, None, 1)
+    else:
+        old_key = getattr(instance, '_loaded_stat_key', None)
+        if old_key is not None and None not in old_key and old_key != new_key:
+            after = RepairStat.snapshot([instance.pk])
+            before = Counter({(*old_key, spare_part_type_id): count
+                              for (_, _, spare_part_type_id), count in after.items()})
+            RepairStat.apply(before, after)
+    instance._loaded_stat_key = new_key
+
+
+@receiver(post_delete, sender=RepairRecord)
+def decrease_asset_repair_count(sender, instance, **kwargs):
+    """删除维修记录时原子地减少资产的维修次数"""
+    Assets.objects.filter(pk=instance.asset_id, repair_count__gt=0).update(
+        repair_count=models.F('repair_count') - 1, update_time=timezone.now())
+
+
+@receiver(post_save, sender=RepairRecord)
+def mark_repair_daily_stat_on_move(sender, instance, created, **kwargs):
+    """维修开始时间改到其他日期时，原日期不在按修改时间的增量刷新中，登记为待重新汇总"""
+    if not created:
+        moved = RepairDailyStat.moved_days([(getattr(instance, '_loaded_start_time', None),
+                                             instance.repair_start_time)])
+        if moved:
+            RepairDailyStat.mark_stale(moved)
+    instance._loaded_start_time = instance.repair_start_time
+
+
+@receiver(post_delete, sender=RepairRecord)
+def update_repair_daily_stat_on_delete(sender, instance, **kwargs):
+    """删除的记录不会出现在按修改时间的增量刷新中，在此直接减去"""
+    RepairDailyStat.subtract(instance)
+
+
+@receiver(pre_delete, sender=RepairRecord)
+def snapshot_repair_stat_on_delete(sender, instance, **kwargs):
+    """删除前记录维修记录的统计贡献，删除后关联备件已被级联删除"""
+    instance._stat_snapshot = RepairStat.snapshot([instance.pk])
+
+
+@receiver(post_delete, sender=RepairRecord)
+def update_repair_stat_on_delete(sender, instance, **kwargs):
+    """删除维修记录时增量更新维修统计"""
+    RepairStat.apply(getattr(instance, '_stat_snapshot', Counter()), Counter())
+
+
+@receiver(m2m_changed, sender=RepairRecord.spare_part.through)
+def update_repair_stat_on_spare_part_change(sender, instance, action, reverse, pk_set, **kwargs):
+    """维修记录关联的备件变化时增量更新维修统计"""
+    if action not in ('pre_add', 'pre_remove', 'pre_clear', 'post_add', 'post_remove', 'post_clear'):
+        return
+    if action.startswith('pre_'):
+        if not reverse:
+            record_ids = [instance.pk]
+        elif action == 'pre_clear':
+            record_ids = list(instance.repairrecord_set.values_list('pk', flat=True))
+        else:
+            record_ids = list(pk_set)
+        instance._stat_snapshot = (record_ids, RepairStat.snapshot(record_ids))
+    else:
+        record_ids, before = getattr(instance, '_stat_snapshot', ([], Counter()))
+        RepairStat.apply(before, RepairStat.snapshot(record_ids))
+
+
+@receiver(post_save, sender=RepairRecord)
+def update_repair_search_index(sender, instance, **kwargs):
+    """保存维修记录时更新维修记录搜索索引"""
+    SearchToken.index('repair', [instance.pk])
+
+
+@receiver(post_delete, sender=RepairRecord)
+def remove_repair_search_index(sender, instance, **kwargs):
+    SearchToken.remove('repair', [instance.pk])
+
+
+@receiver(post_save, sender=Assets)
+def update_repair_search_index_on_asset_rename(sender, instance, created, **kwargs):
+    """维修记录按资产名称检索，资产改名时重建该资产所有维修记录的索引"""
+    if not created and getattr(instance, '_loaded_name', instance.name) != instance.name:
+        SearchToken.index('repair', RepairRecord.objects.filter(asset=instance).values_list('pk', flat=True))
+    instance._loaded_name = instance.name
+
+
+@receiver(bulk_edited, sender=Assets)
+def update_repair_search_index_on_asset_bulk_rename(sender, old, new, **kwargs):
+    renamed = [obj.pk for obj in new if old[obj.pk].name != obj.name]
+    if renamed:
+        SearchToken.index('repair', RepairRecord.objects.filter(asset__in=renamed).values_list('pk', flat=True))
+
+
+@receiver(bulk_edited, sender=RepairRecord)
+def mark_repair_daily_stat_on_bulk_move(sender, old, new, **kwargs):
+    """批量修改维修开始时间时登记原日期为待重新汇总"""
+    moved = RepairDailyStat.moved_days([(old[obj.pk].repair_start_time, obj.repair_start_time) for obj in new])
+    if moved:
+        RepairDailyStat.mark_stale(moved)
+
+
+@receiver(bulk_edited, sender=SparePart)
+def update_spare_part_warranty_on_bulk_edit(sender, old, new, **kwargs):
+    """批量修改备件的保修期限后重新计算过保日期"""
+    stale = [obj for obj in new if obj.warranty_end != obj.get_warranty_end()]
+    for obj in stale:
+        obj.warranty_end = obj.get_warranty_end()
+    SparePart.objects.bulk_update(stale, ['warranty_end'], batch_size=1000)
+
 
-auditlog.register(SparePartType)
-auditlog.register(SparePart)
-auditlog.register(RepairRecord, m2m_fields={"spare_part"})
+audit_buffer.register(SparePartType)
+audit_buffer.register(SparePart)
+audit_buffer.register(RepairRecord, m2m_fields={"spare_part"})
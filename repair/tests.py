@@ -1,3 +1,366 @@
-from django.test import TestCase
+import json
+import sys
+import tempfile
+import threading
+from datetime import date, datetime, timedelta
+from io import StringIO
+from pathlib import Path
+from unittest import mock
 
-# Create your tests here.
+import tablib
+
+from auditlog.models import LogEntry
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+
+from assets.models import Assets, Bussline, Department, Supplier
+from assets.tests import ChangelistQueryCountMixin, create_fleet
+from repair.management.commands.renumber_repair_records import plan_renumbering
+from repair.models import (HighWaterMark, RepairDailyStat, RepairNumberSequence, RepairRecord, RepairStat, SparePart,
+                           SparePartType, StaleDay)
+from utils.audit_buffer import buffered_audit
+from utils.bulk_edit import bulk_edit
+from utils.repair_analytics import compute_report
+from utils.resource import RepairRecordResource
+
+
+class RepairNumberSequenceTests(TestCase):
+    def test_allocate_block(self):
+        day = date(2024, 4, 18)
+        self.assertEqual(RepairNumberSequence.allocate(day=day), ['WX202404180001'])
+        self.assertEqual(RepairNumberSequence.allocate(3, day=day),
+                         ['WX202404180002', 'WX202404180003', 'WX202404180004'])
+        self.assertEqual(RepairNumberSequence.allocate(day=date(2024, 4, 19)), ['WX202404190001'])
+
+    def test_continue_from_existing_numbers(self):
+        bussline = Bussline.objects.create(name='业务线')
+        department = Department.objects.create(name='部门', bussline=bussline)
+        supplier = Supplier.objects.create(name='供应商')
+        asset = Assets.objects.create(name='电脑', sn='SN001', bussline=bussline, department=department,
+                                      supplier=supplier, purchase_date=date(2024, 1, 1), expire_date=12)
+        RepairRecord.objects.bulk_create([RepairRecord(
+            repair_number=RepairNumberSequence.format_number(date.today(), 7), asset=asset, department=department,
+            supplier=supplier, applicant='张三', fault_description='无法开机')])
+
+        record = RepairRecord.objects.create(asset=asset, department=department, supplier=supplier,
+                                             applicant='张三', fault_description='无法开机')
+        self.assertEqual(record.repair_number, RepairNumberSequence.format_number(date.today(), 8))
+
+
+class RenumberRepairRecordsTests(TestCase):
+    def test_plan_renumbering(self):
+        created = datetime(2024, 4, 20, 10, 0)
+        rows = [(1, 'WX202404180001', created), (2, 'WX202404180003', created), (3, 'WX202404180001', created),
+                (4, '', created), (5, 'WX202404180003', created), (6, '', created), (7, 'OLD-1', created)]
+        plan, touched = plan_renumbering(rows)
+        self.assertEqual(plan, {3: 'WX202404180004', 4: 'WX202404200001', 5: 'WX202404180005',
+                                6: 'WX202404200002'})
+        self.assertEqual(touched, {date(2024, 4, 18): 5, date(2024, 4, 20): 2})
+
+    def test_command_without_duplicates(self):
+        out = StringIO()
+        call_command('renumber_repair_records', '--dry-run', stdout=out)
+        self.assertIn('需要重新编号的维修记录: 0 条', out.getvalue())
+
+
+class ReconcileRepairCountsTests(TestCase):
+    def test_only_mismatched_assets_are_updated(self):
+        asset, other = create_fleet(2)
+        RepairRecord.objects.create(asset=asset, department=asset.department, supplier=asset.supplier,
+                                    applicant='张三', fault_description='无法开机')
+        stale = datetime(2024, 1, 1)
+        Assets.objects.update(update_time=stale)
+        Assets.objects.filter(pk=asset.pk).update(repair_count=5)
+        call_command('reconcile_repair_counts', stdout=StringIO())
+        asset.refresh_from_db()
+        other.refresh_from_db()
+        self.assertEqual((asset.repair_count, other.repair_count), (1, 0))
+        self.assertGreater(asset.update_time, stale)
+        self.assertEqual(other.update_time, stale)
+
+
+class IndexAdvisorTests(TestCase):
+    def test_emit_migration(self):
+        create_fleet(3)
+        with tempfile.TemporaryDirectory() as tmp:
+            modules = {}
+            for app_label in ('assets', 'repair'):
+                package = Path(tmp, f'index_advisor_{app_label}_migrations')
+                package.mkdir()
+                (package / '__init__.py').write_text('')
+                (package / '0001_initial.py').write_text(
+                    'from django.db import migrations\n\n\nclass Migration(migrations.Migration):\n    operations = []\n')
+                modules[app_label] = package.name
+            out = StringIO()
+            with mock.patch.object(sys, 'path', [tmp, *sys.path]), override_settings(MIGRATION_MODULES=modules):
+                call_command('index_advisor', '--min-ms', '0', '--emit-migration', stdout=out)
+            output = out.getvalue()
+            self.assertIn("搜索 name,sn,asset_location='电脑0'", output)
+            self.assertIn('n-gram搜索索引', output)
+            migrations = list(Path(tmp).glob('*/0002_advised_indexes.py'))
+            self.assertTrue(migrations)
+            for migration in migrations:
+                source = migration.read_text()
+                self.assertIn("('{}', '0001_initial')".format(migration.parent.name.split('_')[2]), source)
+                self.assertIn('migrations.AddIndex(', source)
+
+
+class RepairNumberConcurrencyTests(TransactionTestCase):
+    def setUp(self):
+        if connection.vendor == 'sqlite' and connection.is_in_memory_db():
+            self.skipTest('内存SQLite不支持多连接并发写入')
+
+    def test_concurrent_allocate_has_no_duplicates(self):
+        threads_count, per_thread = 8, 25
+        numbers, errors = [], []
+        lock = threading.Lock()
+
+        def worker():
+            try:
+                allocated = []
+                for i in range(per_thread):
+                    allocated.extend(RepairNumberSequence.allocate(1 + i % 3))
+                with lock:
+                    numbers.extend(allocated)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=worker) for _ in range(threads_count)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(len(numbers), len(set(numbers)))
+        expected = threads_count * sum(1 + i % 3 for i in range(per_thread))
+        self.assertEqual(len(numbers), expected)
+        self.assertEqual(RepairNumberSequence.objects.get(day=date.today()).last_number, expected)
+
+
+class RepairChangelistQueryTests(ChangelistQueryCountMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.superuser = User.objects.create_superuser('admin', password='password')
+        for asset in create_fleet(cls.rows):
+            spare_part_type = SparePartType.objects.create(name=f'类型{asset.sn}', creator=asset.creator)
+            spare_part = SparePart.objects.create(type=spare_part_type, name=f'备件{asset.sn}', sn=asset.sn,
+                                                  supplier=asset.supplier, warranty=12, creator=asset.creator)
+            record = RepairRecord.objects.create(asset=asset, department=asset.department, supplier=asset.supplier,
+                                                 applicant='张三', fault_description='无法开机', creator=asset.creator)
+            record.spare_part.add(spare_part)
+
+    def setUp(self):
+        self.client.force_login(self.superuser)
+
+    def test_spare_part_type_changelist(self):
+        self.assertChangelistQueries(SparePartType, 5)
+
+    def test_spare_part_changelist(self):
+        self.assertChangelistQueries(SparePart, 8)
+
+    def test_repair_record_changelist(self):
+        self.assertChangelistQueries(RepairRecord, 7)
+
+
+class RepairDailyStatTests(TestCase):
+    def setUp(self):
+        self.asset = create_fleet(1)[0]
+        self.records = [RepairRecord.objects.create(
+            asset=self.asset, department=self.asset.department, supplier=self.asset.supplier,
+            applicant='张三', fault_description='无法开机') for _ in range(3)]
+
+    def counts(self):
+        return dict(RepairDailyStat.objects.filter(count__gt=0).values_list('repair_status', 'count'))
+
+    def test_incremental_refresh(self):
+        self.assertEqual(RepairDailyStat.refresh(), 1)
+        self.assertEqual(self.counts(), {0: 3})
+
+        record = self.records[0]
+        record.repair_status = 2
+        record.save()
+        RepairDailyStat.refresh()
+        self.assertEqual(self.counts(), {0: 2, 2: 1})
+
+        # 最后一次修改尚未汇总(修改时间晚于高水位)的记录删除时登记日期，下次刷新时重新汇总
+        self.records[1].delete()
+        self.assertEqual(self.counts(), {0: 2, 2: 1})
+        self.assertEqual(RepairDailyStat.refresh(), 1)
+        self.assertEqual(self.counts(), {0: 1, 2: 1})
+        RepairDailyStat.refresh(full=True)
+        self.assertEqual(self.counts(), {0: 1, 2: 1})
+
+        # 已汇总的记录删除时直接减去
+        HighWaterMark.objects.filter(name=RepairDailyStat.MARK_NAME).update(value=timezone.now())
+        self.records[2].delete()
+        self.assertEqual(self.counts(), {2: 1})
+
+    def test_moved_record_rebuilds_old_day(self):
+        RepairDailyStat.refresh()
+        old_day = self.records[0].repair_start_time.date()
+        record = RepairRecord.objects.get(pk=self.records[0].pk)
+        record.repair_start_time -= timedelta(days=3)
+        record.save()
+        RepairDailyStat.refresh()
+        self.assertEqual(dict(RepairDailyStat.objects.filter(count__gt=0).values_list('day', 'count')),
+                         {old_day: 2, old_day - timedelta(days=3): 1})
+
+        bulk_edit(RepairRecord.objects.filter(pk=self.records[1].pk),
+                  repair_start_time=record.repair_start_time)
+        RepairDailyStat.refresh()
+        self.assertEqual(dict(RepairDailyStat.objects.filter(count__gt=0).values_list('day', 'count')),
+                         {old_day: 1, old_day - timedelta(days=3): 2})
+
+    def test_trend_chart(self):
+        self.client.force_login(User.objects.create_superuser('admin', password='password'))
+        for by in ('department', 'repair_status'):
+            response = self.client.get('/repair/repair_trend/', {'by': by, 'weeks': 4})
+            self.assertEqual(response.status_code, 200)
+        self.assertEqual(RepairDailyStat.objects.get().count, 3)
+
+    def test_trend_chart_ignores_future_days(self):
+        cache.clear()
+        self.client.force_login(User.objects.create_superuser('admin', password='password'))
+        future = date.today() + timedelta(days=30)
+        # 新增记录的维修开始时间自动取当前时间，导入修改已有记录时可以写入未来的日期
+        dataset = tablib.Dataset(
+            [self.records[0].repair_number, self.asset.sn, self.asset.department.name, self.asset.supplier.name, '张三', '无法开机',
+             future.strftime('%Y/%m/%d 08:00:00')],
+            headers=['维修单号', '资产SN', '部门', '维修供应商', '申请人', '故障描述', '维修开始时间'])
+        self.assertFalse(RepairRecordResource().import_data(dataset).has_errors())
+        RepairDailyStat.refresh()
+        self.assertTrue(RepairDailyStat.objects.filter(day=future).exists())
+        response = self.client.get('/repair/repair_trend/', {'by': 'department', 'weeks': 4})
+        self.assertEqual(response.status_code, 200)
+        # 图表配置中的中文以 \u 转义输出
+        self.assertContains(response, json.dumps('(总记录数: 2)')[1:-1])
+
+
+class RepairAnalyticsTests(TestCase):
+    def setUp(self):
+        asset, other = create_fleet(2)
+        spare_part_type = SparePartType.objects.create(name='硬盘')
+        parts = [SparePart.objects.create(type=spare_part_type, name=f'硬盘{i}', sn=f'HD{i}', supplier=asset.supplier,
+                                          warranty=12) for i in range(2)]
+        records = [RepairRecord.objects.create(asset=target, department=target.department, supplier=target.supplier,
+                                               applicant='张三', fault_description='无法开机')
+                   for target in (asset, asset, other)]
+        records[0].spare_part.set(parts)
+        records[1].spare_part.add(parts[0])
+        for record, hours in zip(records, (2, 4, None)):
+            RepairRecord.objects.filter(pk=record.pk).update(
+                repair_duration=timedelta(hours=hours) if hours else None)
+        self.asset = asset
+
+    def test_compute_report(self):
+        report = compute_report(RepairRecord.objects.all())
+        summary = dict(report['summary'].values.tolist())
+        self.assertEqual(summary['维修记录数'], 3)
+        self.assertEqual(summary['已完成数'], 2)
+        self.assertEqual(summary['平均维修时长(小时)'], 3.0)
+        self.assertEqual(summary['每单备件数'], 1.0)
+        department = report['department'].iloc[0]
+        self.assertEqual((department['name'], department['repairs'], department['repeat_rate']),
+                         (self.asset.department.name, 2, 0.5))
+        spare_part_type = report['spare_part_type'].iloc[0]
+        self.assertEqual((spare_part_type['name'], spare_part_type['repairs'], spare_part_type['parts_per_repair']),
+                         ('硬盘', 2, 1.5))
+        self.assertEqual(report['asset'][['sn', 'repairs', 'repeats']].values.tolist(), [[self.asset.sn, 2, 1]])
+
+    def test_views(self):
+        self.client.force_login(User.objects.create_superuser('admin', password='password'))
+        response = self.client.get('/repair/analytics/')
+        self.assertContains(response, '重复故障资产')
+        response = self.client.get('/repair/analytics/', {'format': 'xlsx'})
+        self.assertEqual(response['Content-Type'],
+                         'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
+
+
+class SparePartBulkEditTests(TestCase):
+    def test_warranty_end_follows_bulk_edit(self):
+        supplier = create_fleet(1)[0].supplier
+        spare_part_type = SparePartType.objects.create(name='内存')
+        part = SparePart.objects.create(type=spare_part_type, name='内存0', sn='RAM0', supplier=supplier, warranty=12)
+        SparePart.objects.filter(pk=part.pk).update(create_time=datetime(2024, 1, 31, 10))
+        self.assertEqual(bulk_edit(SparePart.objects.all(), warranty=13), 1)
+        part.refresh_from_db()
+        self.assertEqual(part.warranty_end, date(2025, 2, 28))
+
+
+class RepairImportTests(TestCase):
+    def setUp(self):
+        self.asset, self.other = create_fleet(2)
+        spare_part_type = SparePartType.objects.create(name='硬盘')
+        self.parts = [SparePart.objects.create(type=spare_part_type, name=f'硬盘{i}', sn=f'HD{i}',
+                                               supplier=self.asset.supplier, warranty=12) for i in range(2)]
+        self.existing = RepairRecord.objects.create(asset=self.asset, department=self.asset.department,
+                                                    supplier=self.asset.supplier, applicant='张三',
+                                                    fault_description='无法开机')
+        self.existing.spare_part.add(self.parts[0])
+
+    def row(self, repair_number, asset, spare_parts):
+        return [repair_number, asset.sn, asset.department.name, asset.supplier.name, '张三', '无法开机', spare_parts]
+
+    def test_bulk_import(self):
+        dataset = tablib.Dataset(
+            self.row('', self.asset, 'HD0|HD1'),
+            self.row('', self.other, ''),
+            self.row('', self.other, 'HD1'),
+            self.row(self.existing.repair_number, self.asset, 'HD1'),
+            headers=['维修单号', '资产SN', '部门', '维修供应商', '申请人', '故障描述', '维修备件'])
+        # 查询条数与行数无关：解析、分配单号、写入、关联、维修次数和统计各为常数条
+        with self.assertNumQueries(38):
+            result = RepairRecordResource().import_data(dataset)
+        self.assertFalse(result.has_errors() or result.has_validation_errors())
+        self.assertEqual((result.totals['new'], result.totals['update']), (3, 1))
+
+        numbers = [RepairNumberSequence.format_number(date.today(), i) for i in (2, 3, 4)]
+        created = RepairRecord.objects.filter(repair_number__in=numbers).order_by('repair_number')
+        self.assertEqual([sorted(record.spare_part.values_list('sn', flat=True)) for record in created],
+                         [['HD0', 'HD1'], [], ['HD1']])
+        self.assertEqual(list(self.existing.spare_part.values_list('sn', flat=True)), ['HD1'])
+        self.asset.refresh_from_db()
+        self.other.refresh_from_db()
+        self.assertEqual((self.asset.repair_count, self.other.repair_count), (2, 2))
+
+        counts = set(RepairStat.objects.filter(count__gt=0).values_list(
+            'department', 'supplier', 'spare_part_type', 'count'))
+        RepairStat.rebuild()
+        self.assertEqual(counts, set(RepairStat.objects.values_list(
+            'department', 'supplier', 'spare_part_type', 'count')))
+
+    def test_bulk_import_is_audited(self):
+        dataset = tablib.Dataset(
+            self.row('', self.other, 'HD0|HD1'),
+            self.row(self.existing.repair_number, self.asset, 'HD1'),
+            headers=['维修单号', '资产SN', '部门', '维修供应商', '申请人', '故障描述', '维修备件'])
+        with buffered_audit(), self.captureOnCommitCallbacks(execute=True):
+            RepairRecordResource().import_data(dataset)
+        created = RepairRecord.objects.exclude(pk=self.existing.pk).get()
+        entry = LogEntry.objects.get_for_object(created).get()
+        self.assertEqual(entry.action, LogEntry.Action.CREATE)
+        self.assertEqual(entry.changes_dict['spare_part'],
+                         {'type': 'm2m', 'operation': 'add', 'objects': [str(part) for part in self.parts]})
+        entries = LogEntry.objects.get_for_object(self.existing).order_by('pk')
+        self.assertEqual([entry.action for entry in entries], [LogEntry.Action.UPDATE] * 2)
+        self.assertEqual([entry.changes_dict['spare_part']['operation'] for entry in entries], ['add', 'delete'])
+        self.assertEqual(entries[0].changes_dict['spare_part']['objects'], [str(self.parts[1])])
+        self.assertIn('update_time', entries[0].changes_dict)
+
+    def test_bulk_import_marks_old_day_stale(self):
+        old_day = self.existing.repair_start_time.date()
+        dataset = tablib.Dataset(
+            [*self.row(self.existing.repair_number, self.asset, 'HD0'), '2024/01/02 08:00:00'],
+            headers=['维修单号', '资产SN', '部门', '维修供应商', '申请人', '故障描述', '维修备件', '维修开始时间'])
+        RepairRecordResource().import_data(dataset)
+        self.assertEqual(list(StaleDay.objects.values_list('day', flat=True)), [old_day])
+        RepairDailyStat.refresh()
+        self.assertEqual(dict(RepairDailyStat.objects.filter(count__gt=0).values_list('day', 'count')),
+                         {date(2024, 1, 2): 1})
@@ -16,4 +16,6 @@ app_name = 'repair'
 urlpatterns = [
     path('department_to_spare/', views.department_to_spare, name='department_to_spare'),
     path('supplier_to_spare/', views.supplier_to_spare, name='supplier_to_spare'),
+    path('repair_trend/', views.repair_trend, name='repair_trend'),
+    path('analytics/', views.repair_analytics, name='repair_analytics'),
 ]
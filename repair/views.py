@@ -1,10 +1,29 @@
+from datetime import date, timedelta
+
+from django.contrib import admin
+from django.contrib.admin.views.decorators import staff_member_required
+from django.core.cache import cache
 from django.db import models
 from django.http import HttpResponse
+from django.shortcuts import render
 from pyecharts import options as opts
 
-from assets.models import Assetsmanager
-from repair.models import RepairRecord
-from utils.sunburst_chart import generate_sunburst_chart
+from assets.models import DataVersion
+from repair.models import RepairDailyStat, RepairRecord, RepairStat
+from utils.repair_analytics import REPEAT_FAILURE_DAYS, get_report, table_labels, to_xlsx
+from utils.sunburst_chart import cached_chart_response, generate_line_chart, generate_sunburst_chart
+from utils.user_scope import get_user_scope
+
+# 维修趋势图可选的分组维度：{参数: (维修日统计的分组字段, 名称, 选项显示名称)}
+TREND_DIMENSIONS = {
+    'department': ('department__name', '部门', None),
+    'supplier': ('supplier__name', '供应商', None),
+    'repair_status': ('repair_status', '维修状态', dict(RepairRecord.REPAIR_STATUS_CHOICES)),
+    'repair_type': ('repair_type', '维修类别', dict(RepairRecord.REPAIR_TYPE_CHOICES)),
+}
+TREND_MAX_SERIES = 10  # 趋势图最多显示的系列数，其余合并为"其他"
+TREND_REFRESH_INTERVAL = 60  # 打开趋势图时增量刷新维修日统计的最小间隔(秒)
+ANALYTICS_PAGE_ROWS = 100  # 维修分析页面每个表格显示的行数，xlsx下载包含全部行
 
 
 def department_to_spare(request):
@@ -17,71 +36,147 @@ def department_to_spare(request):
         返回值:
         - HttpResponse对象，包含渲染的旭日图HTML代码。
         """
-    user = request.user
-    if user.is_superuser:
-        # 超级用户，获取所有部门的维修记录数据
-        records = RepairRecord.objects.values('department__name', 'spare_part__type__name').annotate(
-            count=models.Count('id'))
-    else:
-        # 资产管理员，只获取其管理的部门的维修记录数据
-        department = Assetsmanager.objects.get(user=user).department
-        records = (RepairRecord.objects.filter(department=department)
-                   .values('department__name', 'spare_part__type__name').annotate(count=models.Count('id')))
-
-    # 处理维修记录数据，生成部门和备件类型的统计字典
-    data_dict = {}
-    total_count = 0
-    for record in records:
-        if record['department__name'] not in data_dict:
-            data_dict[record['department__name']] = {}
-        data_dict[record['department__name']][record['spare_part__type__name']] = record['count']
-        total_count += record['count']
-
-    # 将部门和备件类型统计数据转换为旭日图所需的格式
-    data = []
-    for department, spare_part_types in data_dict.items():
-        children = []
-        for spare_part_type, count in spare_part_types.items():
-            children.append(opts.SunburstItem(name=spare_part_type, value=count))
-        data.append(opts.SunburstItem(name=department, children=children))
-
-    # 创建旭日图对象
-
-    chart = generate_sunburst_chart(data, f"部门各备件类型资产维修记录 (总记录数: {total_count})")
-
-    return HttpResponse(chart)
+    scope = get_user_scope(request)
+    # 从维修统计表读取，统计表由信号增量维护，大小与维修记录数量无关；资产管理员只获取其管理的部门的维修记录数据
+    stats = scope.filter(RepairStat.objects.filter(count__gt=0))
+
+    def render():
+        records = (stats.values('department__name', 'spare_part_type__name')
+                   .annotate(count=models.Sum('count')).order_by())
+
+        # 处理维修记录数据，生成部门和备件类型的统计字典
+        data_dict = {}
+        total_count = 0
+        for record in records:
+            if record['department__name'] not in data_dict:
+                data_dict[record['department__name']] = {}
+            data_dict[record['department__name']][record['spare_part_type__name']] = record['count']
+            total_count += record['count']
+
+        # 将部门和备件类型统计数据转换为旭日图所需的格式
+        data = []
+        for department_name, spare_part_types in data_dict.items():
+            children = []
+            for spare_part_type, count in spare_part_types.items():
+                children.append(opts.SunburstItem(name=spare_part_type, value=count))
+            data.append(opts.SunburstItem(name=department_name, children=children))
+
+        # 创建旭日图对象
+
+        return generate_sunburst_chart(data, f"部门各备件类型资产维修记录 (总记录数: {total_count})")
+
+    return cached_chart_response(request, 'department_to_spare', scope.cache_key, DataVersion.get('repair'), render)
 
 
 def supplier_to_spare(request):
     """
     根据资产管理员权限展示供应商各备件类型资产维修记录的旭日图。
     """
-    user = request.user
-    if user.is_superuser:
-        # 超级用户，获取所有供应商的维修记录数据
-        records = RepairRecord.objects.values('supplier__name', 'spare_part__type__name').annotate(
-            count=models.Count('id'))
-    else:
-        # 资产管理员，只获取其管理的部门的维修记录数据
-        department = Assetsmanager.objects.get(user=user).department
-        records = (RepairRecord.objects.filter(department=department)
-                   .values('supplier__name', 'spare_part__type__name').annotate(count=models.Count('id')))
-
-    data_dict = {}
-    total_count = 0
-    for record in records:
-        if record['supplier__name'] not in data_dict:
-            data_dict[record['supplier__name']] = {}
-        data_dict[record['supplier__name']][record['spare_part__type__name']] = record['count']
-        total_count += record['count']
-
-    data = []
-    for supplier, spare_part_types in data_dict.items():
-        children = []
-        for spare_part_type, count in spare_part_types.items():
-            children.append(opts.SunburstItem(name=spare_part_type, value=count))
-        data.append(opts.SunburstItem(name=supplier, children=children))
-
-    chart = generate_sunburst_chart(data, f"供应商各备件类型资产维修记录 (总记录数: {total_count})")
-
-    return HttpResponse(chart)
+    scope = get_user_scope(request)
+    # 资产管理员，只获取其管理的部门的维修记录数据
+    stats = scope.filter(RepairStat.objects.filter(count__gt=0))
+
+    def render():
+        records = (stats.values('supplier__name', 'spare_part_type__name')
+                   .annotate(count=models.Sum('count')).order_by())
+
+        data_dict = {}
+        total_count = 0
+        for record in records:
+            if record['supplier__name'] not in data_dict:
+                data_dict[record['supplier__name']] = {}
+            data_dict[record['supplier__name']][record['spare_part_type__name']] = record['count']
+            total_count += record['count']
+
+        data = []
+        for supplier, spare_part_types in data_dict.items():
+            children = []
+            for spare_part_type, count in spare_part_types.items():
+                children.append(opts.SunburstItem(name=spare_part_type, value=count))
+            data.append(opts.SunburstItem(name=supplier, children=children))
+
+        return generate_sunburst_chart(data, f"供应商各备件类型资产维修记录 (总记录数: {total_count})")
+
+    return cached_chart_response(request, 'supplier_to_spare', scope.cache_key, DataVersion.get('repair'), render)
+
+
+def repair_trend(request):
+    """
+    维修趋势图：最近N周每周的维修记录数，按部门、供应商、维修状态或维修类别分组。
+    只读取维修日统计表中时间窗口内的行，查询量与历史数据的多少无关。
+
+    参数:
+    - request: HttpRequest对象，?by= 分组维度(默认 department)，?weeks= 周数(默认26，最多104)。
+
+    返回值:
+    - HttpResponse对象，包含渲染的折线图HTML代码。
+    """
+    by = request.GET.get('by') if request.GET.get('by') in TREND_DIMENSIONS else 'department'
+    weeks = request.GET.get('weeks', '26')
+    weeks = min(int(weeks), 104) if weeks.isdigit() and int(weeks) > 0 else 26
+    field, label, choices = TREND_DIMENSIONS[by]
+    # 每个进程最多每 TREND_REFRESH_INTERVAL 秒增量刷新一次，定时任务可运行 manage.py refresh_repair_rollup
+    if cache.add('repair_trend:refreshed', 1, TREND_REFRESH_INTERVAL):
+        RepairDailyStat.refresh()
+
+    scope = get_user_scope(request)
+    today = date.today()
+    start = today - timedelta(days=today.weekday(), weeks=weeks - 1)  # 第一周的周一
+
+    def render():
+        # 导入的维修开始时间可能晚于今天，只取窗口内的日期
+        end = start + timedelta(weeks=weeks)
+        rows = (scope.filter(RepairDailyStat.objects.filter(day__gte=start, day__lt=end, count__gt=0))
+                .values('day', field).annotate(count=models.Sum('count')).order_by())
+        week_starts = [start + timedelta(weeks=i) for i in range(weeks)]
+        counts = {}
+        for row in rows:
+            name = choices.get(row[field], row[field]) if choices else row[field]
+            values = counts.setdefault(name, [0] * weeks)
+            values[(row['day'] - start).days // 7] += row['count']
+        ranked = sorted(counts.items(), key=lambda item: sum(item[1]), reverse=True)
+        series = ranked[:TREND_MAX_SERIES]
+        if len(ranked) > TREND_MAX_SERIES:
+            series.append(('其他', [sum(values) for values in zip(*(v for _, v in ranked[TREND_MAX_SERIES:]))]))
+        total = sum(sum(values) for _, values in ranked)
+        return generate_line_chart([day.isoformat() for day in week_starts], series,
+                                   f"最近{weeks}周各{label}维修记录数 (总记录数: {total})")
+
+    return cached_chart_response(request, 'repair_trend', f'{scope.cache_key}:{by}:{weeks}',
+                                 f"{DataVersion.get('repair')}:{today}", render)
+
+
+@staff_member_required
+def repair_analytics(request):
+    """
+    维修分析报表：各部门、供应商、备件类型的维修时长(均值/中位数/P90)、重复故障率和每单备件数，以及重复故障的资产。
+    资产管理员只统计其管理部门的维修记录。
+
+    参数:
+    - request: HttpRequest对象，?format=xlsx 下载全部表格。
+
+    返回值:
+    - HttpResponse对象，报表页面或xlsx文件。
+    """
+    scope = get_user_scope(request)
+    report, seconds = get_report(scope.filter(RepairRecord.objects.all()), scope.cache_key)
+    if request.GET.get('format') == 'xlsx':
+        response = HttpResponse(to_xlsx(report),
+                                content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
+        response['Content-Disposition'] = f'attachment; filename="repair_analytics_{date.today():%Y%m%d}.xlsx"'
+        return response
+
+    tables = []
+    for name, table in report.items():
+        title, columns = table_labels(name)
+        head = table.head(ANALYTICS_PAGE_ROWS)
+        rows = head.astype(object).where(head.notna(), '-').values.tolist()
+        tables.append({'title': title, 'headers': [columns.get(column, column) for column in table.columns],
+                       'rows': rows, 'total': len(table)})
+    return render(request, 'repair/repair_analytics.html', {
+        **admin.site.each_context(request),
+        'tables': tables,
+        'limit': ANALYTICS_PAGE_ROWS,
+        'repeat_days': REPEAT_FAILURE_DAYS,
+        'seconds': seconds,
+    })
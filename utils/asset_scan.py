@@ -0,0 +1,77 @@
+"""
+-*- coding: utf-8 -*-
+ @Author: li
+ @ProjectName: ITAssets
+ @Email: lijianqiao2906@live.com
+ @FileName: asset_scan.py
+ @DateTime: 2024/4/29 上午9:30
+ @Docs: 扫码查看资产：按 (资产ID, 修改时间) 缓存扫码页面所需的数据(含业务线、部门、供应商名称)。
+        资产的保存、批量修改、维修次数变化都会更新修改时间，旧缓存不再被读取，多进程各自缓存时也不会读到旧数据；
+        业务线/部门/供应商修改时递增缓存代数使全部缓存失效(多进程部署需配置共享缓存)
+"""
+from django.conf import settings
+from django.core.cache import cache
+
+from assets.models import Assets
+
+# 扫码缓存代数，业务线、部门、供应商变化时递增，使所有资产的扫码缓存失效
+SCAN_GENERATION_KEY = 'asset_scan:generation'
+
+
+def _cache_key(pk, update_time):
+    generation = cache.get_or_set(SCAN_GENERATION_KEY, 0, None)
+    return f'asset_scan:{generation}:{pk}:{update_time.isoformat()}'
+
+
+def _load_scan_data(pk):
+    asset = Assets.objects.select_related('bussline', 'department', 'supplier').filter(pk=pk).first()
+    if asset is None:
+        return None
+    return {
+        'id': asset.pk,
+        'name': asset.name,
+        'sn': asset.sn,
+        'asset_type': asset.get_asset_type_display(),
+        'status': asset.status,
+        'status_display': asset.get_status_display(),
+        'is_active': asset.is_active,
+        'bussline': asset.bussline.name,
+        'department_id': asset.department_id,
+        'department': asset.department.name,
+        'asset_location': asset.asset_location,
+        'supplier': asset.supplier.name,
+        'purchase_date': asset.purchase_date.isoformat(),
+        'expire_date': asset.expire_date,
+        'warranty_end': asset.warranty_end.isoformat() if asset.warranty_end else None,
+        'repair_count': asset.repair_count,
+        'update_time': asset.update_time.isoformat(),
+    }
+
+
+def find_asset(sn):
+    """按资产编号(唯一索引)查询资产ID和修改时间，资产不存在时为None"""
+    return Assets.objects.filter(sn=sn).values_list('pk', 'update_time').first()
+
+
+def get_scan_data(pk, update_time):
+    """
+    获取资产的扫码数据，未缓存时联表查询一次并缓存 ASSET_SCAN_CACHE_TIMEOUT 秒。
+    :param pk: 资产ID
+    :param update_time: 资产的修改时间
+    :return: 字典，资产不存在时为None
+    """
+    key = _cache_key(pk, update_time)
+    data = cache.get(key)
+    if data is None:
+        data = _load_scan_data(pk)
+        if data is not None:
+            cache.set(key, data, settings.ASSET_SCAN_CACHE_TIMEOUT)
+    return data
+
+
+def invalidate_all_asset_scans():
+    """使所有资产的扫码缓存失效"""
+    try:
+        cache.incr(SCAN_GENERATION_KEY)
+    except ValueError:
+        cache.set(SCAN_GENERATION_KEY, 1, None)
@@ -0,0 +1,162 @@
+"""
+-*- coding: utf-8 -*-
+ @Author: li
+ @ProjectName: ITAssets
+ @Email: lijianqiao2906@live.com
+ @FileName: audit_archive.py
+ @DateTime: 2024/4/26 上午9:40
+ @Docs: 审计日志归档文件：按月存放的 gzip 压缩 JSONL，每次归档运行单独写一个文件，每块日志是一个完整的 gzip 成员，
+        中断时最多留下一个不完整的末尾成员(读取时跳过，对应的日志仍在日志表中，下次归档会重新写入)
+"""
+import gzip
+import json
+import os
+import zlib
+from datetime import datetime
+from pathlib import Path
+
+from auditlog.models import LogEntry
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.core.exceptions import FieldDoesNotExist
+from django.db import models
+
+from utils.audit_buffer import registry
+
+M2M_OPERATION_DISPLAY = {'add': '添加', 'delete': '删除'}
+
+
+def archive_dir():
+    return Path(settings.AUDITLOG_ARCHIVE_DIR)
+
+
+def archive_files(month):
+    """某个月的全部归档文件(每次归档或合并运行一个)"""
+    return sorted(archive_dir().glob(f'logentry-{month}-*.jsonl.gz'))
+
+
+def entry_to_record(entry):
+    """日志转换为可写入JSONL的字典，内容类型和操作人同时保存名称，不依赖数据库中的ID"""
+    return {
+        'id': entry.pk,
+        'content_type': entry.content_type.natural_key(),
+        'object_pk': entry.object_pk,
+        'object_id': entry.object_id,
+        'object_repr': entry.object_repr,
+        'action': entry.action,
+        'changes': entry.changes,
+        'actor_id': entry.actor_id,
+        'actor': str(entry.actor) if entry.actor_id else None,
+        'remote_addr': entry.remote_addr,
+        'timestamp': entry.timestamp.isoformat(),
+        'additional_data': entry.additional_data,
+        'serialized_data': entry.serialized_data,
+    }
+
+
+def record_to_entry(record):
+    """归档记录还原为(不保存的)日志对象，供历史记录页面显示"""
+    entry = LogEntry(
+        id=record['id'], content_type=ContentType.objects.get_by_natural_key(*record['content_type']),
+        object_pk=record['object_pk'], object_id=record['object_id'], object_repr=record['object_repr'],
+        action=record['action'], changes=record['changes'], remote_addr=record['remote_addr'],
+        timestamp=datetime.fromisoformat(record['timestamp']), additional_data=record['additional_data'],
+        serialized_data=record['serialized_data'],
+    )
+    entry.actor_repr = record['actor']
+    return entry
+
+
+def write_chunk(path, records):
+    """把一块日志作为一个完整的 gzip 成员追加到文件，并确保写入磁盘"""
+    with open(path, 'ab') as f:
+        with gzip.GzipFile(fileobj=f, mode='wb') as gz:
+            for record in records:
+                gz.write(json.dumps(record, ensure_ascii=False).encode('utf-8') + b'\n')
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def iter_records(path, contains=None):
+    """
+    逐行读取归档文件，遇到不完整的末尾成员时停止。
+    :param contains: 只解析包含该字符串的行(按原始文本预先过滤，避免逐行解析JSON)
+    """
+    try:
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            for line in f:
+                if contains is None or contains in line:
+                    yield json.loads(line)
+    except (EOFError, gzip.BadGzipFile, zlib.error, json.JSONDecodeError):
+        return
+
+
+def archived_entries(obj):
+    """
+    读取一个对象的归档日志：只打开归档索引中记录的月份，按日志ID去重(归档中断重跑时可能重复写入)。
+    :param obj: 模型对象
+    :return: 按时间倒序的日志对象列表
+    """
+    from assets.models import AuditArchive
+    content_type = ContentType.objects.get_for_model(obj)
+    object_pk = str(obj.pk)
+    natural_key = list(content_type.natural_key())
+    marker = f'"object_pk": {json.dumps(object_pk, ensure_ascii=False)},'  # 与 write_chunk 的序列化格式一致
+    entries = {}
+    for month in AuditArchive.objects.filter(content_type=content_type, object_pk=object_pk).values_list(
+            'month', flat=True):
+        for path in archive_files(month):
+            for record in iter_records(path, marker):
+                if record['object_pk'] == object_pk and record['content_type'] == natural_key:
+                    entries[record['id']] = record
+    return sorted((record_to_entry(record) for record in entries.values()), key=lambda e: e.timestamp, reverse=True)
+
+
+def change_rows(entry):
+    """
+    历史记录页面显示的变更：[(字段名称, 变更内容)]，普通字段为"旧值 → 新值"，多对多字段为"添加/删除 关联对象"
+    """
+    model = entry.content_type.model_class()
+    mapping = registry.get_model_fields(model)['mapping_fields'] if registry.contains(model) else {}
+    rows, m2m = [], []
+    for name, change in entry.changes_dict.items():
+        try:
+            field = model._meta.get_field(name)
+        except FieldDoesNotExist:
+            field = None
+        label = str(mapping.get(name) or (field.verbose_name if field else name))
+        if isinstance(change, dict):
+            operation = M2M_OPERATION_DISPLAY.get(change.get('operation'), change.get('operation'))
+            m2m.append((label, f"{operation} {', '.join(change.get('objects', []))}"))
+        else:
+            rows.append((label, ' → '.join(display_value(field, value) for value in change[:2])))
+    return rows + m2m
+
+
+def display_value(field, value):
+    """日志中的字段值(字符串)转换为显示内容：选项字段显示选项名称，过长的值截断"""
+    if field is not None and field.choices:
+        value = dict((str(key), label) for key, label in field.flatchoices).get(value, value)
+    value = str(value)
+    return f"{value[:140]}..." if len(value) > 140 else value
+
+
+def object_history(obj, include_archive=False):
+    """
+    对象的审计日志：先读取日志表，include_archive 为真且有归档时再读取归档文件。
+    :param obj: 模型对象
+    :param include_archive: 是否读取归档
+    :return: (按时间倒序的日志列表, 归档日志条数)
+    """
+    from assets.models import AuditArchive
+    entries = list(LogEntry.objects.get_for_object(obj).select_related('actor'))
+    for entry in entries:
+        entry.actor_repr = str(entry.actor) if entry.actor_id else None
+    archived = AuditArchive.objects.filter(
+        content_type=ContentType.objects.get_for_model(obj), object_pk=str(obj.pk)).aggregate(
+        total=models.Sum('entries'))['total'] or 0
+    if include_archive and archived:
+        entries += archived_entries(obj)
+    for entry in entries:
+        entry.change_rows = change_rows(entry)
+    return entries, archived
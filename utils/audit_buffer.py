@@ -0,0 +1,303 @@
+"""
+-*- coding: utf-8 -*-
+ @Author: li
+ @ProjectName: ITAssets
+ @Email: lijianqiao2906@live.com
+ @FileName: audit_buffer.py
+ @DateTime: 2024/4/25 上午9:30
+ @Docs: 审计日志合并写入：替换 auditlog 默认的信号接收函数，变更在事务提交后才进入缓冲区，
+        同一请求内对同一对象的多次保存合并为一条差异，请求结束时用一次 bulk_create 写入。
+        模型不注册到 auditlog 的注册表(注册时会连接逐条写入的接收函数)，字段配置保存在本模块的注册表中，
+        只使用 auditlog 的 LogEntry 模型、差异取值函数和 set_actor 上下文
+"""
+import contextlib
+import json
+import threading
+from functools import partial
+
+from auditlog.diff import get_field_value, get_fields_in_model, mask_str
+from auditlog.models import LogEntry
+from auditlog.receivers import check_disable
+from auditlog.registry import AuditLogRegistrationError, AuditlogModelRegistry
+from django.contrib.contenttypes.models import ContentType
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_save
+from django.utils.encoding import smart_str
+
+# 多对多变化信号 -> auditlog 的操作名称；清空时在清空前读取关联对象
+M2M_OPERATIONS = {'post_add': 'add', 'post_remove': 'delete', 'pre_clear': 'delete'}
+
+_local = threading.local()
+
+# 审计的模型及其字段配置(include_fields、exclude_fields、mapping_fields、mask_fields)。
+# 独立的注册表，不连接任何信号，接收函数由 register() 连接
+registry = AuditlogModelRegistry(create=False, update=False, delete=False, access=False, m2m=False)
+
+
+class AuditBuffer:
+    """
+    一个缓冲范围内已提交的审计日志，按 (内容类型, 主键) 合并：
+    - 字段差异保留最早的旧值和最新的新值，改回原值的字段不再记录
+    - 范围内新建后又删除的对象不记录
+    - 多对多字段同一操作(add/delete)的对象合并；同一字段既有添加又有删除时分为两条
+    """
+
+    def __init__(self):
+        self.entries = {}
+
+    def add(self, entry):
+        key = (entry.content_type_id, entry.object_pk)
+        pending = self.entries.get(key)
+        if pending is None:
+            self.entries[key] = [entry]
+        elif entry.action == LogEntry.Action.DELETE:
+            if pending[0].action == LogEntry.Action.CREATE:
+                del self.entries[key]
+                return
+            for field, change in entry.changes.items():
+                previous = pending[0].changes.get(field)
+                if isinstance(previous, (list, tuple)):
+                    entry.changes[field] = (previous[0], change[1])
+            self.entries[key] = [entry]
+        else:
+            self._merge(pending, entry)
+
+    @staticmethod
+    def _merge(pending, entry):
+        first = pending[0]
+        first.object_repr = entry.object_repr
+        first.serialized_data = entry.serialized_data
+        for field, change in entry.changes.items():
+            if isinstance(change, dict):  # 多对多
+                target = next((e for e in pending
+                               if e.changes.get(field, change)['operation'] == change['operation']), None)
+                if target is None:
+                    extra = LogEntry(**{f.attname: getattr(entry, f.attname) for f in LogEntry._meta.concrete_fields})
+                    extra.changes = {field: change}
+                    pending.append(extra)
+                elif field in target.changes:
+                    objects = target.changes[field]['objects']
+                    objects.extend(obj for obj in change['objects'] if obj not in objects)
+                else:
+                    target.changes[field] = change
+                continue
+            previous = first.changes.get(field)
+            old = previous[0] if previous else change[0]
+            if old == change[1] and first.action == LogEntry.Action.UPDATE:
+                first.changes.pop(field, None)
+            else:
+                first.changes[field] = (old, change[1])
+
+    def flush(self):
+        """写入缓冲的日志(一条 INSERT)，合并后没有差异的修改日志不写入"""
+        entries = [entry for pending in self.entries.values() for entry in pending
+                   if entry.changes or entry.action != LogEntry.Action.UPDATE]
+        self.entries = {}
+        for entry in entries:
+            entry.changes = json.dumps(entry.changes)
+        if entries:
+            self._delete_reused(entries)
+            LogEntry.objects.bulk_create(entries)
+        return entries
+
+    @staticmethod
+    def _delete_reused(entries):
+        """与 auditlog 相同：新增对象的主键被重复使用时，删除之前使用该主键的对象的日志"""
+        created = {}
+        for entry in entries:
+            if entry.action == LogEntry.Action.CREATE:
+                created.setdefault(entry.content_type_id, []).append(entry.object_pk)
+        for content_type_id, object_pks in created.items():
+            for i in range(0, len(object_pks), 1000):
+                LogEntry.objects.filter(content_type_id=content_type_id, object_pk__in=object_pks[i:i + 1000]).delete()
+
+
+@contextlib.contextmanager
+def buffered_audit():
+    """
+    缓冲范围：范围内提交的审计日志合并后在退出时一次写入，可嵌套(由最外层写入)。
+    请求由 AuditBufferMiddleware 包裹，管理命令中批量修改数据时可直接使用。
+    """
+    if getattr(_local, 'buffer', None) is not None:
+        yield _local.buffer
+        return
+    _local.buffer = buffer = AuditBuffer()
+    try:
+        yield buffer
+    finally:
+        _local.buffer = None
+        buffer.flush()
+
+
+class AuditBufferMiddleware:
+    """审计日志合并写入中间件，放在 AuditlogMiddleware 之后"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with buffered_audit():
+            return self.get_response(request)
+
+
+def _stage(entry):
+    """事务提交后把日志放入当前缓冲范围，不在缓冲范围内时立即写入"""
+    buffer = getattr(_local, 'buffer', None)
+    if buffer is None:
+        buffer = AuditBuffer()
+        buffer.add(entry)
+        buffer.flush()
+    else:
+        buffer.add(entry)
+
+
+def _log(instance, action, changes):
+    """
+    生成日志并登记到事务提交后写入；回滚的事务(或保存点)中的变更不会记录。
+    操作人和IP在此时由 auditlog 的 set_actor 上下文填入。
+    """
+    pk = instance.pk
+    entry = LogEntry(
+        content_type=ContentType.objects.get_for_model(instance),
+        object_pk=smart_str(pk),
+        object_id=pk if isinstance(pk, int) else None,
+        object_repr=smart_str(instance),
+        action=action,
+        changes=changes,
+    )
+    get_additional_data = getattr(instance, 'get_additional_data', None)
+    if callable(get_additional_data):
+        entry.additional_data = get_additional_data()
+    pre_save.send(sender=LogEntry, instance=entry, raw=False, using=instance._state.db, update_fields=None)
+    transaction.on_commit(partial(_stage, entry), using=instance._state.db)
+
+
+def model_diff(old, new, fields_to_check=None):
+    """
+    两个对象的字段差异，与 auditlog.diff.model_instance_diff 相同，字段配置从本模块的注册表读取。
+    :param old: 修改前的对象，新增时为 None
+    :param new: 修改后的对象，删除时为 None
+    :param fields_to_check: 只比较这些字段
+    :return: {字段名: (旧值, 新值)}，没有差异时为 None
+    """
+    instance = new if new is not None else old
+    config = registry.get_model_fields(instance.__class__)
+    if old is not None and new is not None:
+        fields = set(instance._meta.fields)
+    else:
+        fields = set(get_fields_in_model(instance))
+    if fields_to_check:
+        fields = {field for field in fields if field.name in fields_to_check}
+    if config['include_fields']:
+        fields = {field for field in fields if field.name in config['include_fields']}
+    fields = {field for field in fields if field.name not in config['exclude_fields']}
+    diff = {}
+    for field in fields:
+        old_value, new_value = get_field_value(old, field), get_field_value(new, field)
+        if old_value != new_value:
+            if field.name in config['mask_fields']:
+                diff[field.name] = (mask_str(smart_str(old_value)), mask_str(smart_str(new_value)))
+            else:
+                diff[field.name] = (smart_str(old_value), smart_str(new_value))
+    return diff or None
+
+
+@check_disable
+def log_pre_save(sender, instance, **kwargs):
+    """保存前读取数据库中的旧值，外键对象一并查出，避免比较差异时逐个加载"""
+    if instance.pk is None:
+        return
+    related = [field.name for field in sender._meta.concrete_fields if field.is_relation]
+    instance._audit_old = sender._default_manager.select_related(*related).filter(pk=instance.pk).first()
+
+
+@check_disable
+def log_save(sender, instance, created, update_fields=None, **kwargs):
+    old = instance.__dict__.pop('_audit_old', None)
+    if created:
+        _log(instance, LogEntry.Action.CREATE, model_diff(None, instance) or {})
+    elif old is not None:
+        changes = model_diff(old, instance, fields_to_check=update_fields)
+        if changes:
+            _log(instance, LogEntry.Action.UPDATE, changes)
+
+
+@check_disable
+def log_delete(sender, instance, **kwargs):
+    if instance.pk is not None:
+        _log(instance, LogEntry.Action.DELETE, model_diff(instance, None) or {})
+
+
+@check_disable
+def log_bulk_create(instances):
+    """
+    为 bulk_create 批量新增补写审计日志，与逐个保存时记录的新增日志相同。
+    :param instances: 已写入并带有主键的对象，外键字段应已关联
+    """
+    if not instances or not registry.contains(instances[0].__class__):
+        return
+    for instance in instances:
+        _log(instance, LogEntry.Action.CREATE, model_diff(None, instance) or {})
+
+
+@check_disable
+def log_bulk_update(pairs, fields):
+    """
+    为 queryset.update()/bulk_update 批量修改补写审计日志，与逐个保存时记录的差异相同。
+    :param pairs: [(修改前的对象, 修改后的对象)]，外键字段应已 select_related
+    :param fields: 比较的字段名
+    """
+    if not pairs or not registry.contains(pairs[0][1].__class__):
+        return
+    for old, new in pairs:
+        changes = model_diff(old, new, fields_to_check=fields)
+        if changes:
+            _log(new, LogEntry.Action.UPDATE, changes)
+
+
+@check_disable
+def log_m2m_change(instance, field_name, operation, objects):
+    """
+    记录多对多字段的变化，与 m2m_changed 信号记录的日志相同；用于不触发信号的批量写入关联表。
+    :param operation: 'add' 或 'delete'
+    :param objects: 添加或删除的关联对象
+    """
+    objects = [smart_str(obj) for obj in objects]
+    if objects and registry.contains(instance.__class__):
+        _log(instance, LogEntry.Action.UPDATE,
+             {field_name: {'type': 'm2m', 'operation': operation, 'objects': objects}})
+
+
+def make_log_m2m_changes(model_class, field_name):
+    """生成多对多字段变化的信号接收函数，正向和反向修改都记录在发生修改的一方"""
+    field = model_class._meta.get_field(field_name)
+
+    @check_disable
+    def log_m2m_changes(sender, instance, action, reverse, model, pk_set, **kwargs):
+        operation = M2M_OPERATIONS.get(action)
+        if operation is None:
+            return
+        if action == 'pre_clear':
+            changed = model._default_manager.filter(**{field_name if reverse else field.related_query_name(): instance})
+        elif pk_set:
+            changed = model._default_manager.filter(pk__in=pk_set)
+        else:
+            return
+        log_m2m_change(instance, field_name, operation, changed)
+
+    return log_m2m_changes
+
+
+def register(model, m2m_fields=None, **kwargs):
+    """
+    代替 auditlog.register 注册模型，参数相同(不支持 serialize_data，合并写入的日志不保存对象快照)。
+    字段配置保存在本模块的注册表中，保存、删除和多对多字段的变化由本模块的接收函数记录。
+    """
+    if kwargs.get('serialize_data'):
+        raise AuditLogRegistrationError(f'{model._meta.label}: 合并写入的审计日志不支持 serialize_data')
+    registry.register(model, m2m_fields=m2m_fields, **kwargs)
+    for signal, receiver in ((pre_save, log_pre_save), (post_save, log_save), (post_delete, log_delete)):
+        signal.connect(receiver, sender=model, dispatch_uid=f'audit_buffer:{model._meta.label}.{receiver.__name__}')
+    for field_name in m2m_fields or ():
+        m2m_changed.connect(make_log_m2m_changes(model, field_name), sender=getattr(model, field_name).through,
+                            weak=False, dispatch_uid=f'audit_buffer:{model._meta.label}.{field_name}')
@@ -0,0 +1,66 @@
+"""
+-*- coding: utf-8 -*-
+ @Author: li
+ @ProjectName: ITAssets
+ @Email: lijianqiao2906@live.com
+ @FileName: bulk_edit.py
+ @DateTime: 2024/4/28 上午9:30
+ @Docs: 批量修改：按主键分块，每块一条 UPDATE，模型的业务规则以SQL表达式执行；
+        修改前后各查询一次本块数据，差异作为审计日志经 audit_buffer 合并后批量写入
+"""
+from django.db import transaction
+from django.dispatch import Signal
+from django.utils import timezone
+
+from utils.audit_buffer import buffered_audit, log_bulk_update
+
+BULK_EDIT_CHUNK_SIZE = 1000  # 每块修改的行数
+
+# 每块修改完成后发送，参数 old: {主键: 修改前的对象}，new: [修改后的对象]；
+# queryset.update() 不触发 post_save，依赖保存信号维护的统计、索引在此增量更新
+bulk_edited = Signal()
+
+
+def attach_related(objs, fields):
+    """按外键批量读取关联对象并放入对象缓存，审计日志显示外键时不再逐个查询(行锁查询不能联表外连接)"""
+    for field in fields:
+        ids = {getattr(obj, field.attname) for obj in objs} - {None}
+        related = field.related_model._default_manager.in_bulk(ids) if ids else {}
+        for obj in objs:
+            field.set_cached_value(obj, related.get(getattr(obj, field.attname)))
+
+
+def bulk_edit(queryset, chunk_size=BULK_EDIT_CHUNK_SIZE, **values):
+    """
+    批量修改查询集中的对象，已经是目标值的行不修改。
+    模型可定义 bulk_edit_values(values) 类方法，把与 save() 相同的规则转换为 UPDATE 的字段值(可以是SQL表达式)。
+    :param queryset: 查询集
+    :param chunk_size: 每块的行数
+    :param values: {字段名: 新值}
+    :return: 实际修改的行数
+    """
+    model = queryset.model
+    if hasattr(model, 'bulk_edit_values'):
+        values = model.bulk_edit_values(values)
+    fields = [model._meta.get_field(name) for name in values]
+    related = [field for field in fields if field.is_relation]
+    audit_fields = {*values, 'update_time'}
+    manager = model._default_manager
+    last_pk, total = 0, 0
+    while True:
+        pks = list(queryset.filter(pk__gt=last_pk).order_by('pk').values_list('pk', flat=True)[:chunk_size])
+        if not pks:
+            return total
+        last_pk = pks[-1]
+        with buffered_audit(), transaction.atomic(using=queryset.db):
+            # exclude 多个条件为"任一字段与目标值不同"
+            changed = manager.filter(pk__in=pks).exclude(**values)
+            old = {obj.pk: obj for obj in changed.select_for_update()}
+            if not old:
+                continue
+            manager.filter(pk__in=list(old)).update(**values, update_time=timezone.now())
+            new = list(manager.filter(pk__in=list(old)).order_by('pk'))
+            attach_related([*old.values(), *new], related)
+            log_bulk_update([(old[obj.pk], obj) for obj in new], audit_fields)
+            bulk_edited.send(sender=model, old=old, new=new)
+        total += len(new)
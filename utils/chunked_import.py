@@ -0,0 +1,236 @@
+"""
+-*- coding: utf-8 -*-
+ @Author: li
+ @ProjectName: ITAssets
+ @Email: lijianqiao2906@live.com
+ @FileName: chunked_import.py
+ @DateTime: 2024/5/3 上午9:30
+ @Docs: 大文件分块导入资产：xlsx使用openpyxl只读模式逐行读取(csv逐行读取)，按块在进程池中做纯Python校验和选项名称转换，
+        逐行收集错误而不中断导入，只有校验通过的行按块交给 AssetsResource 写入数据库；内存占用取决于块大小，与文件大小无关
+"""
+import csv
+import functools
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, datetime
+
+IMPORT_CHUNK_SIZE = 2000  # 每块行数
+IMPORT_PENDING_PER_WORKER = 2  # 每个校验进程最多排队的块数，限制读取领先写入的块数
+
+# 选项字段：{字段名: 导入列名}，导入列的值为选项名称
+ASSET_CHOICE_COLUMNS = {'asset_type': '资产类型', 'status': '状态', 'is_active': '是否启用'}
+# 不能为空的字段(列存在时校验，新增资产时这些列必须存在)
+ASSET_REQUIRED_FIELDS = ['bussline', 'department', 'supplier', 'name', 'sn', 'purchase_date', 'expire_date']
+
+
+@functools.lru_cache(maxsize=None)
+def asset_row_rules():
+    """
+    资产行的校验规则：列名和选项 名称->值 的反向字典。
+    只包含普通数据，在主进程生成一次后传给校验进程，校验进程不需要加载Django。
+    """
+    from assets.models import Assets
+    from utils.resource import AssetsResource
+    fields = AssetsResource.fields
+    choices = {
+        'asset_type': {name: code for code, name in Assets.ASSET_TYPE},
+        'status': {name: code for code, name in Assets.ASSET_STATUS},
+        'is_active': {'是': True, '否': False},
+    }
+    return {
+        'choices': [(field, column, choices[field]) for field, column in ASSET_CHOICE_COLUMNS.items()],
+        'required': {name: str(fields[name].column_name) for name in ASSET_REQUIRED_FIELDS},
+        'purchase_date': str(fields['purchase_date'].column_name),
+        'expire_date': str(fields['expire_date'].column_name),
+        'date_formats': list(fields['purchase_date'].widget.formats),
+    }
+
+
+def clean_asset_row(row, rules):
+    """
+    校验一行资产数据，并把选项名称转换为值、日期和整数列转换为对应类型(纯Python，不访问数据库)。
+    :param row: {列名: 值}，原地修改
+    :param rules: asset_row_rules() 的返回值
+    :return: 错误信息列表
+    """
+    errors = []
+    row['repair_count'] = 0  # 维修次数默认为0
+    price = row.get('price')
+    row['price'] = price if isinstance(price, (int, float)) and price >= 0 else 0
+
+    for field, column, choices in rules['choices']:
+        display = row.get(column) or row.get(field)
+        if not display:
+            errors.append(f"{column}不能为空")
+        elif display not in choices:
+            errors.append(f"无效的{column}: {display}")
+        else:
+            row[field] = choices[display]
+
+    for column in rules['required'].values():
+        if column in row and row[column] in (None, ''):
+            errors.append(f"{column}不能为空")
+
+    column = rules['purchase_date']
+    value = row.get(column)
+    if isinstance(value, datetime):
+        row[column] = value.date()
+    elif value and not isinstance(value, date):
+        for date_format in rules['date_formats']:
+            try:
+                row[column] = datetime.strptime(str(value).strip(), date_format).date()
+                break
+            except ValueError:
+                continue
+        else:
+            errors.append(f"{column}格式应为 {rules['date_formats'][0]}: {value}")
+
+    column = rules['expire_date']
+    value = row.get(column)
+    if value not in (None, ''):
+        if isinstance(value, float) and value.is_integer():
+            value = int(value)
+        elif isinstance(value, str) and value.strip().isdigit():
+            value = int(value.strip())
+        if isinstance(value, int) and not isinstance(value, bool) and value >= 0:
+            row[column] = value
+        else:
+            errors.append(f"{column}应为非负整数: {value}")
+    return errors
+
+
+def validate_chunk(rows, rules):
+    """
+    校验一块数据(在校验进程中执行)。
+    :param rows: [(行号, {列名: 值})]
+    :return: (校验通过的 [(行号, 行)], 错误 [(行号, 错误信息)])
+    """
+    valid, errors = [], []
+    for number, row in rows:
+        row_errors = clean_asset_row(row, rules)
+        if row_errors:
+            errors.extend((number, message) for message in row_errors)
+        else:
+            valid.append((number, row))
+    return valid, errors
+
+
+def _cell(value):
+    if isinstance(value, str):
+        value = value.strip()
+    return value
+
+
+def iter_chunks(path, chunk_size=IMPORT_CHUNK_SIZE):
+    """
+    逐行读取xlsx(第一个工作表)或csv文件，按块返回 (表头, [(行号, {列名: 值})])，跳过空行。
+    行号与表格软件中显示的一致(表头为第1行)。
+    """
+    if path.lower().endswith('.csv'):
+        f = open(path, newline='', encoding='utf-8-sig')
+        reader, close = csv.reader(f), f.close
+    else:
+        from openpyxl import load_workbook
+        workbook = load_workbook(path, read_only=True, data_only=True)
+        reader, close = workbook.worksheets[0].iter_rows(values_only=True), workbook.close
+    try:
+        headers = [str(_cell(value)) if value is not None else '' for value in next(reader, [])]
+        chunk = []
+        for number, values in enumerate(reader, 2):
+            values = [_cell(value) for value in values]
+            if all(value in (None, '') for value in values):
+                continue
+            chunk.append((number, dict(zip(headers, values))))
+            if len(chunk) >= chunk_size:
+                yield headers, chunk
+                chunk = []
+        if chunk:
+            yield headers, chunk
+    finally:
+        close()
+
+
+class ChunkedImportResult:
+    """分块导入结果：各类行数和逐行错误"""
+
+    def __init__(self):
+        self.totals = {'rows': 0, 'valid': 0, 'new': 0, 'update': 0, 'skip': 0}
+        self.errors = []  # [(行号, 错误信息)]
+
+    @property
+    def error_rows(self):
+        return len({number for number, _ in self.errors})
+
+
+def write_chunk(rows, headers, result, dry_run):
+    """把一块校验通过的行交给 AssetsResource 写入，写入时的错误按原始行号记录"""
+    import tablib
+    from utils.resource import AssetsChunkImportResource
+
+    columns = list(dict.fromkeys([*headers, *(key for _, row in rows for key in row)]))
+    dataset = tablib.Dataset(*[[row.get(column) for column in columns] for _, row in rows], headers=columns)
+    # 已校验的行不再逐行校验
+    import_result = AssetsChunkImportResource().import_data(dataset, dry_run=dry_run, validated=True)
+    numbers = [number for number, _ in rows]
+    for error in import_result.base_errors:
+        result.errors.extend((number, str(error.error)) for number in numbers)
+    for line, errors in import_result.row_errors():
+        result.errors.extend((numbers[line - 1], str(error.error)) for error in errors)
+    for invalid_row in import_result.invalid_rows:
+        result.errors.append((numbers[invalid_row.number - 1], str(invalid_row.error_dict)))
+    for key in ('new', 'update', 'skip'):
+        result.totals[key] += import_result.totals[key]
+
+
+def import_assets(path, chunk_size=IMPORT_CHUNK_SIZE, workers=None, dry_run=False, progress=None):
+    """
+    分块导入资产文件。读取、校验、写入流水线进行：主进程读取并写库，校验进程池校验，
+    排队的块数不超过 workers * IMPORT_PENDING_PER_WORKER，写入顺序与文件中的顺序一致。
+    :param path: xlsx或csv文件路径
+    :param workers: 校验进程数，0表示在主进程中校验，默认为CPU数
+    :param dry_run: 只校验和试写，不提交到数据库
+    :param progress: 可选，每写入一块后调用 progress(result)
+    :return: ChunkedImportResult
+    """
+    rules = asset_row_rules()
+    result = ChunkedImportResult()
+    required = [*rules['required'].values(), *ASSET_CHOICE_COLUMNS.values()]
+
+    def write(headers, valid, errors):
+        result.totals['valid'] += len(valid)
+        result.errors.extend(errors)
+        if valid:
+            write_chunk(valid, headers, result, dry_run)
+        if progress:
+            progress(result)
+
+    def check_headers(headers):
+        missing = [column for column in required if column not in headers]
+        if missing:
+            raise ValueError(f"缺少列: {', '.join(missing)}")
+
+    chunks = iter_chunks(path, chunk_size)
+    if workers == 0:
+        for headers, rows in chunks:
+            check_headers(headers)
+            result.totals['rows'] += len(rows)
+            write(headers, *validate_chunk(rows, rules))
+    else:
+        workers = workers or os.cpu_count() or 1
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            pending = deque()
+            limit = workers * IMPORT_PENDING_PER_WORKER
+            for headers, rows in chunks:
+                check_headers(headers)
+                result.totals['rows'] += len(rows)
+                pending.append((headers, executor.submit(validate_chunk, rows, rules)))
+                if len(pending) >= limit:
+                    headers, future = pending.popleft()
+                    write(headers, *future.result())
+            while pending:
+                headers, future = pending.popleft()
+                write(headers, *future.result())
+
+    result.errors.sort()
+    return result
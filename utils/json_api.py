@@ -0,0 +1,219 @@
+"""
+-*- coding: utf-8 -*-
+ @Author: li
+ @ProjectName: ITAssets
+ @Email: lijianqiao2906@live.com
+ @FileName: json_api.py
+ @DateTime: 2024/4/27 上午9:30
+ @Docs: 只读JSON接口：按 (修改时间, ID) 游标分页、字段选择、updated_since 增量过滤，数据范围与admin列表页一致；
+        先只查询本页的 (ID, 修改时间) 计算ETag，与 If-None-Match 相同时直接返回304，不读取整行
+"""
+import base64
+import binascii
+import hashlib
+from datetime import datetime
+
+from django.contrib import admin
+from django.contrib.auth import authenticate, get_user_model
+from django.core.cache import cache
+from django.http import JsonResponse
+from django.urls import path
+from django.utils import timezone
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.crypto import constant_time_compare
+from django.utils.dateparse import parse_date, parse_datetime
+from django.utils.http import quote_etag
+from django.views.decorators.http import require_safe
+
+from utils.user_scope import get_user_scope
+
+API_PAGE_SIZE = 100  # 默认每页条数
+API_MAX_PAGE_SIZE = 1000  # 每页条数上限
+API_AUTH_CACHE_TIMEOUT = 60  # Basic认证结果的缓存时间(秒)
+
+
+class ApiError(Exception):
+    """请求参数错误，返回400"""
+
+
+class ApiResource:
+    """
+    一个接口资源，数据范围和权限使用该模型已注册的ModelAdmin(get_queryset、has_view_permission)。
+    :param name: URL中的资源名称
+    :param model: 模型
+    :param fields: {输出字段: values()查询路径}，外键只输出ID，关联对象通过对应资源获取
+    :param many: {输出字段: 多对多字段名}，输出关联对象的ID列表
+    """
+
+    def __init__(self, name, model, fields, many=None):
+        self.name = name
+        self.model = model
+        self.fields = {'id': 'id', **fields, 'update_time': 'update_time'}
+        self.many = many or {}
+
+    @property
+    def model_admin(self):
+        return admin.site._registry[self.model]
+
+    def select_fields(self, value):
+        """解析 fields 参数，ID总是输出"""
+        if not value:
+            return list(self.fields) + list(self.many)
+        names = ['id', *(name.strip() for name in value.split(',') if name.strip() and name.strip() != 'id')]
+        unknown = [name for name in names if name not in self.fields and name not in self.many]
+        if unknown:
+            raise ApiError(f"未知字段: {', '.join(unknown)}")
+        return list(dict.fromkeys(names))
+
+    def rows(self, queryset, ids, names):
+        """按ID读取本页数据，保持ids的顺序"""
+        paths = [self.fields[name] for name in names if name in self.fields]
+        by_id = {row['id']: row for row in queryset.filter(pk__in=ids).values(*dict.fromkeys(['id', *paths]))}
+        results = [{name: by_id[pk][self.fields[name]] for name in names if name in self.fields} for pk in ids]
+        for name in names:
+            if name in self.many:
+                related = self.related_ids(self.many[name], ids)
+                for result in results:
+                    result[name] = related.get(result['id'], [])
+        return results
+
+    def related_ids(self, field_name, ids):
+        """一次查询多对多中间表，返回 {对象ID: [关联对象ID]}"""
+        field = self.model._meta.get_field(field_name)
+        source, target = f'{field.m2m_field_name()}_id', f'{field.m2m_reverse_field_name()}_id'
+        related = {}
+        for source_id, target_id in field.remote_field.through.objects.filter(
+                **{f'{source}__in': ids}).order_by(source, target).values_list(source, target):
+            related.setdefault(source_id, []).append(target_id)
+        return related
+
+
+def encode_cursor(update_time, pk):
+    return base64.urlsafe_b64encode(f'{update_time.isoformat()}|{pk}'.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        value = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+        update_time, pk = value.rsplit('|', 1)
+        update_time = parse_datetime(update_time)
+        if update_time is None:
+            raise ValueError
+        return update_time, int(pk)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise ApiError('cursor 无效') from None
+
+
+def parse_updated_since(value):
+    """updated_since 支持日期或日期时间，带时区时转换为本地时间"""
+    try:
+        since = parse_datetime(value) or parse_date(value)
+    except ValueError:
+        since = None
+    if since is None:
+        raise ApiError('updated_since 格式应为 YYYY-MM-DD 或 ISO 8601 日期时间')
+    if not hasattr(since, 'hour'):
+        return datetime.combine(since, datetime.min.time())
+    return timezone.make_naive(since) if timezone.is_aware(since) else since
+
+
+def parse_limit(value):
+    if not value:
+        return API_PAGE_SIZE
+    if not value.isdigit() or not 0 < int(value) <= API_MAX_PAGE_SIZE:
+        raise ApiError(f'limit 应为 1-{API_MAX_PAGE_SIZE} 的整数')
+    return int(value)
+
+
+def authenticate_api_request(request):
+    """
+    已登录admin的会话直接使用；否则使用 HTTP Basic 认证。
+    认证成功后按请求头摘要缓存用户ID和会话认证哈希，轮询时不必每次计算密码哈希；
+    与会话相同，修改密码后认证哈希改变，缓存随之失效，旧密码不能再使用。
+    """
+    if request.user.is_authenticated:
+        return request.user
+    header = request.META.get('HTTP_AUTHORIZATION', '')
+    if not header.startswith('Basic '):
+        return None
+    key = 'api_auth:' + hashlib.sha256(header.encode()).hexdigest()
+    cached = cache.get(key)
+    if cached is not None:
+        user_id, auth_hash = cached
+        user = get_user_model()._default_manager.filter(pk=user_id, is_active=True).first()
+        if user is not None and constant_time_compare(user.get_session_auth_hash(), auth_hash):
+            return user
+        cache.delete(key)
+    try:
+        username, _, password = base64.b64decode(header[6:]).decode().partition(':')
+    except (binascii.Error, UnicodeDecodeError):
+        return None
+    user = authenticate(request, username=username, password=password)
+    if user is not None:
+        cache.set(key, (user.pk, user.get_session_auth_hash()), API_AUTH_CACHE_TIMEOUT)
+    return user
+
+
+def _error(status, message):
+    response = JsonResponse({'error': message}, status=status)
+    if status == 401:
+        response['WWW-Authenticate'] = 'Basic realm="api", charset="UTF-8"'
+    return response
+
+
+def list_view(request, resource):
+    """
+    资源列表，按 (修改时间, ID) 升序。参数：
+    - fields: 逗号分隔的输出字段
+    - updated_since: 只返回该时间之后修改的数据
+    - cursor: 上一页返回的 next_cursor(next 仅在还有更多数据时返回)
+    - limit: 每页条数，默认 API_PAGE_SIZE
+    """
+    user = authenticate_api_request(request)
+    if user is None:
+        return _error(401, '需要登录或使用 HTTP Basic 认证')
+    request.user = user
+    model_admin = resource.model_admin
+    if not model_admin.has_view_permission(request):
+        return _error(403, '没有查看权限')
+    try:
+        names = resource.select_fields(request.GET.get('fields'))
+        limit = parse_limit(request.GET.get('limit'))
+        queryset = model_admin.get_queryset(request)
+        if request.GET.get('updated_since'):
+            queryset = queryset.filter(update_time__gte=parse_updated_since(request.GET['updated_since']))
+        if request.GET.get('cursor'):
+            # (修改时间, ID) > 游标：写成范围条件加排除，便于数据库使用 (update_time, id) 索引
+            update_time, pk = decode_cursor(request.GET['cursor'])
+            queryset = queryset.filter(update_time__gte=update_time).exclude(update_time=update_time, pk__lte=pk)
+    except ApiError as e:
+        return _error(400, str(e))
+
+    keys = list(queryset.order_by('update_time', 'pk').values_list('pk', 'update_time')[:limit + 1])
+    has_more, keys = len(keys) > limit, keys[:limit]
+    # 下一页游标为本页最后一行；本页为空时沿用请求的游标，轮询方保存 next_cursor 即可增量获取
+    next_cursor = encode_cursor(keys[-1][1], keys[-1][0]) if keys else request.GET.get('cursor')
+    etag = quote_etag(hashlib.md5(
+        f'{get_user_scope(request).cache_key}|{",".join(names)}|{has_more}|{keys}'.encode()).hexdigest())
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        next_url = None
+        if has_more:
+            params = request.GET.copy()
+            params['cursor'] = next_cursor
+            next_url = f'{request.path}?{params.urlencode()}'
+        response = JsonResponse({
+            'results': resource.rows(queryset, [pk for pk, _ in keys], names),
+            'next_cursor': next_cursor,
+            'next': next_url,
+        }, json_dumps_params={'ensure_ascii': False})
+    response['ETag'] = etag
+    patch_cache_control(response, private=True, no_cache=True)
+    patch_vary_headers(response, ['Authorization', 'Cookie'])
+    return response
+
+
+def api_urlpatterns(resources):
+    """生成资源列表的URL：<资源名称>/，URL名称为 api_<资源名称>"""
+    return [path(f'{resource.name}/', require_safe(list_view), {'resource': resource},
+                 name=f"api_{resource.name.replace('-', '_')}") for resource in resources]
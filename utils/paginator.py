@@ -0,0 +1,133 @@
+"""
+-*- coding: utf-8 -*-
+ @Author: li
+ @ProjectName: ITAssets
+ @Email: lijianqiao2906@live.com
+ @FileName: paginator.py
+ @DateTime: 2024/4/24 上午9:50
+ @Docs: 大表列表页分页：总数使用数据库统计信息估算或短时缓存；翻到下一页时按上一页最后一行的排序值定位(keyset)，
+        跳页时先只在索引上取主键再回表，避免 OFFSET 读取整行
+"""
+import hashlib
+
+from django.core.cache import cache
+from django.core.exceptions import EmptyResultSet
+from django.core.paginator import Paginator
+from django.db import connections, models
+from django.utils.functional import cached_property
+
+ESTIMATED_COUNT_THRESHOLD = 100000  # 无过滤且表行数估计超过该值时直接使用估计值
+COUNT_CACHE_TIMEOUT = 60  # 精确总数的缓存时间(秒)
+BOUNDARY_CACHE_TIMEOUT = 600  # 每页最后一行排序值的缓存时间(秒)
+
+
+def estimated_row_count(model, using='default'):
+    """
+    从数据库统计信息读取表的估计行数，无统计信息时返回None。
+    SQLite 需执行过 ANALYZE，MySQL 使用 information_schema，PostgreSQL 使用 pg_class。
+    """
+    connection = connections[using]
+    table = model._meta.db_table
+    sql = {
+        'postgresql': "SELECT reltuples::bigint FROM pg_class WHERE relname = %s",
+        'mysql': "SELECT TABLE_ROWS FROM information_schema.TABLES WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s",
+        'sqlite': "SELECT stat FROM sqlite_stat1 WHERE tbl = %s ORDER BY idx IS NOT NULL LIMIT 1",
+    }.get(connection.vendor)
+    if not sql:
+        return None
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [table])
+            row = cursor.fetchone()
+    except Exception:
+        # SQLite 未执行过 ANALYZE 时没有 sqlite_stat1 表
+        return None
+    if not row or row[0] is None:
+        return None
+    value = int(str(row[0]).split()[0])
+    return value if value >= 0 else None
+
+
+class KeysetPaginator(Paginator):
+    """
+    列表页分页器，通过 Baseadmin.fast_pagination 启用。
+    - 总数：无过滤的大表使用估计值，其余精确计数结果按查询缓存 COUNT_CACHE_TIMEOUT 秒
+    - 第N页：缓存中有第N-1页最后一行的排序值时，用 (排序列) < (边界值) 定位，不使用 OFFSET；
+      否则只在索引上按 OFFSET 取本页主键，再按主键取整行
+    排序列必须是本模型的字段(管理后台会自动追加主键保证排序确定)，否则退回普通分页。
+    """
+
+    @cached_property
+    def query_key(self):
+        try:
+            sql, params = self.object_list.query.sql_with_params()
+        except EmptyResultSet:
+            return None
+        return hashlib.md5(f'{sql}{params}{self.per_page}'.encode()).hexdigest()
+
+    @cached_property
+    def ordering(self):
+        """[(字段attname, 是否降序)]，包含无法用于定位的排序时返回None"""
+        opts = self.object_list.model._meta
+        ordering = []
+        for name in self.object_list.query.order_by or ():
+            if not isinstance(name, str):
+                return None
+            descending = name.startswith('-')
+            name = name.lstrip('-')
+            try:
+                field = opts.pk if name == 'pk' else opts.get_field(name)
+            except Exception:
+                return None
+            if not field.concrete or field.null:
+                return None
+            ordering.append((field.attname, descending))
+        return ordering if ordering and ordering[-1][0] == opts.pk.attname else None
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if not queryset.query.where:
+            estimate = estimated_row_count(queryset.model, queryset.db)
+            if estimate is not None and estimate >= ESTIMATED_COUNT_THRESHOLD:
+                return estimate
+        if self.query_key is None:
+            return super().count
+        key = f'changelist:count:{self.query_key}'
+        count = cache.get(key)
+        if count is None:
+            count = super().count
+            cache.set(key, count, COUNT_CACHE_TIMEOUT)
+        return count
+
+    def page(self, number):
+        number = self.validate_number(number)
+        if self.ordering is None or self.query_key is None:
+            return super().page(number)
+        bottom = (number - 1) * self.per_page
+        boundary = cache.get(self._boundary_key(number - 1)) if number > 1 else None
+        if boundary is not None:
+            object_list = self.object_list.filter(self._after(boundary))[:self.per_page]
+        elif bottom == 0:
+            object_list = self.object_list[:self.per_page]
+        else:
+            ids = list(self.object_list.values_list('pk', flat=True)[bottom:bottom + self.per_page])
+            object_list = self.object_list.filter(pk__in=ids)
+        rows = list(object_list)  # 求值后结果缓存在查询集中，列表页和可编辑表单集复用
+        if rows:
+            last = rows[-1]
+            cache.set(self._boundary_key(number), [getattr(last, attname) for attname, _ in self.ordering],
+                      BOUNDARY_CACHE_TIMEOUT)
+        return self._get_page(object_list, number, self)
+
+    def _boundary_key(self, number):
+        return f'changelist:boundary:{self.query_key}:{number}'
+
+    def _after(self, boundary):
+        """排在边界行之后的条件：(a, b, c) 之后 = a之后 或 (a相等且b之后) 或 (a、b相等且c之后)"""
+        condition = models.Q()
+        for i, (attname, descending) in enumerate(self.ordering):
+            equal = {name: value for (name, _), value in zip(self.ordering[:i], boundary)}
+            after = {f"{attname}__{'lt' if descending else 'gt'}": boundary[i]}
+            condition |= models.Q(**equal, **after)
+        return condition
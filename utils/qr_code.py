@@ -0,0 +1,84 @@
+"""
+-*- coding: utf-8 -*-
+ @Author: li
+ @ProjectName: ITAssets
+ @Email: lijianqiao2906@live.com
+ @FileName: qr_code.py
+ @DateTime: 2024/4/16 上午9:30
+ @Docs: 二维码渲染, 按内容寻址的LRU缓存, 相同内容只渲染一次
+"""
+import hashlib
+import io
+from functools import lru_cache
+
+import qrcode
+import qrcode.image.svg
+
+# 支持的图片格式及其Content-Type
+QR_IMAGE_FORMATS = {
+    'png': 'image/png',
+    'svg': 'image/svg+xml',
+}
+# 渲染参数变化时修改此版本号，使浏览器和代理缓存的旧图片失效
+QR_RENDER_VERSION = '1'
+
+
+def _make_qr(content):
+    qr = qrcode.main.QRCode(
+        version=1,
+        error_correction=qrcode.constants.ERROR_CORRECT_L,
+        box_size=10,
+        border=4,
+    )
+    # 添加内容到二维码
+    qr.add_data(content)
+    qr.make(fit=True)
+    return qr
+
+
+def render_qr_png(content):
+    """
+    将内容渲染为二维码PNG图片。
+    :param content: 二维码内容
+    :return: PNG图片的二进制数据
+    """
+    # 将二维码保存为图片
+    img = _make_qr(content).make_image()
+    img_io = io.BytesIO()
+    img.save(img_io)
+    return img_io.getvalue()
+
+
+def render_qr_svg(content):
+    """
+    将内容渲染为二维码SVG图片。
+    :param content: 二维码内容
+    :return: SVG图片的二进制数据
+    """
+    img = _make_qr(content).make_image(image_factory=qrcode.image.svg.SvgPathImage)
+    img_io = io.BytesIO()
+    img.save(img_io)
+    return img_io.getvalue()
+
+
+def qr_code_etag(content, fmt):
+    """
+    二维码图片的强ETag，由渲染版本、格式和内容计算，内容不变则ETag不变。
+    :param content: 二维码内容
+    :param fmt: 图片格式, png 或 svg
+    :return: ETag字符串(不含引号)
+    """
+    return hashlib.sha256(f"{QR_RENDER_VERSION}:{fmt}:{content}".encode()).hexdigest()[:32]
+
+
+@lru_cache(maxsize=2048)
+def get_qr_image(content, fmt):
+    """
+    获取二维码图片，按(内容, 格式)缓存最近使用的图片。
+    :param content: 二维码内容
+    :param fmt: 图片格式, png 或 svg
+    :return: 图片的二进制数据
+    """
+    if fmt == 'svg':
+        return render_qr_svg(content)
+    return render_qr_png(content)
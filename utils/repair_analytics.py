@@ -0,0 +1,213 @@
+"""
+-*- coding: utf-8 -*-
+ @Author: li
+ @ProjectName: ITAssets
+ @Email: lijianqiao2906@live.com
+ @FileName: repair_analytics.py
+ @DateTime: 2024/5/2 上午9:30
+ @Docs: 维修分析报表：按主键分块读取维修记录的 values_list 元组组成 DataFrame，不实例化模型对象；
+        维修时长(均值/中位数/P90)、重复故障率、每单备件数都是 pandas 的分组向量运算。结果按维修数据版本缓存
+"""
+import io
+import time
+
+import pandas as pd
+from django.core.cache import cache
+from django.db import models
+
+ANALYTICS_CHUNK_SIZE = 20000  # 每次从数据库读取的行数
+ANALYTICS_CACHE_TIMEOUT = 24 * 3600  # 报表缓存时间(秒)，维修数据变化后缓存键随之改变
+REPEAT_FAILURE_DAYS = 90  # 同一资产距上次维修开始不超过该天数再次维修，计为重复故障
+ASSET_LABEL_CHUNK_SIZE = 500  # 查询资产名称时每次的ID个数
+
+RECORD_COLUMNS = ['id', 'asset_id', 'department_id', 'supplier_id', 'repair_start_time', 'repair_duration']
+
+# 报表表格：{名称: (工作表名称, {列: 列名称})}
+REPORT_TABLES = {
+    'summary': ('汇总', {'metric': '指标', 'value': '值'}),
+    'department': ('部门', {}),
+    'supplier': ('供应商', {}),
+    'spare_part_type': ('备件类型', {}),
+    'asset': ('重复故障资产', {'sn': '资产编号', 'name': '资产名称', 'repairs': '维修次数',
+                             'repeats': '重复故障次数', 'repeat_rate': '重复故障率'}),
+}
+GROUP_COLUMNS = {
+    'name': '名称', 'repairs': '维修记录数', 'finished': '已完成数', 'mean_hours': '平均维修时长(小时)',
+    'median_hours': '维修时长中位数(小时)', 'p90_hours': 'P90维修时长(小时)', 'repeat_rate': '重复故障率',
+    'parts_per_repair': '每单备件数',
+}
+
+
+def read_chunks(queryset, fields, chunk_size=ANALYTICS_CHUNK_SIZE):
+    """
+    按主键分块读取 values_list 元组并拼接为 DataFrame，每块一次查询，内存中不保留模型对象。
+    :param queryset: 查询集
+    :param fields: values_list 的字段，第一个应为本表主键
+    :return: 列名为 fields 的 DataFrame
+    """
+    frames, last_pk = [], None
+    queryset = queryset.order_by('pk')
+    while True:
+        chunk = queryset if last_pk is None else queryset.filter(pk__gt=last_pk)
+        rows = list(chunk.values_list(*fields)[:chunk_size])
+        if rows:
+            frames.append(pd.DataFrame.from_records(rows, columns=fields))
+            last_pk = rows[-1][0]
+        if len(rows) < chunk_size:
+            break
+    if not frames:
+        return pd.DataFrame.from_records([], columns=fields)
+    return pd.concat(frames, ignore_index=True)
+
+
+def load_frames(records):
+    """
+    读取维修记录和维修备件关联。
+    :param records: 维修记录查询集(已按用户权限过滤)
+    :return: (维修记录DataFrame, (维修记录ID, 备件类型ID) DataFrame)
+    """
+    frame = read_chunks(records, RECORD_COLUMNS)
+    links = records.model.spare_part.through.objects.all()
+    if records.query.where:
+        # 只有按权限过滤时才限定维修记录，全部数据时子查询会使每块查询慢数倍
+        links = links.filter(repairrecord__in=records.values('pk'))
+    parts = read_chunks(links, ['id', 'repairrecord_id', 'sparepart__type_id'])
+    parts = parts.rename(columns={'repairrecord_id': 'record_id', 'sparepart__type_id': 'spare_part_type_id'})
+
+    frame['repair_start_time'] = pd.to_datetime(frame['repair_start_time'])
+    frame['hours'] = pd.to_timedelta(frame['repair_duration']).dt.total_seconds() / 3600
+    frame['parts'] = frame['id'].map(parts['record_id'].value_counts()).fillna(0).astype(int)
+    # 同一资产按维修开始时间排序，与上一次维修的间隔不超过 REPEAT_FAILURE_DAYS 天即为重复故障
+    frame = frame.sort_values(['asset_id', 'repair_start_time'], kind='stable')
+    gap = frame.groupby('asset_id')['repair_start_time'].diff()
+    frame['repeat'] = gap <= pd.Timedelta(days=REPEAT_FAILURE_DAYS)
+    return frame, parts
+
+
+def group_stats(frame, by, names):
+    """
+    按一个维度分组统计维修时长、重复故障率和每单备件数，按维修记录数降序。
+    :param names: {维度ID: 名称}
+    """
+    grouped = frame.groupby(by)
+    hours = frame.dropna(subset=['hours']).groupby(by)['hours']
+    result = pd.DataFrame({
+        'repairs': grouped.size(),
+        'finished': hours.size(),
+        'mean_hours': hours.mean(),
+        'median_hours': hours.median(),
+        'p90_hours': hours.quantile(0.9),
+        'repeat_rate': grouped['repeat'].mean(),
+        'parts_per_repair': grouped['parts'].mean(),
+    })
+    result['finished'] = result['finished'].fillna(0).astype(int)
+    result.insert(0, 'name', result.index.map(lambda pk: names.get(pk, pk)))
+    return result.sort_values('repairs', ascending=False).round(2).reset_index(drop=True)
+
+
+def asset_stats(frame, labels):
+    """
+    有重复故障的资产，按重复故障次数降序。
+    :param labels: 返回 {资产ID: (资产编号, 资产名称)} 的函数，参数为资产ID列表
+    """
+    grouped = frame.groupby('asset_id')
+    result = pd.DataFrame({'repairs': grouped.size(), 'repeats': grouped['repeat'].sum()})
+    result = result[result['repeats'] > 0].sort_values(['repeats', 'repairs'], ascending=False)
+    result['repeat_rate'] = (result['repeats'] / result['repairs']).round(2)
+    names = labels(result.index.tolist())
+    result.insert(0, 'sn', result.index.map(lambda pk: names.get(pk, ('', ''))[0]))
+    result.insert(1, 'name', result.index.map(lambda pk: names.get(pk, ('', ''))[1]))
+    return result.reset_index(drop=True)
+
+
+def summary_stats(frame):
+    """全部维修记录的汇总指标"""
+    hours = frame['hours'].dropna()
+    repeat_assets = frame.groupby('asset_id')['repeat'].any()
+    rows = [
+        ('维修记录数', len(frame)),
+        ('已完成数', len(hours)),
+        ('平均维修时长(小时)', hours.mean()),
+        ('维修时长中位数(小时)', hours.median()),
+        ('P90维修时长(小时)', hours.quantile(0.9)),
+        (f'重复故障率({REPEAT_FAILURE_DAYS}天内再次维修)', frame['repeat'].mean()),
+        ('有重复故障的资产占比', repeat_assets.mean()),
+        ('每单备件数', frame['parts'].mean()),
+    ]
+    rows += [(f'使用{count}个备件的维修单数', total)
+             for count, total in frame['parts'].value_counts().sort_index().items()]
+    # 值列使用object类型，整数指标不会被转换为浮点数
+    return pd.DataFrame({'metric': [metric for metric, _ in rows],
+                         'value': pd.Series([_number(value) for _, value in rows], dtype=object)})
+
+
+def _number(value):
+    """numpy数值转换为可缓存、可序列化的Python数值，保留两位小数"""
+    if pd.isna(value):
+        return None
+    return round(float(value), 2) if isinstance(value, float) else int(value)
+
+
+def compute_report(records):
+    """
+    计算维修分析报表。
+    :param records: 维修记录查询集(已按用户权限过滤)
+    :return: {表格名称: DataFrame}，表格名称见 REPORT_TABLES
+    """
+    from assets.models import Assets, Department, Supplier
+    from repair.models import SparePartType
+
+    def asset_labels(ids):
+        labels = {}
+        for i in range(0, len(ids), ASSET_LABEL_CHUNK_SIZE):
+            labels.update((pk, (sn, name)) for pk, sn, name in Assets.objects.filter(
+                pk__in=ids[i:i + ASSET_LABEL_CHUNK_SIZE]).values_list('pk', 'sn', 'name'))
+        return labels
+
+    frame, parts = load_frames(records)
+    by_type = (parts[['record_id', 'spare_part_type_id']].drop_duplicates()
+               .merge(frame[['id', 'hours', 'repeat', 'parts']], left_on='record_id', right_on='id'))
+    return {
+        'summary': summary_stats(frame),
+        'department': group_stats(frame, 'department_id', dict(Department.objects.values_list('pk', 'name'))),
+        'supplier': group_stats(frame, 'supplier_id', dict(Supplier.objects.values_list('pk', 'name'))),
+        'spare_part_type': group_stats(by_type, 'spare_part_type_id',
+                                       dict(SparePartType.objects.values_list('pk', 'name'))),
+        'asset': asset_stats(frame, asset_labels),
+    }
+
+
+def get_report(records, scope_key):
+    """
+    带缓存的维修分析报表。维修数据版本(统计、名称变化时递增)和维修记录最新修改时间都计入缓存键，
+    维修状态、维修时长的修改也会使缓存失效。
+    :param records: 维修记录查询集(已按用户权限过滤)
+    :param scope_key: 用户数据权限范围的缓存键
+    :return: (报表, 计算耗时秒数)
+    """
+    from assets.models import DataVersion
+    latest = records.model.objects.aggregate(latest=models.Max('update_time'))['latest']
+    key = (f"repair_analytics:{scope_key}:{DataVersion.get('repair')}:{DataVersion.get('assets')}:"
+           f"{latest.isoformat() if latest else ''}")
+    cached = cache.get(key)
+    if cached is None:
+        start = time.perf_counter()
+        cached = (compute_report(records), round(time.perf_counter() - start, 2))
+        cache.set(key, cached, ANALYTICS_CACHE_TIMEOUT)
+    return cached
+
+
+def table_labels(name):
+    """表格的 (工作表名称, {列: 列名称})"""
+    title, columns = REPORT_TABLES[name]
+    return title, columns or GROUP_COLUMNS
+
+
+def to_xlsx(report):
+    """报表写入xlsx，每个表格一个工作表，返回文件内容"""
+    output = io.BytesIO()
+    with pd.ExcelWriter(output, engine='openpyxl') as writer:
+        for name, table in report.items():
+            title, columns = table_labels(name)
+            table.rename(columns=columns).to_excel(writer, sheet_name=title, index=False)
+    return output.getvalue()
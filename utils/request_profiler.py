@@ -0,0 +1,143 @@
+"""
+-*- coding: utf-8 -*-
+ @Author: li
+ @ProjectName: ITAssets
+ @Email: lijianqiao2906@live.com
+ @FileName: request_profiler.py
+ @DateTime: 2024/4/21 上午10:15
+ @Docs: 请求性能采样中间件：统计每个请求的SQL条数、数据库耗时、最慢的SQL及调用位置，
+        写入Server-Timing响应头，并按URL名称在内存环形缓冲区中保留最近的样本用于计算分位数
+"""
+import heapq
+import os
+import threading
+import time
+import traceback
+from collections import defaultdict, deque
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
+
+# 调用位置只取项目代码中的栈帧(排除第三方库和本模块)
+_PROJECT_ROOT = str(settings.BASE_DIR)
+_THIS_FILE = os.path.abspath(__file__)
+
+_lock = threading.Lock()
+_samples = defaultdict(lambda: deque(maxlen=settings.REQUEST_PROFILER_WINDOW))
+
+
+def _call_site():
+    for frame in reversed(traceback.extract_stack()):
+        if frame.filename.startswith('<'):
+            continue
+        filename = os.path.abspath(frame.filename)
+        if filename.startswith(_PROJECT_ROOT) and filename != _THIS_FILE and 'site-packages' not in filename:
+            return f"{os.path.relpath(filename, _PROJECT_ROOT)}:{frame.lineno} in {frame.name}"
+    return ''
+
+
+class QueryRecorder:
+    """
+    作为数据库 execute_wrapper 记录本次请求的SQL条数、总耗时，并保留耗时最长的N条SQL。
+    只记录带占位符的SQL文本，不记录参数。
+    """
+
+    def __init__(self, keep):
+        self.keep = keep
+        self.count = 0
+        self.duration = 0.0
+        self.slowest = []  # (耗时, 序号, SQL, 调用位置) 小顶堆
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = time.perf_counter() - start
+            self.count += 1
+            self.duration += duration
+            if self.keep and (len(self.slowest) < self.keep or duration > self.slowest[0][0]):
+                # 只为可能进入前N的SQL提取调用栈
+                item = (duration, self.count, sql[:500], _call_site())
+                if len(self.slowest) < self.keep:
+                    heapq.heappush(self.slowest, item)
+                else:
+                    heapq.heapreplace(self.slowest, item)
+
+    def slow_queries(self):
+        return [{'ms': round(duration * 1000, 2), 'sql': sql, 'call_site': call_site}
+                for duration, _, sql, call_site in sorted(self.slowest, reverse=True)]
+
+
+class RequestProfilerMiddleware:
+    """
+    请求性能采样中间件，在 settings.REQUEST_PROFILER_ENABLED 开启时加入 MIDDLEWARE 的最前面。
+    耗时统计到视图返回响应为止，流式响应的内容生成不计入。
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        recorder = QueryRecorder(settings.REQUEST_PROFILER_SLOW_QUERIES)
+        start = time.perf_counter()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(recorder))
+            response = self.get_response(request)
+        total = time.perf_counter() - start
+
+        timing = (f'db;dur={recorder.duration * 1000:.1f};desc="{recorder.count} queries", '
+                  f'app;dur={(total - recorder.duration) * 1000:.1f}, total;dur={total * 1000:.1f}')
+        response['Server-Timing'] = f"{response['Server-Timing']}, {timing}" if response.has_header(
+            'Server-Timing') else timing
+
+        match = getattr(request, 'resolver_match', None)
+        record(match.view_name if match else '<unresolved>', total, recorder)
+        return response
+
+
+def record(name, total, recorder):
+    sample = (total * 1000, recorder.duration * 1000, recorder.count, recorder.slowest and recorder.slow_queries())
+    with _lock:
+        _samples[name].append(sample)
+
+
+def _percentile(values, percent):
+    """最近秩法求分位数，values 需已排序"""
+    index = max(0, int(len(values) * percent / 100 + 0.5) - 1)
+    return round(values[min(index, len(values) - 1)], 2)
+
+
+def request_profile_stats():
+    """
+    按URL名称汇总本进程最近的请求样本。
+    :return: 列表，每项包含请求数、总耗时与数据库耗时的p50/p95/p99、平均SQL条数，以及最慢一次请求中的慢SQL
+    """
+    with _lock:
+        snapshot = {name: list(samples) for name, samples in _samples.items()}
+    stats = []
+    for name, samples in snapshot.items():
+        totals = sorted(sample[0] for sample in samples)
+        db_times = sorted(sample[1] for sample in samples)
+        worst = max(samples, key=lambda sample: sample[0])
+        stats.append({
+            'name': name,
+            'requests': len(samples),
+            'p50_ms': _percentile(totals, 50),
+            'p95_ms': _percentile(totals, 95),
+            'p99_ms': _percentile(totals, 99),
+            'db_p50_ms': _percentile(db_times, 50),
+            'db_p95_ms': _percentile(db_times, 95),
+            'db_p99_ms': _percentile(db_times, 99),
+            'avg_queries': round(sum(sample[2] for sample in samples) / len(samples), 1),
+            'max_queries': max(sample[2] for sample in samples),
+            'slow_queries': worst[3] or [],
+        })
+    return sorted(stats, key=lambda item: item['p95_ms'], reverse=True)
+
+
+def reset_request_profile_stats():
+    with _lock:
+        _samples.clear()
@@ -5,42 +5,164 @@
 # @FileName: resource.py
 # @DateTime: 2024/4/2 13:43
 # @Docs: django-import-export 导出
+import logging
+import time
+from collections import Counter
+
+from django.conf import settings
 from django.core.exceptions import ValidationError
+from django.db import models
+from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 from django.contrib.auth.models import User
 from import_export import resources
 from import_export.fields import Field
+from import_export.instance_loaders import CachedInstanceLoader
+from import_export.results import RowResult
 from import_export.widgets import DateWidget, ForeignKeyWidget, ManyToManyWidget
-from assets.models import Assets, Bussline, Department, Supplier
-from repair.models import SparePart, RepairRecord
+from assets.models import Assets, AssetStat, Bussline, Department, SearchToken, Supplier
+from repair.models import RepairDailyStat, RepairNumberSequence, RepairRecord, RepairStat, SparePart
+from utils.audit_buffer import buffered_audit, log_bulk_create, log_bulk_update, log_m2m_change
+from utils.chunked_import import asset_row_rules, clean_asset_row
+
+logger = logging.getLogger(__name__)
+
+
+class CachedForeignKeyWidget(ForeignKeyWidget):
+    """
+    带缓存的外键widget，导入前由资源类一次性填充 名称->实例 的映射，命中缓存时不再逐行查询数据库。
+    """
+
+    def __init__(self, model, field='pk', *args, **kwargs):
+        super().__init__(model, field, *args, **kwargs)
+        self.cache = {}
+
+    def clean(self, value, row=None, **kwargs):
+        if value in self.cache:
+            return self.cache[value]
+        return super().clean(value, row, **kwargs)
+
+
+class CachedManyToManyWidget(ManyToManyWidget):
+    """
+    带缓存的多对多widget，导入前由资源类一次性填充 值->实例 的映射，全部命中缓存时不再逐行查询数据库。
+    """
+
+    def __init__(self, model, separator=None, field=None, *args, **kwargs):
+        super().__init__(model, separator, field, *args, **kwargs)
+        self.cache = {}
+
+    def split(self, value):
+        if not value:
+            return []
+        return [item.strip() for item in str(value).split(self.separator) if item.strip()]
+
+    def clean(self, value, row=None, **kwargs):
+        keys = self.split(value)
+        if all(key in self.cache for key in keys):
+            return [self.cache[key] for key in keys]
+        return super().clean(value, row, **kwargs)
+
+
+def resolve_by_name(model, names, defaults=None, batch_size=1000, related=()):
+    """
+    以集合查询的方式批量解析(必要时批量创建)按名称唯一的对象。
+    :param model: 模型类，要求 name 字段唯一
+    :param names: 名称集合
+    :param defaults: 可选，名称 -> 创建新对象时使用的额外字段字典
+    :param batch_size: 每次 IN 查询/批量创建的数量
+    :param related: 查询时一并关联的外键
+    :return: 名称 -> 模型实例 的字典
+    """
+    names = [name for name in set(names) if name]
+    defaults = defaults or {}
+    queryset = model.objects.select_related(*related)
+    resolved = {}
+    for i in range(0, len(names), batch_size):
+        chunk = names[i:i + batch_size]
+        resolved.update({obj.name: obj for obj in queryset.filter(name__in=chunk)})
+    missing = [name for name in names if name not in resolved]
+    if missing:
+        model.objects.bulk_create([model(name=name, **defaults.get(name, {})) for name in missing],
+                                  batch_size=batch_size)
+        # 部分数据库(如MySQL)的bulk_create不会回填主键，这里重新查询一次
+        for i in range(0, len(missing), batch_size):
+            chunk = missing[i:i + batch_size]
+            resolved.update({obj.name: obj for obj in queryset.filter(name__in=chunk)})
+    return resolved
+
+
+class AuditedImportMixin:
+    """
+    批量导入(use_bulk)不调用 save()，也不触发审计日志的信号：记录导入时写入的对象和导入前的原值，
+    写入后补写新增和修改的审计日志。导入在审计日志缓冲范围内执行，日志合并为一次写入。
+    """
+
+    def import_data(self, *args, **kwargs):
+        self._audit_pairs = []  # [(原值，新增时为None, 写入的对象)]
+        with buffered_audit():
+            return super().import_data(*args, **kwargs)
+
+    def skip_row(self, instance, original, row, import_validation_errors=None):
+        """不跳过的行保留 import-export 比对时复制的原值"""
+        skip = super().skip_row(instance, original, row, import_validation_errors)
+        if not skip:
+            instance._audit_original = None if original is None or original._state.adding else original
+        return skip
+
+    def after_save_instance(self, instance, using_transactions, dry_run):
+        super().after_save_instance(instance, using_transactions, dry_run)
+        self._audit_pairs.append((instance.__dict__.pop('_audit_original', None), instance))
+
+    def _resolve_created_ids(self, instances, field_name):
+        """部分数据库(如MySQL)的bulk_create不会回填主键，按唯一字段查询一次"""
+        missing = {getattr(instance, field_name): instance for instance in instances if instance.pk is None}
+        values = list(missing)
+        for i in range(0, len(values), 1000):
+            queryset = self._meta.model.objects.filter(**{f'{field_name}__in': values[i:i + 1000]})
+            for pk, value in queryset.values_list('pk', field_name):
+                missing[value].pk = pk
+
+    def log_imported(self, field_name):
+        """
+        补写本次导入的审计日志，在全部写入后调用。
+        :param field_name: 回填新增对象主键使用的唯一字段
+        """
+        created = [instance for original, instance in self._audit_pairs if original is None]
+        self._resolve_created_ids(created, field_name)
+        log_bulk_create(created)
+        log_bulk_update([(original, instance) for original, instance in self._audit_pairs if original is not None],
+                        self.get_bulk_update_fields())
 
 
-class AssetsResource(resources.ModelResource):
+class AssetsResource(AuditedImportMixin, resources.ModelResource):
     """
     资产资源类，用于django-import-export库，定义了资产数据的导出行为。
     """
     id = Field(column_name='ID', attribute='id')
     bussline = Field(attribute='bussline', column_name=_('业务线'),
-                     widget=ForeignKeyWidget(Bussline, 'name'))
+                     widget=CachedForeignKeyWidget(Bussline, 'name'))
     department = Field(attribute='department', column_name=_('部门'),
-                       widget=ForeignKeyWidget(Department, 'name'))
+                       widget=CachedForeignKeyWidget(Department, 'name'))
     supplier = Field(attribute='supplier', column_name=_('供应商'),
-                     widget=ForeignKeyWidget(Supplier, 'name'))
+                     widget=CachedForeignKeyWidget(Supplier, 'name'))
     purchase_date = Field(attribute='purchase_date', column_name=_('购入日期'),
                           widget=DateWidget(format='%Y/%m/%d'))
     name = Field(column_name=_('资产名称'), attribute='name')
     sn = Field(column_name=_('资产编号'), attribute='sn')
     asset_location = Field(column_name=_('资产位置'), attribute='asset_location')
     expire_date = Field(column_name=_('过保期限(月份)'), attribute='expire_date')
+    warranty_end = Field(column_name=_('过保日期'), attribute='warranty_end', readonly=True,
+                         widget=DateWidget(format='%Y/%m/%d'))
     price = Field(column_name=_('价格'), attribute='price')
     repair_count = Field(column_name=_('维修次数'), attribute='repair_count')
     remake = Field(column_name=_('备注'), attribute='remake')
-    creator = Field(column_name=_('创建人'), attribute='creator', widget=ForeignKeyWidget(User, 'username'))
+    creator = Field(column_name=_('创建人'), attribute='creator', widget=CachedForeignKeyWidget(User, 'username'))
     create_time = Field(column_name=_('创建时间'), attribute='create_time',
                         widget=DateWidget(format='%Y/%m/%d %H:%M:%S'))
     update_time = Field(column_name=_('更新时间'), attribute='update_time',
                         widget=DateWidget(format='%Y/%m/%d %H:%M:%S'))
-    qr_code = Field(column_name=_('二维码路径'), attribute='qr_code')
+    qr_code = Field(column_name=_('二维码地址'), readonly=True)
 
     class Meta:
         model = Assets
@@ -48,60 +170,127 @@ class AssetsResource(resources.ModelResource):
         report_skipped = False
         import_id_fields = ('sn',)
         export_formats = ['xlsx']
+        # 批量导入：已有资产按sn一次性加载，新增/修改的资产分批 bulk_create/bulk_update
+        use_bulk = True
+        batch_size = 1000
+        instance_loader_class = CachedInstanceLoader
+
+    def __init__(self, **kwargs):
+        """
+        列名在实例化时按当前语言转换为字符串：导入时每行的每个字段都按列名取值，惰性翻译的列名每次比较都会重新翻译。
+        """
+        super().__init__(**kwargs)
+        for field in self.fields.values():
+            field.column_name = str(field.column_name)
+
+    def get_queryset(self):
+        """
+        预先关联外键(部门的名称包含业务线)，避免导入比对、补写审计日志和导出时逐行查询。
+        """
+        return super().get_queryset().select_related('bussline', 'department__bussline', 'supplier', 'creator')
+
+    def filter_export(self, queryset, *args, **kwargs):
+        """
+        导出时预先关联外键列，避免逐行查询。
+        """
+        return queryset.select_related('bussline', 'department', 'supplier', 'creator')
+
+    def before_import(self, dataset, using_transactions, dry_run, **kwargs):
+        """
+        导入前先读取整个数据集，用集合查询一次性解析(或创建)引用到的业务线、部门和供应商，
+        并填充外键widget的缓存，避免逐行 get_or_create。
+        """
+        self._import_started = time.perf_counter()
+        columns = {name: str(field.column_name) for name, field in self.fields.items()}
+        rows = dataset.dict
+
+        bussline_map = resolve_by_name(Bussline, (row.get(columns['bussline']) for row in rows))
+
+        department_defaults = {}
+        for row in rows:
+            department_name = row.get(columns['department'])
+            bussline = bussline_map.get(row.get(columns['bussline']))
+            if department_name and bussline and department_name not in department_defaults:
+                department_defaults[department_name] = {'bussline': bussline}
+        department_map = resolve_by_name(Department, department_defaults.keys(), department_defaults,
+                                         related=['bussline'])
+
+        supplier_map = resolve_by_name(Supplier, (row.get(columns['supplier']) for row in rows))
+
+        self.fields['bussline'].widget.cache = bussline_map
+        self.fields['department'].widget.cache = department_map
+        self.fields['supplier'].widget.cache = supplier_map
+        if columns['creator'] in dataset.headers:
+            usernames = {row.get(columns['creator']) for row in rows} - {None, ''}
+            self.fields['creator'].widget.cache = User.objects.in_bulk(usernames, field_name='username')
+        # 将被修改的资产当前的统计贡献，导入后按差值增量更新资产统计
+        self._stat_before = AssetStat.snapshot(self._asset_ids(dataset))
+
+    def _asset_ids(self, dataset):
+        """数据集中的资产编号对应的资产ID"""
+        sn_column = str(self.fields['sn'].column_name)
+        sns = list(set(dataset[sn_column])) if sn_column in dataset.headers else []
+        asset_ids = []
+        for i in range(0, len(sns), 1000):
+            asset_ids.extend(Assets.objects.filter(sn__in=sns[i:i + 1000]).values_list('pk', flat=True))
+        return asset_ids
 
     def before_import_row(self, row, row_number=None, **kwargs):
         """
         在导入行之前执行的操作，用于将导入的数据转换为数据库中的数据。
+        分块导入(validated=True)的行已在校验进程中转换过。
+        """
+        if not kwargs.get('validated'):
+            self._validate_and_set_default_values(row)
+
+    def before_save_instance(self, instance, using_transactions, dry_run):
+        """
+        批量写入不会调用 Assets.save()，这里补上报废规则、过保日期和更新时间。
+        """
+        if instance.status == 2:  # 已报废
+            instance.is_active = False
+        instance.warranty_end = instance.get_warranty_end()
+        instance.update_time = timezone.now()
+
+    def get_bulk_update_fields(self):
+        """
+        批量更新时排除主键、创建时间和不对应模型字段的导出列(如二维码地址)。
+        """
+        model_fields = {field.name for field in self._meta.model._meta.concrete_fields}
+        return [f for f in super().get_bulk_update_fields() if f in model_fields and f not in ('id', 'create_time')]
+
+    def after_import(self, dataset, result, using_transactions, dry_run, **kwargs):
+        """
+        导入完成后按导入前后的快照差值增量更新资产统计、更新导入资产的搜索索引并补写审计日志(批量写入不触发信号)，
+        并统计导入速度(行/秒)。
         """
-        bussline, created = Bussline.objects.get_or_create(name=row['业务线'])
-        department, created = Department.objects.get_or_create(name=row['部门'], bussline=bussline)
-        supplier, created = Supplier.objects.get_or_create(name=row['供应商'])
-        row['bussline'] = bussline.id
-        row['department'] = department.id
-        row['supplier'] = supplier.id
-        self._validate_and_set_default_values(row)
+        super().after_import(dataset, result, using_transactions, dry_run, **kwargs)
+        if not dry_run and (result.totals[RowResult.IMPORT_TYPE_NEW] or result.totals[RowResult.IMPORT_TYPE_UPDATE]):
+            self.log_imported('sn')
+            asset_ids = self._asset_ids(dataset)
+            AssetStat.apply(getattr(self, '_stat_before', Counter()), AssetStat.snapshot(asset_ids))
+            SearchToken.index('assets', asset_ids)
+        elapsed = time.perf_counter() - getattr(self, '_import_started', time.perf_counter())
+        result.elapsed = elapsed
+        result.rows_per_second = result.total_rows / elapsed if elapsed > 0 else 0
+        logger.info("资产导入完成: %s 行, 耗时 %.2f 秒, %.1f 行/秒",
+                    result.total_rows, elapsed, result.rows_per_second)
 
     @staticmethod
     def _validate_and_set_default_values(row):
         """
-        验证并设置默认值。
-        """
-        row['repair_count'] = 0  # 维修次数默认为0
-
-        price = row.get(_('price'))
-        if isinstance(price, (int, float)) and price >= 0:
-            row['price'] = price
-        else:
-            row['price'] = 0
-
-        asset_type_display = row.get(_('资产类型')) or row.get('asset_type')
-        if asset_type_display:
-            for code, asset_type in Assets.ASSET_TYPE:
-                if asset_type == asset_type_display:
-                    row['asset_type'] = code
-                    break
-            else:
-                raise ValidationError(f"无效的资产类型: {asset_type_display}")
-        else:
-            raise ValidationError(_("资产类型不能为空"))
-
-        status_display = row.get(_('状态')) or row.get('status')
-        if status_display:
-            for code, status in Assets.ASSET_STATUS:
-                if status == status_display:
-                    row['status'] = code
-                    break
-            else:
-                raise ValidationError(f"无效的状态: {status_display}")
-        else:
-            raise ValidationError("状态不能为空")
-
-        is_active_display = row.get(_('是否启用')) or row.get('is_active')
-        is_active_dict = {_('是'): True, _('否'): False}
-        if is_active_display in is_active_dict.keys():
-            row['is_active'] = is_active_dict[is_active_display]
-        else:
-            raise ValidationError(_("是否启用不能为空"))
+        验证并设置默认值，选项名称通过反向字典转换为值；规则与分块导入相同，见 utils.chunked_import.clean_asset_row。
+        """
+        errors = clean_asset_row(row, asset_row_rules())
+        if errors:
+            raise ValidationError(errors)
+
+    @staticmethod
+    def dehydrate_qr_code(assets):
+        """
+        导出二维码图片的访问地址。
+        """
+        return f"{settings.PUBLIC_URL}{assets.qr_code_url()}" if assets.pk else ''
 
     @staticmethod
     def dehydrate_status(assets):
@@ -125,23 +314,46 @@ class AssetsResource(resources.ModelResource):
         return _('是') if assets.is_active else _('否')
 
 
-class RepairRecordResource(resources.ModelResource):
+class _NoDiff:
+    """不生成导入预览的差异HTML"""
+
+    def __init__(self, resource, instance, new):
+        pass
+
+    def compare_with(self, resource, instance, dry_run=False):
+        pass
+
+    def as_html(self):
+        return None
+
+
+class AssetsChunkImportResource(AssetsResource):
+    """
+    分块导入(utils.chunked_import)使用的资产资源类：没有预览页面，不生成每行的差异HTML。
+    未修改的行仍按 skip_unchanged 跳过。
+    """
+
+    def get_diff_class(self):
+        return _NoDiff
+
+
+class RepairRecordResource(AuditedImportMixin, resources.ModelResource):
     id = Field(column_name='ID', attribute='id')
     repair_number = Field(attribute='repair_number', column_name=_('维修单号'))
     asset = Field(attribute='asset', column_name=_('资产SN'),
-                  widget=ForeignKeyWidget(Assets, 'sn'))
+                  widget=CachedForeignKeyWidget(Assets, 'sn'))
     department = Field(attribute='department', column_name=_('部门'),
-                       widget=ForeignKeyWidget(Department, 'name'))
+                       widget=CachedForeignKeyWidget(Department, 'name'))
     applicant = Field(attribute='applicant', column_name=_('申请人'))
     fault_description = Field(attribute='fault_description', column_name=_('故障描述'))
     supplier = Field(attribute='supplier', column_name=_('维修供应商'),
-                     widget=ForeignKeyWidget(Supplier, 'name'))
+                     widget=CachedForeignKeyWidget(Supplier, 'name'))
     spare_part = Field(attribute='spare_part', column_name=_('维修备件'),
-                       widget=ManyToManyWidget(SparePart, separator='|', field='sn'))
+                       widget=CachedManyToManyWidget(SparePart, separator='|', field='sn'))
     repair_start_time = Field(attribute='repair_start_time', column_name=_('维修开始时间'),
                               widget=DateWidget(format='%Y/%m/%d %H:%M:%S'))
     repair_duration = Field(attribute='repair_duration', column_name=_('维修持续周期'))
-    creator = Field(column_name=_('创建人'), attribute='creator', widget=ForeignKeyWidget(User, 'username'))
+    creator = Field(column_name=_('创建人'), attribute='creator', widget=CachedForeignKeyWidget(User, 'username'))
     create_time = Field(column_name=_('创建时间'), attribute='create_time',
                         widget=DateWidget(format='%Y/%m/%d %H:%M:%S'))
     update_time = Field(column_name=_('更新时间'), attribute='update_time',
@@ -153,6 +365,182 @@ class RepairRecordResource(resources.ModelResource):
         report_skipped = False
         import_id_fields = ('repair_number',)
         export_formats = ['xlsx']
+        # 批量导入：已有维修记录按单号一次性加载，新增/修改分批 bulk_create/bulk_update，
+        # 维修备件关联、维修次数和统计在全部写入后按集合处理，不逐行执行 RepairRecord.save() 和信号
+        use_bulk = True
+        batch_size = 1000
+        instance_loader_class = CachedInstanceLoader
+
+    def __init__(self, **kwargs):
+        """列名在实例化时转换为字符串，原因见 AssetsResource.__init__"""
+        super().__init__(**kwargs)
+        for field in self.fields.values():
+            field.column_name = str(field.column_name)
+        self._new_numbers = iter(())
+        self._created = []  # 本次导入新增的维修记录
+        self._links = []  # [(维修记录, 导入的备件ID列表)]
+        self._stat_before = Counter()
+        self._existing_ids = []
+
+    def get_queryset(self):
+        """
+        导入比对时预先关联外键和维修备件(及审计日志显示名称用到的业务线和备件类型)，比较差异时不逐行查询。
+        """
+        return (super().get_queryset().select_related('asset', 'department__bussline', 'supplier', 'creator')
+                .prefetch_related(models.Prefetch('spare_part', SparePart.objects.select_related('type'))))
+
+    def filter_export(self, queryset, *args, **kwargs):
+        """
+        导出时预先关联外键列和维修备件，避免逐行查询。
+        """
+        return (queryset.select_related('asset', 'department', 'supplier', 'creator')
+                .prefetch_related('spare_part'))
+
+    @staticmethod
+    def _in_bulk(queryset, values, field_name, batch_size=1000):
+        """按唯一字段分批 in_bulk，返回 值->实例"""
+        values = list({str(value).strip() for value in values if value not in (None, '')})
+        resolved = {}
+        for i in range(0, len(values), batch_size):
+            resolved.update(queryset.in_bulk(values[i:i + batch_size], field_name=field_name))
+        return resolved
+
+    def before_import(self, dataset, using_transactions, dry_run, **kwargs):
+        """
+        导入前用 in_bulk 一次性解析引用到的资产、部门、供应商、创建人和备件，填充widget缓存；
+        为新增的行一次分配连续的维修单号；记录将被修改的维修记录当前的统计贡献。
+        """
+        columns = {name: field.column_name for name, field in self.fields.items()}
+
+        def column(name):
+            return dataset[columns[name]] if columns[name] in dataset.headers else []
+
+        self.fields['asset'].widget.cache = self._in_bulk(Assets.objects, column('asset'), 'sn')
+        self.fields['department'].widget.cache = self._in_bulk(Department.objects.select_related('bussline'),
+                                                               column('department'), 'name')
+        self.fields['supplier'].widget.cache = self._in_bulk(Supplier.objects, column('supplier'), 'name')
+        self.fields['creator'].widget.cache = self._in_bulk(User.objects, column('creator'), 'username')
+        widget = self.fields['spare_part'].widget
+        widget.cache = self._in_bulk(SparePart.objects.select_related('type'),
+                                     (sn for value in column('spare_part') for sn in widget.split(value)), 'sn')
+
+        numbers = [str(number).strip() if number not in (None, '') else '' for number in column('repair_number')]
+        numbers += [''] * (len(dataset) - len(numbers))
+        existing = self._in_bulk(RepairRecord.objects, numbers, 'repair_number')
+        self._existing_ids = [record.pk for record in existing.values()]
+        # 与 RepairRecord.save() 一致，新增记录都使用新分配的维修单号
+        missing = sum(1 for number in numbers if number not in existing)
+        if missing:
+            self._new_numbers = iter(RepairNumberSequence.allocate(missing))
+        self._stat_before = self._stat_snapshot(self._existing_ids)
+
+    def before_save_instance(self, instance, using_transactions, dry_run):
+        """
+        批量写入不会调用 RepairRecord.save()，这里补上维修单号、维修持续周期和更新时间。
+        """
+        if instance.pk is None:
+            instance.repair_number = next(self._new_numbers)
+            self._created.append(instance)
+        if instance.repair_status in [2, 3, 4] and instance.repair_start_time:
+            instance.repair_duration = timezone.now() - instance.repair_start_time
+        instance.update_time = timezone.now()
+
+    def save_m2m(self, obj, data, using_transactions, dry_run):
+        """
+        批量写入时记录每条维修记录导入的备件，全部写入后用一次 bulk_create 写入关联表。
+        """
+        field = self.fields['spare_part']
+        if field.column_name in data:
+            obj._import_spare_parts = list(field.clean(data))
+            self._links.append((obj, [part.pk for part in obj._import_spare_parts]))
+
+    def after_import_instance(self, instance, new, row_number=None, **kwargs):
+        """
+        导入比对使用的 original 是 deepcopy 得到的，预取的备件查询集复制后没有结果缓存，这里先转为列表保存。
+        """
+        if not new:
+            instance._loaded_spare_parts = list(instance.spare_part.all())
+
+    def skip_row(self, instance, original, row, import_validation_errors=None):
+        """比较维修备件是否变化时使用预取结果，备件在全部写入后才修改，此时 instance 的预取结果即原值"""
+        if original.pk is not None:
+            original._prefetched_objects_cache = instance._prefetched_objects_cache
+        return super().skip_row(instance, original, row, import_validation_errors)
+
+    def get_bulk_update_fields(self):
+        """
+        批量更新时排除主键、创建时间和多对多字段。
+        """
+        model_fields = {field.name for field in self._meta.model._meta.concrete_fields}
+        return [f for f in super().get_bulk_update_fields() if f in model_fields and f not in ('id', 'create_time')]
+
+    def after_import(self, dataset, result, using_transactions, dry_run, **kwargs):
+        """
+        全部写入后按集合处理：写入维修备件关联、补写审计日志(含维修备件的变化)、按资产汇总增加维修次数、
+        按快照差值更新维修统计、更新搜索索引。新增和修改的记录都带有新的修改时间，维修日统计按修改时间增量刷新；
+        维修开始时间改到其他日期的记录，原日期登记为待重新汇总。
+        """
+        super().after_import(dataset, result, using_transactions, dry_run, **kwargs)
+        if dry_run or result.has_errors():
+            return
+        self._resolve_created_ids(self._created, 'repair_number')
+        self._write_links()
+        self.log_imported('repair_number')
+        self._log_link_changes()
+        RepairDailyStat.mark_stale(RepairDailyStat.moved_days(
+            [(original.repair_start_time, record.repair_start_time)
+             for original, record in self._audit_pairs if original is not None]))
+        self._bump_repair_counts()
+        record_ids = self._existing_ids + [record.pk for record in self._created]
+        RepairStat.apply(self._stat_before, self._stat_snapshot(record_ids))
+        SearchToken.index('repair', record_ids)
+
+    def _write_links(self):
+        """先删除被修改的维修记录原有的备件关联，再一次 bulk_create 写入全部关联"""
+        through = RepairRecord.spare_part.through
+        created = set(map(id, self._created))
+        replaced = [record.pk for record, _ in self._links if id(record) not in created]
+        for i in range(0, len(replaced), 1000):
+            through.objects.filter(repairrecord_id__in=replaced[i:i + 1000]).delete()
+        through.objects.bulk_create([through(repairrecord_id=record.pk, sparepart_id=part_id)
+                                     for record, part_ids in self._links for part_id in set(part_ids)],
+                                    batch_size=1000)
+
+    def _log_link_changes(self):
+        """按导入前后的维修备件补写多对多变化的审计日志，新增的记录合并到新增日志中"""
+        for record, _ in self._links:
+            old = getattr(record, '_loaded_spare_parts', [])
+            new = list(dict.fromkeys(record._import_spare_parts))
+            log_m2m_change(record, 'spare_part', 'add', [part for part in new if part not in old])
+            log_m2m_change(record, 'spare_part', 'delete', [part for part in old if part not in new])
+
+    def _bump_repair_counts(self):
+        """新增记录的维修次数按资产汇总，增量相同的资产合并为一条 UPDATE(同时更新修改时间)"""
+        by_delta = {}
+        for asset_id, delta in Counter(record.asset_id for record in self._created).items():
+            by_delta.setdefault(delta, []).append(asset_id)
+        now = timezone.now()
+        for delta, asset_ids in by_delta.items():
+            for i in range(0, len(asset_ids), 1000):
+                Assets.objects.filter(pk__in=asset_ids[i:i + 1000]).update(
+                    repair_count=models.F('repair_count') + delta, update_time=now)
+
+    @staticmethod
+    def _stat_snapshot(record_ids):
+        snapshot = Counter()
+        for i in range(0, len(record_ids), 1000):
+            snapshot.update(RepairStat.snapshot(record_ids[i:i + 1000]))
+        return snapshot
+
+    @staticmethod
+    def dehydrate_spare_part(repair):
+        """
+        维修备件序列号，以|分隔；导入比对时使用本行导入的备件(批量写入前关联表尚未写入)。
+        """
+        parts = getattr(repair, '_import_spare_parts', getattr(repair, '_loaded_spare_parts', None))
+        if parts is None:
+            parts = repair.spare_part.all() if repair.pk else []
+        return '|'.join(part.sn for part in parts)
 
     @staticmethod
     def dehydrate_repair_type(repair):
@@ -0,0 +1,56 @@
+"""
+-*- coding: utf-8 -*-
+ @Author: li
+ @ProjectName: ITAssets
+ @Email: lijianqiao2906@live.com
+ @FileName: search_index.py
+ @DateTime: 2024/4/22 上午9:40
+ @Docs: 搜索索引的分词：中文按相邻两字(bigram)切分，英文数字按连续三个字符(trigram)切分，
+        查询词按同样规则切分后在倒排索引表中按词元匹配，任意子串都能命中且无需LIKE全表扫描
+"""
+import re
+
+# 索引名称 -> (模型, {检索字段: 权重})，检索字段与admin的search_fields一致，权重用于结果排序
+SEARCH_INDEXES = {
+    'assets': ('assets.Assets', {'name': 3, 'sn': 3, 'asset_location': 1}),
+    'repair': ('repair.RepairRecord', {'asset__name': 2, 'fault_description': 1}),
+}
+
+_CJK = '㐀-䶿一-鿿豈-﫿'
+_RUN_RE = re.compile(f'[{_CJK}]+|[0-9a-z]+')
+_CJK_RE = re.compile(f'[{_CJK}]')
+
+
+def _ngrams(run):
+    size = 2 if _CJK_RE.match(run) else 3
+    return [run[i:i + size] for i in range(len(run) - size + 1)]
+
+
+def tokenize(text):
+    """
+    将文本切分为n-gram词元集合，短于n的片段不产生词元。
+    :param text: 文本
+    :return: 词元集合
+    """
+    tokens = set()
+    for run in _RUN_RE.findall(str(text or '').lower()):
+        tokens.update(_ngrams(run))
+    return tokens
+
+
+def query_tokens(term):
+    """
+    切分查询词。任一片段短于n(单个汉字、一两个字母数字)时无法用索引精确匹配，返回None，由调用方回退到普通搜索。
+    :param term: 查询词
+    :return: 词元集合或None
+    """
+    runs = _RUN_RE.findall(str(term or '').lower())
+    if not runs:
+        return None
+    tokens = set()
+    for run in runs:
+        grams = _ngrams(run)
+        if not grams:
+            return None
+        tokens.update(grams)
+    return tokens
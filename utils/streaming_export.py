@@ -0,0 +1,104 @@
+"""
+-*- coding: utf-8 -*-
+ @Author: li
+ @ProjectName: ITAssets
+ @Email: lijianqiao2906@live.com
+ @FileName: streaming_export.py
+ @DateTime: 2024/4/19 下午4:15
+ @Docs: 流式导出, 分块读取查询集逐行写出, 内存占用与导出行数无关。
+        只有csv边查询边发送；xlsx(zip格式)需要先完整写入磁盘临时文件才能开始发送，
+        导出行数很多时响应开始前要等待整个文件生成，代理超时时间较短时应使用csv
+"""
+import csv
+import tempfile
+
+from django.http import FileResponse, StreamingHttpResponse
+from django.utils.encoding import force_str
+from django.utils.functional import Promise
+from openpyxl import Workbook
+from openpyxl.cell.cell import ILLEGAL_CHARACTERS_RE
+
+# 每次从数据库读取的行数
+EXPORT_CHUNK_SIZE = 2000
+# 支持流式导出的格式
+STREAMING_EXPORT_FORMATS = ('csv', 'xlsx')
+
+
+class _Echo:
+    """csv.writer 的写入目标，直接返回写入的内容"""
+
+    def write(self, value):
+        return value
+
+
+def iter_export_rows(resource, queryset, chunk_size=EXPORT_CHUNK_SIZE):
+    """
+    按主键分块读取查询集，逐行生成导出数据。
+    每块单独查询(含 select_related/prefetch_related)，不依赖数据库的服务端游标。
+    :param resource: django-import-export 资源实例
+    :param queryset: 要导出的查询集
+    :param chunk_size: 每块行数
+    """
+    queryset = resource.filter_export(queryset).order_by('pk')
+    last_pk = None
+    while True:
+        chunk = queryset if last_pk is None else queryset.filter(pk__gt=last_pk)
+        objs = list(chunk[:chunk_size])
+        if not objs:
+            break
+        for obj in objs:
+            yield resource.export_resource(obj)
+        last_pk = objs[-1].pk
+
+
+def _clean_value(value):
+    if isinstance(value, Promise):
+        value = force_str(value)
+    if isinstance(value, str):
+        value = ILLEGAL_CHARACTERS_RE.sub('', value)
+    return value
+
+
+def stream_csv(resource, queryset):
+    """
+    生成CSV内容，边查询边输出。
+    """
+    writer = csv.writer(_Echo())
+    # 带BOM，方便Excel正确识别中文
+    yield '\ufeff' + writer.writerow(resource.get_export_headers())
+    for row in iter_export_rows(resource, queryset):
+        yield writer.writerow([force_str(value) if isinstance(value, Promise) else value for value in row])
+
+
+def write_xlsx(resource, queryset, file):
+    """
+    使用openpyxl只写模式逐行写入xlsx，行数据先写入磁盘临时文件，不在内存中保留整个工作簿。
+    """
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet()
+    sheet.append(resource.get_export_headers())
+    for row in iter_export_rows(resource, queryset):
+        sheet.append([_clean_value(value) for value in row])
+    workbook.save(file)
+
+
+def streaming_export_response(resource, queryset, file_format, filename):
+    """
+    生成流式导出的响应。
+    :param resource: django-import-export 资源实例
+    :param queryset: 要导出的查询集
+    :param file_format: 导出格式，csv 或 xlsx
+    :param filename: 下载文件名
+    :return: csv为边生成边发送的 StreamingHttpResponse；xlsx为写完临时文件后分块发送的 FileResponse
+    """
+    if file_format == 'csv':
+        response = StreamingHttpResponse(stream_csv(resource, queryset), content_type='text/csv; charset=utf-8')
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        return response
+
+    # xlsx是zip格式，需要写完才能生成目录，先写入临时文件再分块发送，文件关闭后自动删除
+    file = tempfile.TemporaryFile()
+    write_xlsx(resource, queryset, file)
+    file.seek(0)
+    return FileResponse(file, as_attachment=True, filename=filename,
+                        content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
@@ -7,10 +7,23 @@
  @DateTime: 2024/4/8 下午2:07
  @Docs: 
 """
+import hashlib
+import time
+from collections import defaultdict
 
-from pyecharts.charts import Sunburst
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import quote_etag
+from pyecharts.charts import Line, Sunburst
 from pyecharts import options as opts
 
+# 渲染结果缓存时间(秒)，数据变化时由版本号使缓存失效
+CHART_CACHE_TIMEOUT = 24 * 3600
+
+# 本进程的图表缓存统计：{图表类型: {'hits', 'misses', 'not_modified', 'render_count', 'render_seconds'}}
+_chart_cache_stats = defaultdict(lambda: defaultdict(float))
+
 
 def generate_sunburst_chart(data, title):
     """
@@ -34,3 +47,90 @@ def generate_sunburst_chart(data, title):
     chart = sunburst.render_embed()
 
     return chart
+
+
+def generate_line_chart(x_data, series, title):
+    """
+    生成折线图(时间序列)的通用函数。
+
+    参数:
+    - x_data: 横轴数据，如每周的开始日期。
+    - series: [(系列名称, 与横轴对应的数值列表)]。
+    - title: 折线图的标题。
+
+    返回值:
+    - 折线图的HTML代码。
+    """
+    line = Line().add_xaxis(x_data)
+    for name, values in series:
+        line.add_yaxis(series_name=name, y_axis=values, is_smooth=True,
+                       label_opts=opts.LabelOpts(is_show=False))
+    line.set_global_opts(title_opts=opts.TitleOpts(title=title),
+                         tooltip_opts=opts.TooltipOpts(trigger='axis'),
+                         legend_opts=opts.LegendOpts(type_='scroll', pos_top='8%'),
+                         toolbox_opts=opts.ToolboxOpts(is_show=True))
+    return line.render_embed()
+
+
+def cached_chart_response(request, kind, scope, version, render):
+    """
+    带缓存的图表响应：按 图表类型+权限范围+数据版本 缓存渲染后的HTML，ETag匹配时直接返回304。
+
+    参数:
+    - request: HttpRequest对象。
+    - kind: 图表类型，如 asset_chart、department_to_spare。
+    - scope: 用户的数据权限范围，如 all、dept:3。
+    - version: 图表所用数据的版本号，数据变化时递增。
+    - render: 无参函数，缓存未命中时调用，返回图表HTML代码。
+
+    返回值:
+    - HttpResponse对象。
+    """
+    stats = _chart_cache_stats[kind]
+    key = f"sunburst:{kind}:{scope}:{version}"
+    etag = quote_etag(hashlib.sha256(key.encode()).hexdigest()[:32])
+
+    response = get_conditional_response(request, etag=etag)
+    if response is not None:
+        stats['not_modified'] += 1
+    else:
+        chart = cache.get(key)
+        if chart is None:
+            stats['misses'] += 1
+            start = time.perf_counter()
+            chart = render()
+            elapsed = time.perf_counter() - start
+            stats['render_count'] += 1
+            stats['render_seconds'] += elapsed
+            cache.set(key, chart, CHART_CACHE_TIMEOUT)
+            timing = f'chart;desc="miss";dur={elapsed * 1000:.1f}'
+        else:
+            stats['hits'] += 1
+            timing = 'chart;desc="hit"'
+        response = HttpResponse(chart)
+        response['ETag'] = etag
+        response['Server-Timing'] = timing
+    # 内容随用户权限不同而不同，只允许浏览器缓存，且每次都需要用ETag验证
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+
+def chart_cache_stats():
+    """
+    本进程的图表缓存统计。
+
+    返回值:
+    - {图表类型: {hits, misses, not_modified, hit_ratio, avg_render_ms}}
+    """
+    result = {}
+    for kind, stats in _chart_cache_stats.items():
+        served = stats['hits'] + stats['misses'] + stats['not_modified']
+        result[kind] = {
+            'hits': int(stats['hits']),
+            'misses': int(stats['misses']),
+            'not_modified': int(stats['not_modified']),
+            'hit_ratio': round((stats['hits'] + stats['not_modified']) / served, 4) if served else 0,
+            'avg_render_ms': round(stats['render_seconds'] * 1000 / stats['render_count'], 2)
+            if stats['render_count'] else 0,
+        }
+    return result
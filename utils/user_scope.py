@@ -0,0 +1,101 @@
+"""
+-*- coding: utf-8 -*-
+ @Author: li
+ @ProjectName: ITAssets
+ @Email: lijianqiao2906@live.com
+ @FileName: user_scope.py
+ @DateTime: 2024/4/18 上午11:02
+ @Docs: 用户数据权限范围(是否超级用户、管理的部门), 每个请求只计算一次
+"""
+from dataclasses import dataclass, field
+
+from django.conf import settings
+from django.core.cache import cache
+
+from assets.models import Assetsmanager
+
+# 权限范围缓存代数，资产管理员变化时递增，使所有已缓存的权限范围失效
+SCOPE_GENERATION_KEY = 'user_scope:generation'
+
+
+@dataclass(frozen=True)
+class UserScope:
+    """用户数据权限范围"""
+    is_superuser: bool = False
+    is_manager: bool = False  # 是否为资产管理员
+    department_ids: frozenset = field(default_factory=frozenset)  # 管理的部门ID集合
+
+    def can_access(self, department_id):
+        """
+        判断是否有权访问指定部门的数据。
+        :param department_id: 部门ID
+        :return: 布尔值
+        """
+        return self.is_superuser or department_id in self.department_ids
+
+    def filter(self, queryset, field_name='department'):
+        """
+        按权限范围过滤查询集，直接比较部门外键列，不产生联表。
+        :param queryset: 查询集
+        :param field_name: 部门字段名，None 表示该模型不按部门划分(仅超级用户可见)
+        :return: 过滤后的查询集
+        """
+        if self.is_superuser:
+            return queryset
+        if field_name is None:
+            return queryset.none()
+        return queryset.filter(**{f'{field_name}__in': self.department_ids})
+
+    @property
+    def cache_key(self):
+        """用于缓存键的权限范围标识"""
+        if self.is_superuser:
+            return 'all'
+        return 'dept:' + ','.join(str(pk) for pk in sorted(self.department_ids))
+
+
+def _cache_key(user_id):
+    generation = cache.get_or_set(SCOPE_GENERATION_KEY, 0, None)
+    return f'user_scope:{generation}:{user_id}'
+
+
+def _load_user_scope(user):
+    if not user.is_authenticated:
+        return UserScope()
+    if user.is_superuser:
+        return UserScope(is_superuser=True)
+
+    timeout = getattr(settings, 'USER_SCOPE_CACHE_TIMEOUT', 0)
+    key = _cache_key(user.pk) if timeout else None
+    if key:
+        scope = cache.get(key)
+        if scope is not None:
+            return scope
+
+    department_ids = list(Assetsmanager.objects.filter(user=user).values_list('department_id', flat=True))
+    scope = UserScope(is_manager=bool(department_ids),
+                      department_ids=frozenset(pk for pk in department_ids if pk is not None))
+    if key:
+        cache.set(key, scope, timeout)
+    return scope
+
+
+def get_user_scope(request):
+    """
+    获取当前请求用户的数据权限范围，同一个请求内只计算一次。
+    设置 USER_SCOPE_CACHE_TIMEOUT(秒) 后还会跨请求缓存，多进程部署时需要配置共享缓存(如Redis)。
+    :param request: HttpRequest对象
+    :return: UserScope
+    """
+    scope = getattr(request, '_user_scope', None)
+    if scope is None:
+        scope = request._user_scope = _load_user_scope(request.user)
+    return scope
+
+
+def invalidate_user_scopes():
+    """使所有已缓存的用户权限范围失效"""
+    try:
+        cache.incr(SCOPE_GENERATION_KEY)
+    except ValueError:
+        cache.set(SCOPE_GENERATION_KEY, 1, None)
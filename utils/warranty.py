@@ -0,0 +1,65 @@
+"""
+-*- coding: utf-8 -*-
+ @Author: li
+ @ProjectName: ITAssets
+ @Email: lijianqiao2906@live.com
+ @FileName: warranty.py
+ @DateTime: 2024/4/30 上午9:30
+ @Docs: 过保日期：由起始日期加保修月数得出并保存在 warranty_end 字段(有索引)，
+        "即将过保/已过保"的过滤和报表都是 warranty_end 上的一次范围查询
+"""
+import calendar
+from datetime import date, timedelta
+
+from django.contrib import admin
+from django.utils.translation import gettext_lazy as _
+
+# 过滤器和报表中"N天内过保"的可选天数
+WARRANTY_FILTER_DAYS = (30, 90, 180)
+
+
+def add_months(start, months):
+    """
+    日期加月数，目标月份没有对应日期时取该月最后一天(如 1月31日 加1个月为 2月28/29日)。
+    :param start: 起始日期
+    :param months: 月数
+    :return: 日期
+    """
+    month = start.month - 1 + months
+    year, month = start.year + month // 12, month % 12 + 1
+    return date(year, month, min(start.day, calendar.monthrange(year, month)[1]))
+
+
+def warranty_end(start, months):
+    """过保日期，起始日期或月数为空时为None"""
+    if start is None or months is None:
+        return None
+    return add_months(start, months)
+
+
+def expiring_filter(days, today=None):
+    """
+    过滤条件：days 为正数时是 days 天内(含今天)过保，为 None 时是已过保。
+    :return: 可直接传给 filter() 的关键字参数
+    """
+    today = today or date.today()
+    if days is None:
+        return {'warranty_end__lt': today}
+    return {'warranty_end__gte': today, 'warranty_end__lt': today + timedelta(days=days)}
+
+
+class WarrantyListFilter(admin.SimpleListFilter):
+    """列表页过滤器：已过保、N天内过保，按 warranty_end 范围查询"""
+    title = _('过保情况')
+    parameter_name = 'warranty'
+
+    def lookups(self, request, model_admin):
+        return [('expired', _('已过保'))] + [(str(days), _('{}天内过保').format(days)) for days in WARRANTY_FILTER_DAYS]
+
+    def queryset(self, request, queryset):
+        value = self.value()
+        if value == 'expired':
+            return queryset.filter(**expiring_filter(None))
+        if value and value.isdigit():
+            return queryset.filter(**expiring_filter(int(value)))
+        return queryset